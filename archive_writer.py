@@ -0,0 +1,163 @@
+"""Write rendered invoices into a single ZIP or tar archive.
+
+Every invoice becomes the member "{invoice_number}.pdf". When the archive
+is closed a manifest of the run is added as "manifest/{run}.jsonl", one
+JSON line per invoice with its number, client, totals in cents, size,
+SHA-256 and the key of the input record it came from. Opening an existing
+archive with append=True adds a new run, e.g. a rerun of the invoices that
+failed; each run gets its own manifest, and existing_keys() tells which
+records are archived already, numbered or not.
+
+Members are written one after another as they are added, so only the
+invoice being written is held in memory.
+"""
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+import zipfile
+
+MANIFEST_DIR = "manifest/"
+
+ARCHIVE_FORMATS = {
+    ".zip": "zip",
+    ".tar": "tar",
+    ".tar.gz": "tar:gz",
+    ".tgz": "tar:gz",
+    ".tar.xz": "tar:xz",
+}
+
+
+def archive_format(path):
+    """Return the archive format of `path` from its extension."""
+    name = path.lower()
+    for extension, archive_type in ARCHIVE_FORMATS.items():
+        if name.endswith(extension):
+            return archive_type
+    raise ValueError(f"Unsupported archive type: {path} (use one of {', '.join(ARCHIVE_FORMATS)})")
+
+
+def manifest_entry(invoice, name, data, include_vat=False, key=None):
+    """Manifest line of one archived invoice, rendered with or without VAT
+    like its PDF; `key` identifies its input record, see
+    batch_renderer.record_key()."""
+    net_cents, vat_cents = invoice.totals_cents()
+    if not include_vat:
+        vat_cents = 0
+    entry = {
+        "invoice_number": invoice.invoice_number,
+        "client": invoice.client_info.get("company_name", ""),
+        "client_vat_number": invoice.client_info.get("vat_number"),
+        "issue_date": str(invoice.issue_date),
+        "net_cents": net_cents,
+        "vat_cents": vat_cents,
+        "gross_cents": net_cents + vat_cents,
+        "file": name,
+        "size": len(data),
+        "sha256": hashlib.sha256(data).hexdigest(),
+    }
+    if key is not None:
+        entry["source_key"] = key
+    return entry
+
+
+class InvoiceArchive:
+    """Sink writing invoice PDFs into one ZIP or tar archive.
+
+    Use as a context manager, the manifest is written on close. With
+    append=True an existing archive is extended, which compressed tar
+    files do not support. add() refuses an invoice number that is
+    already in the archive.
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.format = archive_format(path)
+        if append and self.format.startswith("tar:"):
+            raise ValueError(f"Cannot append to a compressed tar archive: {path}")
+        self.manifest = []
+        self._mtime = time.time()
+        exists = append and os.path.exists(path)
+        self._keys = {entry["source_key"] for entry in read_manifest(path) if "source_key" in entry} \
+            if exists else set()
+        if self.format == "zip":
+            self._archive = zipfile.ZipFile(path, "a" if append else "w")
+            names = self._archive.namelist()
+        else:
+            mode = "a" if append else "w" + self.format[3:]
+            self._archive = tarfile.open(path, mode)
+            names = self._archive.getnames() if exists else []
+        self._names = set(names)
+        runs = [name for name in names if name.startswith(MANIFEST_DIR)]
+        self.run = f"{len(runs) + 1:04d}"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def existing_numbers(self):
+        """Invoice numbers already in the archive, from earlier runs too."""
+        return {name[:-4] for name in self._names
+                if name.endswith(".pdf") and not name.startswith(MANIFEST_DIR)}
+
+    def existing_keys(self):
+        """Source keys of the invoices already in the archive."""
+        return set(self._keys)
+
+    def _write(self, name, data):
+        if self.format == "zip":
+            info = zipfile.ZipInfo(name, time.localtime(self._mtime)[:6])
+            # The PDF streams are compressed already
+            info.compress_type = zipfile.ZIP_STORED if name.endswith(".pdf") else zipfile.ZIP_DEFLATED
+            self._archive.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = self._mtime
+            self._archive.addfile(info, io.BytesIO(data))
+        self._names.add(name)
+
+    def add(self, invoice, data, include_vat=False, key=None):
+        """Write the PDF bytes of an invoice and return its member name.
+        `include_vat` is the option it was rendered with, `key` is
+        recorded in the manifest as the invoice's source key."""
+        name = f"{invoice.invoice_number}.pdf"
+        if name in self._names:
+            raise ValueError(f"Invoice {invoice.invoice_number} is already in {self.path}")
+        self._write(name, data)
+        self.manifest.append(manifest_entry(invoice, name, data, include_vat, key))
+        if key is not None:
+            self._keys.add(key)
+        return name
+
+    def close(self):
+        """Write the manifest of this run and close the archive."""
+        if self._archive is None:
+            return
+        try:
+            if self.manifest:
+                lines = "".join(json.dumps(entry) + "\n" for entry in self.manifest)
+                self._write(f"{MANIFEST_DIR}{self.run}.jsonl", lines.encode("utf-8"))
+        finally:
+            self._archive.close()
+            self._archive = None
+
+
+def read_manifest(path):
+    """Return the manifest entries of all runs of an archive, in run order."""
+    entries = []
+    if archive_format(path) == "zip":
+        with zipfile.ZipFile(path) as archive:
+            for name in sorted(n for n in archive.namelist() if n.startswith(MANIFEST_DIR)):
+                entries.extend(json.loads(line) for line in archive.read(name).splitlines() if line)
+    else:
+        with tarfile.open(path) as archive:
+            for member in sorted((m for m in archive if m.name.startswith(MANIFEST_DIR)),
+                                 key=lambda m: m.name):
+                data = archive.extractfile(member).read()
+                entries.extend(json.loads(line) for line in data.splitlines() if line)
+    return entries
@@ -0,0 +1,164 @@
+"""Crash safe file writes.
+
+A file is written to a temporary file next to it, flushed and fsynced,
+and renamed over the final path, then the directory is fsynced so the
+rename itself survives a power loss. Readers see either the old or the
+new contents, never a truncated file, and a failed write leaves the old
+file untouched.
+
+    with atomic_write("invoice_metadata.json", "w") as f:
+        json.dump(data, f)
+
+Fsyncing the directory after every file dominates when a batch writes
+thousands of small PDFs. A GroupCommit defers it: the data of each file
+is still fsynced before its rename, but the directories are fsynced
+once per `every` files and when the group is committed, so a file is
+durable once its group commits.
+
+    with GroupCommit() as group:
+        for job in jobs:
+            with atomic_write(path, group=group) as f:
+                ...
+
+sync=False keeps the atomic rename but skips all fsyncs, for files that
+can be rebuilt, like cache entries and metrics.
+"""
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import instrumentation
+
+GROUP_SIZE = 64  # files per directory fsync of a GroupCommit
+
+# New files get the permissions open() would give them, not mkstemp's 0600
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+
+def fsync_directory(directory):
+    """Make renames and removals in `directory` durable. No-op on Windows,
+    where directories cannot be opened and NTFS journals the rename."""
+    if os.name == "nt":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        with instrumentation.span("io.fsync_dir"):
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class GroupCommit:
+    """Collects the directories of atomic writes and fsyncs them together,
+    every `every` files and on commit(). Thread safe; use as a context
+    manager, which commits on exit."""
+
+    def __init__(self, every=GROUP_SIZE):
+        self.every = every
+        self._lock = threading.Lock()
+        self._directories = set()
+        self._pending = 0
+
+    def add(self, directory):
+        """Note a file renamed into `directory`."""
+        with self._lock:
+            self._directories.add(directory)
+            self._pending += 1
+            if self._pending >= self.every:
+                self._commit()
+
+    def commit(self):
+        """Fsync the directories of all files added since the last commit."""
+        with self._lock:
+            self._commit()
+
+    def _commit(self):
+        for directory in self._directories:
+            fsync_directory(directory)
+        instrumentation.count("io.group_commits")
+        self._directories.clear()
+        self._pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Files renamed before a failure are kept, make them durable too
+        self.commit()
+
+
+class AtomicFile:
+    """A temporary file that replaces `path` on commit().
+
+    `file` is the open file object; mode and encoding are as for open(),
+    write modes only. discard() removes the temporary file and leaves
+    `path` as it was. See atomic_write() for the context manager.
+    """
+
+    def __init__(self, path, mode="wb", encoding=None, sync=True, group=None):
+        if "r" in mode or "a" in mode or "+" in mode:
+            raise ValueError(f"AtomicFile only writes whole files, not mode {mode!r}")
+        self.path = path
+        self.sync = sync
+        self.group = group
+        self.directory = os.path.dirname(os.path.abspath(path))
+        fd, self._tmp_path = tempfile.mkstemp(prefix="." + os.path.basename(path) + ".", suffix=".tmp",
+                                              dir=self.directory)
+        try:
+            if hasattr(os, "fchmod"):
+                os.fchmod(fd, FILE_MODE)
+            self.file = os.fdopen(fd, mode, encoding=encoding)
+        except BaseException:
+            os.close(fd)
+            os.unlink(self._tmp_path)
+            raise
+
+    def commit(self):
+        """Flush, fsync and rename the file into place."""
+        try:
+            self.file.flush()
+            if self.sync:
+                with instrumentation.span("io.fsync"):
+                    os.fsync(self.file.fileno())
+            self.file.close()
+            os.replace(self._tmp_path, self.path)
+        except BaseException:
+            self.discard()
+            raise
+        if not self.sync:
+            return
+        if self.group is not None:
+            self.group.add(self.directory)
+        else:
+            fsync_directory(self.directory)
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.unlink(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def atomic_write(path, mode="wb", encoding=None, sync=True, group=None):
+    """Open `path` for writing as an AtomicFile; the file replaces `path`
+    when the block ends and is discarded if it raises."""
+    atomic = AtomicFile(path, mode, encoding, sync, group)
+    try:
+        yield atomic.file
+    except BaseException:
+        atomic.discard()
+        raise
+    atomic.commit()
+
+
+def write_atomic(path, data, sync=True, group=None):
+    """Replace `path` with `data`, bytes or str (written as UTF-8)."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    with atomic_write(path, "wb", sync=sync, group=group) as f:
+        f.write(data)
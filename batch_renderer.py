@@ -0,0 +1,606 @@
+"""Headless batch rendering of invoices.
+
+Invoice definitions are read from a JSONL or CSV file, turned into
+Invoice/InvoiceItem objects and rendered with the generators from
+invoice_generator.py on a process pool.
+
+JSONL: one invoice per line, e.g.
+  {"invoice_number": "2025-001", "issue_date": "2025-01-31", "due_date": "2025-02-15",
+   "language": "Slovene", "include_vat": true, "include_note": false,
+   "contractor_info": {...}, "client_info": {...},
+   "items": [{"description": "Consulting", "unit_price": 50.0, "quantity": 8, "vat_rate": 22.0}]}
+
+CSV: one item per row. Consecutive rows with the same "invoice_ref" (or
+"invoice_number" when there is no ref column) form one invoice. Contractor
+and client fields use the "contractor_" and "client_" prefixes, e.g.
+"contractor_company_name" or "client_vat_number".
+
+Missing invoice numbers are allocated from invoice_metadata before the
+pool is started, missing dates default to today and today + 15 days.
+Numbers of invoices that fail to render are given back when nothing was
+allocated after them.
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+import instrumentation
+from atomic_io import GroupCommit, atomic_write
+from invoice_model import Invoice, InvoiceItem, ItemBatch
+from invoice_metadata import allocate_invoice_numbers, release_invoice_numbers
+from invoice_generator import (
+    DEFAULT_PROFILE, OUTPUT_PROFILES, register_fonts, render_invoice, render_statement, write_invoice_file
+)
+from archive_writer import InvoiceArchive
+from einvoice_export import FORMATS as EINVOICE_FORMATS, EInvoiceExport, export_format, write_sidecar
+from invoice_ledger import LEDGER_FILE, InvoiceLedger, LedgerWriter
+from render_cache import DEFAULT_MAX_BYTES, RenderCache
+
+DEFAULT_DUE_DAYS = 15
+MAX_CHUNK_SIZE = 32
+
+
+class BatchJob:
+    """One invoice to render together with its rendering options."""
+
+    def __init__(self, invoice, language="English", include_vat=False, include_note=False,
+                 source=None, error=None, key=None):
+        self.invoice = invoice
+        self.language = language
+        self.include_vat = include_vat
+        self.include_note = include_note
+        self.source = source  # e.g. "invoices.jsonl:12", used to report bad records
+        self.error = error    # set when the record could not be parsed
+        self.key = key        # record_key() of the input record
+
+
+class BatchResult:
+    """Outcome of rendering one BatchJob."""
+
+    def __init__(self, invoice_number, path=None, error=None, report=None):
+        self.invoice_number = invoice_number
+        self.path = path
+        self.error = error
+        self.report = report  # RenderReport of a successful render
+        self.pdf = None       # PDF bytes while on the way to an archive
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "yes", "y")
+
+
+def _parse_date(value, default):
+    if not value:
+        return default
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value).strip(), "%Y-%m-%d").date()
+
+
+def _parse_quantity(value):
+    """Whole number quantity; "3" and "3.0" are accepted, "1.5" is not."""
+    try:
+        quantity = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f"quantity {value!r} is not a number") from None
+    if not quantity.is_finite() or quantity != quantity.to_integral_value():
+        raise ValueError(f"quantity {value!r} is not a whole number")
+    return int(quantity)
+
+
+def item_from_record(record):
+    return InvoiceItem(
+        description=str(record["description"]),
+        unit_price=float(record["unit_price"]),
+        quantity=_parse_quantity(record["quantity"]),
+        vat_rate=float(record.get("vat_rate") or 0.0)
+    )
+
+
+def _items_from_records(records):
+    # Columnar storage keeps large usage based invoices compact in memory
+    # and cheap to send to the workers.
+    items = ItemBatch()
+    for position, record in enumerate(records, start=1):
+        try:
+            items.append(
+                str(record["description"]),
+                float(record["unit_price"]),
+                _parse_quantity(record["quantity"]),
+                float(record.get("vat_rate") or 0.0)
+            )
+        except KeyError as e:
+            raise ValueError(f"item {position} has no {e.args[0]!r} field") from None
+        except ValueError as e:
+            raise ValueError(f"item {position}: {e}") from None
+    return items
+
+
+def record_key(record):
+    """Hash of an input record without its invoice number.
+
+    Identifies the same record across runs, also when its number is
+    allocated by the run, so an archive rerun can skip what it holds.
+    """
+    content = {name: value for name, value in record.items() if name != "invoice_number"}
+    text = json.dumps(content, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def job_from_record(record):
+    """Build a BatchJob from a JSON-style invoice record."""
+    issue_date = _parse_date(record.get("issue_date"), datetime.now().date())
+    due_date = _parse_date(record.get("due_date"), issue_date + timedelta(days=DEFAULT_DUE_DAYS))
+    invoice = Invoice(
+        invoice_number=record.get("invoice_number") or None,
+        issue_date=issue_date,
+        due_date=due_date,
+        contractor_info=dict(record.get("contractor_info", {})),
+        client_info=dict(record.get("client_info", {})),
+        items=_items_from_records(record.get("items", []))
+    )
+    return BatchJob(
+        invoice,
+        language=record.get("language") or "English",
+        include_vat=_parse_bool(record.get("include_vat", False)),
+        include_note=_parse_bool(record.get("include_note", False)),
+        key=record_key(record)
+    )
+
+
+def _parse_record(parse, record, source):
+    try:
+        job = job_from_record(parse(record))
+    except Exception:
+        return BatchJob(None, source=source, error=traceback.format_exc())
+    job.source = source
+    return job
+
+
+def read_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if line:
+                yield _parse_record(json.loads, line, f"{path}:{line_number}")
+
+
+def _record_from_csv_rows(rows):
+    first = rows[0]
+    record = {
+        "invoice_number": first.get("invoice_number"),
+        "issue_date": first.get("issue_date"),
+        "due_date": first.get("due_date"),
+        "language": first.get("language"),
+        "include_vat": first.get("include_vat", False),
+        "include_note": first.get("include_note", False),
+        "contractor_info": {},
+        "client_info": {},
+        "items": []
+    }
+    for key, value in first.items():
+        if key.startswith("contractor_"):
+            record["contractor_info"][key[len("contractor_"):]] = value or ""
+        elif key.startswith("client_"):
+            record["client_info"][key[len("client_"):]] = value or ""
+    for row in rows:
+        if row.get("description"):
+            record["items"].append(row)
+    return record
+
+
+def read_csv(path):
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        group_key = "invoice_ref" if "invoice_ref" in (reader.fieldnames or []) else "invoice_number"
+        rows = []
+        for row in reader:
+            if rows and row.get(group_key) != rows[0].get(group_key):
+                yield _parse_record(_record_from_csv_rows, rows, f"{path}:{reader.line_num - 1}")
+                rows = []
+            rows.append(row)
+        if rows:
+            yield _parse_record(_record_from_csv_rows, rows, f"{path}:{reader.line_num}")
+
+
+def read_jobs(path):
+    """Read BatchJobs from a .csv or .jsonl file."""
+    if path.lower().endswith(".csv"):
+        return read_csv(path)
+    return read_jsonl(path)
+
+
+def assign_invoice_numbers(jobs):
+    """Allocate numbers for jobs that do not carry one, in input order.
+
+    All numbers are reserved as one block, so the metadata file is
+    locked and written once per batch rather than once per invoice.
+    """
+    missing = [job for job in jobs if not job.invoice.invoice_number]
+    if missing:
+        for job, number in zip(missing, allocate_invoice_numbers(len(missing))):
+            job.invoice.invoice_number = number
+    return jobs
+
+
+def _release_failed_numbers(allocated, results):
+    """Give back the numbers allocated by this run whose invoices failed.
+
+    `allocated` lists the numbers in allocation order. Only a failed tail
+    can return to the sequence, a failed number followed by a rendered
+    one stays a gap.
+    """
+    failed = {result.invoice_number for result in results if not result.ok}
+    tail = len(allocated)
+    while tail and allocated[tail - 1] in failed:
+        tail -= 1
+    if tail < len(allocated):
+        release_invoice_numbers(allocated[tail:])
+
+
+def render_job(job, output_dir=".", profile=DEFAULT_PROFILE, cache=None, sidecar=None, group=None):
+    """Render a single job, returning a BatchResult instead of raising.
+
+    With output_dir None the PDF is not written but kept in result.pdf.
+    `cache` is an optional render_cache.RenderCache. With `sidecar` set to
+    "xml" or "json" an e-invoice copy is written next to the PDF file.
+    Files are written atomically; `group` is an optional
+    atomic_io.GroupCommit that defers their directory fsyncs.
+    """
+    number = job.invoice.invoice_number
+    try:
+        if output_dir is None:
+            buffer = io.BytesIO()
+            report = render_invoice(job.invoice, buffer, job.language, job.include_vat, job.include_note,
+                                    profile=profile, cache=cache)
+            result = BatchResult(number, report=report)
+            result.pdf = buffer.getvalue()
+            return result
+        output_path = os.path.join(output_dir, f"{number}.pdf")
+        report = write_invoice_file(job.invoice, job.language, job.include_vat, job.include_note,
+                                    output_path=output_path, profile=profile, cache=cache, group=group)
+        if sidecar:
+            write_sidecar(job.invoice, output_path, sidecar, job.language, job.include_vat, job.include_note,
+                          group)
+        return BatchResult(number, path=output_path, report=report)
+    except Exception:
+        return BatchResult(number, error=traceback.format_exc())
+
+
+def init_worker(instrumentation_config):
+    """Initializer of render worker processes, see instrumentation.config()."""
+    register_fonts()
+    # Forked workers start with a copy of the parent's data, drop it so
+    # nothing is merged twice.
+    instrumentation.reset()
+    instrumentation.configure(instrumentation_config)
+
+
+def _render_chunk(jobs, output_dir, profile, cache, sidecar):
+    """Render jobs in a worker, returning the results and the worker's
+    instrumentation data (None when it is disabled). The files of a chunk
+    are durable once it returns: their directory is fsynced once per
+    GROUP_SIZE files instead of once per file."""
+    with GroupCommit() as group:
+        results = [render_job(job, output_dir, profile, cache, sidecar, group) for job in jobs]
+    return results, instrumentation.snapshot(clear=True) if instrumentation.enabled else None
+
+
+def _chunked(jobs, size):
+    for start in range(0, len(jobs), size):
+        yield jobs[start:start + size]
+
+
+def _split_invalid(jobs):
+    """Return (results for the unparsable jobs, valid jobs)."""
+    results = []
+    valid_jobs = []
+    for job in jobs:
+        if job.error:
+            results.append(BatchResult(job.source, error=job.error))
+        else:
+            valid_jobs.append(job)
+    return results, valid_jobs
+
+
+def _archive_results(archive, jobs, results):
+    """Move the PDFs of a rendered chunk into the archive."""
+    for job, result in zip(jobs, results):
+        if result.pdf is None:
+            continue
+        try:
+            result.path = archive.add(job.invoice, result.pdf, job.include_vat, job.key)
+        except Exception:
+            result.error = traceback.format_exc()
+        result.pdf = None
+
+
+def _record_results(ledger_writer, jobs, results, archive=None):
+    """Add the rendered invoices of a chunk to the ledger; archived ones
+    are recorded as "{archive path}/{member}"."""
+    for job, result in zip(jobs, results):
+        if not result.ok:
+            continue
+        path = result.path
+        if archive is not None:
+            path = os.path.join(os.path.abspath(archive.path), path)
+        ledger_writer.add(job.invoice, job.language, job.include_vat, job.include_note, path)
+
+
+def _export_results(export, jobs, results):
+    """Add the rendered invoices of a chunk to a combined e-invoice export."""
+    for job, result in zip(jobs, results):
+        if result.ok:
+            export.add(job.invoice, job.language, job.include_vat, job.include_note)
+
+
+def render_batch(jobs, output_dir=".", workers=None, progress=None, profile=DEFAULT_PROFILE, archive=None,
+                 cache=None, ledger=None, sidecar=None, export=None):
+    """Render jobs on a process pool and return a list of BatchResults.
+
+    A failing invoice never aborts the batch, its traceback ends up in
+    BatchResult.error. progress(done, total, result) is called in the
+    parent process after every rendered invoice. `profile` is one of
+    invoice_generator.OUTPUT_PROFILES.
+
+    With an `archive` (an archive_writer.InvoiceArchive) the workers
+    return the PDFs instead of writing files, and this process writes
+    them into the archive as chunks complete; BatchResult.path is then
+    the member name. output_dir is not used.
+
+    With a `cache` (a render_cache.RenderCache) invoices rendered before
+    with the same content are copied from it instead of rendered. The
+    workers only add entries, the cache is trimmed once at the end.
+
+    With a `ledger` (an invoice_ledger.InvoiceLedger) every rendered
+    invoice is recorded, in batches of invoice_ledger.BATCH_SIZE.
+
+    `sidecar` ("xml" or "json") makes the workers write an e-invoice copy
+    next to every PDF; it needs output files, not an archive. With an
+    `export` (an einvoice_export.EInvoiceExport) every rendered invoice
+    is added to one combined e-invoice file as chunks complete.
+    """
+    if sidecar and archive is not None:
+        raise ValueError("E-invoice sidecar files cannot be written into an archive")
+    if profile not in OUTPUT_PROFILES:
+        raise ValueError(f"Unknown output profile: {profile!r}")
+    results, valid_jobs = _split_invalid(jobs)
+    unnumbered = [job for job in valid_jobs if not job.invoice.invoice_number]
+    jobs = assign_invoice_numbers(valid_jobs)
+    allocated = [job.invoice.invoice_number for job in unnumbered]
+    if archive is None:
+        output_dir = os.path.abspath(output_dir)
+        os.makedirs(output_dir, exist_ok=True)
+    else:
+        output_dir = None
+    workers = workers or os.cpu_count() or 1
+    # Parse the fonts once here so forked workers share them.
+    register_fonts()
+    total = len(jobs) + len(results)
+    if progress:
+        for done, result in enumerate(results, start=1):
+            progress(done, total, result)
+    # Several invoices per task amortise the pickling round trip, while
+    # enough chunks remain to keep every worker busy until the end.
+    chunk_size = max(1, min(MAX_CHUNK_SIZE, len(jobs) // (workers * 4)))
+
+    ledger_writer = LedgerWriter(ledger) if ledger is not None else None
+    # A pickled cache would scan the whole directory in every chunk
+    worker_cache = cache.detached() if cache is not None else None
+    # register_fonts is a no-op in workers that inherited the fonts via fork.
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(instrumentation.config(),)) as executor:
+        futures = {executor.submit(_render_chunk, chunk, output_dir, profile, worker_cache, sidecar): chunk
+                   for chunk in _chunked(jobs, chunk_size)}
+        for future in as_completed(futures):
+            # Drop the finished future so its PDFs can be freed once written.
+            chunk = futures.pop(future)
+            try:
+                chunk_results, worker_data = future.result()
+                if worker_data is not None:
+                    instrumentation.merge(worker_data)
+            except Exception:
+                # The worker itself died, mark the whole chunk as failed.
+                error = traceback.format_exc()
+                chunk_results = [BatchResult(job.invoice.invoice_number, error=error)
+                                 for job in chunk]
+            if archive is not None:
+                _archive_results(archive, chunk, chunk_results)
+            if ledger_writer is not None:
+                _record_results(ledger_writer, chunk, chunk_results, archive)
+            if export is not None:
+                _export_results(export, chunk, chunk_results)
+            for result in chunk_results:
+                results.append(result)
+                if progress:
+                    progress(len(results), total, result)
+    if ledger_writer is not None:
+        ledger_writer.flush()
+    if cache is not None:
+        cache.trim()
+    _release_failed_numbers(allocated, results)
+    return results
+
+
+def render_statement_file(jobs, path, progress=None, profile=DEFAULT_PROFILE, ledger=None, export=None):
+    """Render all jobs in input order into a single statement PDF.
+
+    The statement is one document, so it is rendered in this process, and
+    an invoice that fails to render fails the whole file: every job is
+    then reported as failed and no file is left behind.
+
+    With a `ledger` every invoice is recorded with the statement's path,
+    with an `export` every invoice is added to the e-invoice export.
+
+    Returns (results, report): BatchResults like render_batch and the
+    RenderReport of the statement, or None if it failed.
+    """
+    results, jobs = _split_invalid(jobs)
+    unnumbered = [job for job in jobs if not job.invoice.invoice_number]
+    jobs = assign_invoice_numbers(jobs)
+    allocated = [job.invoice.invoice_number for job in unnumbered]
+    total = len(jobs) + len(results)
+    if progress:
+        for done, result in enumerate(results, start=1):
+            progress(done, total, result)
+    path = os.path.abspath(path)
+    done = len(results)
+
+    def statement_progress(count):
+        if progress:
+            job = jobs[count - 1]
+            progress(done + count, total, BatchResult(job.invoice.invoice_number, path=path))
+
+    try:
+        with atomic_write(path) as f:
+            report = render_statement(jobs, f, statement_progress, profile)
+    except Exception:
+        error = traceback.format_exc()
+        failed = [BatchResult(job.invoice.invoice_number, error=error) for job in jobs]
+        _release_failed_numbers(allocated, failed)
+        return results + failed, None
+    report.path = path
+    rendered = [BatchResult(job.invoice.invoice_number, path=path) for job in jobs]
+    if ledger is not None:
+        with LedgerWriter(ledger) as ledger_writer:
+            _record_results(ledger_writer, jobs, rendered)
+    if export is not None:
+        _export_results(export, jobs, rendered)
+    return results + rendered, report
+
+
+def _print_progress(done, total, result):
+    status = "ok" if result.ok else "FAILED"
+    sys.stderr.write(f"\r[{done}/{total}] {result.invoice_number}: {status}   ")
+    if done == total:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+
+def write_size_report(reports, path):
+    """Write one JSON line per RenderReport with its size, pages and
+    embedded glyph counts."""
+    with atomic_write(path, "w", encoding="utf-8") as f:
+        for report in reports:
+            f.write(json.dumps(report.as_dict()) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render invoices in batch from a CSV or JSONL file.")
+    parser.add_argument("input", help="path to a .csv or .jsonl file with invoice definitions")
+    parser.add_argument("-o", "--output-dir", default=".", help="directory for the generated PDFs")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="do not show progress")
+    parser.add_argument("--profile", choices=sorted(OUTPUT_PROFILES), default=DEFAULT_PROFILE,
+                        help=f"PDF output profile (default: {DEFAULT_PROFILE})")
+    parser.add_argument("--statement", metavar="PATH",
+                        help="write all invoices into the single PDF PATH instead of one file each")
+    parser.add_argument("--archive", metavar="PATH",
+                        help="write the PDFs into the .zip, .tar, .tar.gz or .tar.xz archive PATH")
+    parser.add_argument("--append", action="store_true",
+                        help="add to an existing --archive, skipping invoices it already holds, "
+                             "by number or by input record")
+    parser.add_argument("--cache", metavar="DIR",
+                        help="reuse PDFs of invoices rendered before with the same content from DIR")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), metavar="MB",
+                        help="evict the least recently used PDFs above this cache size "
+                             f"(default: {DEFAULT_MAX_BYTES // (1024 * 1024)})")
+    parser.add_argument("--ledger", default=LEDGER_FILE, metavar="PATH",
+                        help=f"record the rendered invoices in this ledger (default: {LEDGER_FILE})")
+    parser.add_argument("--no-ledger", action="store_true", help="do not record the invoices in a ledger")
+    parser.add_argument("--einvoice", choices=sorted(EINVOICE_FORMATS),
+                        help="also write a UBL XML or JSON e-invoice next to every PDF")
+    parser.add_argument("--export", metavar="PATH",
+                        help="write the e-invoices of all rendered invoices into one .xml or .jsonl file")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="collect phase timings and counters and write them to PATH, "
+                             "as Prometheus text for .prom files and JSON lines otherwise")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="with --metrics, also record memory peaks per phase (slower)")
+    parser.add_argument("--size-report", metavar="PATH",
+                        help="write a JSONL report of the size of every invoice to PATH")
+    args = parser.parse_args(argv)
+    if args.einvoice and (args.archive or args.statement):
+        parser.error("--einvoice writes files next to the PDFs, it cannot be used with --archive or --statement")
+    if args.export:
+        try:
+            export_format(args.export)
+        except ValueError as e:
+            parser.error(str(e))
+
+    progress = None if args.quiet else _print_progress
+    if args.metrics:
+        instrumentation.enable(memory=args.trace_memory)
+    with instrumentation.span("batch") as batch_span:
+        results, reports = _run(args, progress)
+        batch_span.set(invoices=len(results))
+    if args.metrics:
+        instrumentation.write_metrics(args.metrics)
+    failed = [result for result in results if not result.ok]
+    for result in failed:
+        sys.stderr.write(f"Invoice {result.invoice_number} failed:\n{result.error}\n")
+    if args.size_report:
+        write_size_report(reports, args.size_report)
+    total_size = sum(report.size for report in reports)
+    print(f"Rendered {len(results) - len(failed)} of {len(results)} invoices, {total_size} bytes.")
+    return 1 if failed else 0
+
+
+def _run(args, progress):
+    cache = RenderCache(args.cache, args.cache_size * 1024 * 1024) if args.cache else None
+    ledger = None if args.no_ledger else InvoiceLedger(args.ledger)
+    export = EInvoiceExport(args.export) if args.export else None
+    try:
+        if args.statement:
+            results, report = render_statement_file(read_jobs(args.input), args.statement, progress=progress,
+                                                    profile=args.profile, ledger=ledger, export=export)
+            reports = [report] if report is not None else []
+        elif args.archive:
+            jobs = list(read_jobs(args.input))
+            with InvoiceArchive(args.archive, append=args.append) as archive:
+                if args.append:
+                    numbers = archive.existing_numbers()
+                    keys = archive.existing_keys()
+                    kept = [job for job in jobs
+                            if not (job.invoice and (job.invoice.invoice_number in numbers or job.key in keys))]
+                    if len(kept) < len(jobs):
+                        print(f"Skipping {len(jobs) - len(kept)} invoices already in {args.archive}.")
+                    jobs = kept
+                results = render_batch(jobs, workers=args.workers, progress=progress, profile=args.profile,
+                                       archive=archive, cache=cache, ledger=ledger, export=export)
+            reports = [result.report for result in results if result.report is not None]
+        else:
+            results = render_batch(read_jobs(args.input), output_dir=args.output_dir, workers=args.workers,
+                                   progress=progress, profile=args.profile, cache=cache, ledger=ledger,
+                                   sidecar=args.einvoice, export=export)
+            reports = [result.report for result in results if result.report is not None]
+    except BaseException:
+        if export is not None:
+            export.discard()
+        raise
+    else:
+        if export is not None:
+            export.close()
+    finally:
+        if ledger is not None:
+            ledger.close()
+    return results, reports
+
+
+if __name__ == '__main__':
+    sys.exit(main())
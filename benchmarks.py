@@ -0,0 +1,379 @@
+"""Benchmarks of rendering, metadata and client I/O, the ledger, the GUI table and startup.
+
+Run from the repository directory:
+
+    python benchmarks.py -o results.json
+    python benchmarks.py --quick --only render metadata
+    python benchmarks.py -o new.json --compare results.json
+
+All inputs are synthetic and generated from a fixed seed, and every
+benchmark runs in a temporary working directory, so runs are comparable
+across commits. Results are written as JSON: one entry per benchmark and
+parameter set with the best and median wall time over the repeats.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+from invoice_model import Invoice, InvoiceItem
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SEED = 1234
+
+RENDER_ITEM_COUNTS = (1, 10, 100, 1000, 10000, 100000)
+METADATA_ITEM_COUNTS = (10, 1000, 100000)
+CLIENT_COUNTS = (1000, 10000, 100000)
+GUI_ITEM_COUNTS = (100, 10000, 100000)
+LEDGER_INVOICE_COUNTS = (1000, 10000, 100000)
+STARTUP_RUNS = 5
+# --quick leaves out parameter values above this
+QUICK_LIMIT = 1000
+
+BENCHMARKS = {}
+
+_WORDS = ("consulting", "hosting", "support", "licence", "development", "maintenance", "training",
+          "storitve", "gostovanje", "svetovanje", "vzdrževanje", "izobraževanje", "načrtovanje",
+          "monthly", "annual", "on-site", "remote", "premium", "backup", "migration", "audit")
+_NAME_PARTS = ("Alpha", "Beta", "Čebelar", "Delta", "Šumnik", "Žaga", "Kovač", "Nova", "Omega",
+               "Podjetje", "Sistemi", "Storitve", "Tehnika", "Trgovina", "Zavod", "Global", "Nordic")
+_LEGAL_FORMS = ("d.o.o.", "d.d.", "s.p.", "Ltd.", "GmbH", "Inc.")
+
+
+# Synthetic data
+
+def make_items(count, seed=SEED):
+    """Return `count` invoice items with mixed descriptions and VAT rates."""
+    rng = random.Random(seed)
+    return [
+        InvoiceItem(
+            description=" ".join(rng.choice(_WORDS) for _ in range(rng.randint(1, 12))).capitalize(),
+            unit_price=round(rng.uniform(0.5, 2000), rng.choice((2, 4))),
+            quantity=rng.randint(1, 100),
+            vat_rate=rng.choice((0.0, 9.5, 22.0))
+        )
+        for _ in range(count)
+    ]
+
+
+def make_client(rng, index):
+    name = f"{rng.choice(_NAME_PARTS)} {rng.choice(_NAME_PARTS)} {index} {rng.choice(_LEGAL_FORMS)}"
+    return {
+        "company_name": name,
+        "address": f"{rng.choice(_NAME_PARTS)}ova ulica {rng.randint(1, 200)}, {rng.randint(1000, 9999)} Mesto",
+        "registration_number": f"{rng.randint(1000000, 9999999)}{index:06d}",
+        "vat_number": f"SI{index:08d}",
+    }
+
+
+def make_clients(count, seed=SEED):
+    rng = random.Random(seed)
+    return [make_client(rng, index) for index in range(count)]
+
+
+def make_invoice(item_count, seed=SEED, number="2025-001"):
+    rng = random.Random(seed)
+    issue_date = date(2025, 1, 31)
+    contractor = make_client(rng, 0)
+    contractor.update(bank_info="SI56 0201 0001 2345 678", swift="LJBASI2X")
+    return Invoice(number, issue_date.isoformat(), (issue_date + timedelta(days=15)).isoformat(),
+                   contractor, make_client(rng, 1), make_items(item_count, seed))
+
+
+# Measurement
+
+def measure(func, repeat=3, setup=None):
+    """Run func `repeat` times and return (best, median) wall time."""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times)
+
+
+def _repeat_for(count):
+    return 5 if count <= 100 else 3 if count <= 10000 else 1
+
+
+def result(name, params, timing, repeat, **extra):
+    best, median = timing
+    entry = {"name": name, "params": params, "best": best, "median": median, "repeat": repeat}
+    entry.update(extra)
+    return entry
+
+
+def benchmark(name):
+    """Register a benchmark, a generator taking the size limit and yielding results."""
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def _sizes(sizes, limit):
+    return [size for size in sizes if limit is None or size <= limit]
+
+
+@contextmanager
+def working_directory():
+    """Run in an empty temporary directory, where the metadata and client
+    files of the modules under test are created."""
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="invoice-bench-") as directory:
+        os.chdir(directory)
+        try:
+            yield directory
+        finally:
+            os.chdir(previous)
+
+
+# Benchmarks
+
+@benchmark("render")
+def bench_render(limit):
+    from invoice_generator import generate_invoice_pdf, register_fonts
+    register_fonts()
+    for count in _sizes(RENDER_ITEM_COUNTS, limit):
+        invoice = make_invoice(count)
+        repeat = _repeat_for(count)
+        timing = measure(lambda: generate_invoice_pdf(invoice, True, True, output_path="bench.pdf"), repeat)
+        yield result("render", {"items": count}, timing, repeat, bytes=os.path.getsize("bench.pdf"))
+
+
+@benchmark("metadata")
+def bench_metadata(limit):
+    import invoice_metadata
+    from invoice_metadata import (
+        allocate_invoice_numbers, load_last_items, load_metadata, save_last_items, save_metadata
+    )
+
+    def forget_cache():
+        invoice_metadata._cache["stat"] = None
+
+    for count in _sizes(METADATA_ITEM_COUNTS, limit):
+        items = make_items(count)
+        repeat = _repeat_for(count)
+        params = {"items": count}
+        save_last_items(items)
+        data = load_metadata()
+        yield result("metadata.save", params, measure(lambda: save_metadata(data), repeat), repeat)
+        yield result("metadata.load_cold", params,
+                     measure(load_metadata, repeat, setup=forget_cache), repeat)
+        yield result("metadata.load_cached", params, measure(load_metadata, repeat), repeat)
+        yield result("metadata.save_last_items", params, measure(lambda: save_last_items(items), repeat), repeat)
+        yield result("metadata.load_last_items", params, measure(load_last_items, repeat), repeat)
+        yield result("metadata.allocate_number", params,
+                     measure(lambda: allocate_invoice_numbers(1), repeat), repeat)
+
+
+@benchmark("clients")
+def bench_clients(limit):
+    from client_manager import ClientRegistry, load_clients, save_clients
+    for count in _sizes(CLIENT_COUNTS, limit):
+        save_clients(make_clients(count))
+        repeat = _repeat_for(count)
+        params = {"clients": count}
+        yield result("clients.load", params, measure(load_clients, repeat), repeat)
+        yield result("clients.registry", params, measure(ClientRegistry, repeat), repeat)
+        registry = ClientRegistry()
+        for query in ("nova", "kovac sistemi", f"SI{count // 2:08d}", "sistmi trgovna"):
+            yield result("clients.search", dict(params, query=query),
+                         measure(lambda: registry.search(query), 5), 5)
+
+
+@benchmark("ledger")
+def bench_ledger(limit):
+    from invoice_ledger import InvoiceLedger
+    items = make_items(1000)
+    clients = make_clients(200)
+    first_day = date(2023, 1, 1)
+    for count in _sizes(LEDGER_INVOICE_COUNTS, limit):
+        params = {"invoices": count}
+        entries = []
+        for index in range(count):
+            issue_date = first_day + timedelta(days=index * 3 * 365 // count)
+            start = index % 990
+            invoice = Invoice(f"{issue_date.year}-{index:06d}", issue_date.isoformat(),
+                              (issue_date + timedelta(days=15)).isoformat(), clients[0],
+                              clients[index % len(clients)], items[start:start + 10])
+            entries.append((invoice, "English", True, False, f"{invoice.invoice_number}.pdf"))
+        ledger = InvoiceLedger(f"ledger-{count}.sqlite3")
+        try:
+            # Recording again replaces the records, every repeat writes all of them
+            yield result("ledger.record_many", params, measure(lambda: ledger.record_many(entries), 1), 1)
+            number = entries[count // 2][0].invoice_number
+            vat_number = clients[7]["vat_number"]
+            queries = {
+                "get": lambda: ledger.get(number),
+                "by_client": lambda: ledger.by_client(vat_number),
+                "in_period": lambda: ledger.in_period("2024-03-01", "2024-03-31"),
+                "totals_by_month": lambda: ledger.period_totals(group_by="month"),
+                "vat_by_rate": lambda: ledger.vat_by_rate("2024-01-01", "2024-12-31"),
+            }
+            for name, query in queries.items():
+                yield result(f"ledger.{name}", params, measure(query, 5), 5)
+        finally:
+            ledger.close()
+
+
+@benchmark("gui")
+def bench_gui(limit):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication
+    from invoice_gui import InvoiceGUI
+    from invoice_metadata import save_last_items
+    app = QApplication.instance() or QApplication([sys.argv[0]])
+    for count in _sizes(GUI_ITEM_COUNTS, limit):
+        items = make_items(count)
+        repeat = _repeat_for(count)
+        params = {"items": count}
+        save_last_items(items)
+
+        def construct():
+            gui = InvoiceGUI()
+            loaded = []
+            gui.loaded.connect(lambda: loaded.append(True))
+            gui.show()
+            while not loaded:
+                app.processEvents()
+            gui.close()
+            gui.deleteLater()
+            app.processEvents()
+
+        yield result("gui.construct_with_last_items", params, measure(construct, repeat), repeat)
+
+        save_last_items([])
+        gui = InvoiceGUI()
+        gui.show()
+        gui.load_deferred()
+        app.processEvents()
+
+        def clear():
+            gui.item_model.remove_rows(range(len(gui.item_model.items)))
+            app.processEvents()
+
+        def populate():
+            gui.item_model.append_items(items)
+            app.processEvents()
+
+        yield result("gui.append_items", params, measure(populate, repeat, setup=clear), repeat)
+        gui.close()
+        gui.deleteLater()
+        app.processEvents()
+
+
+@benchmark("startup")
+def bench_startup(limit):
+    """Phases reported by main.py --profile-startup, in fresh processes."""
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen", PYTHONDONTWRITEBYTECODE="1")
+    phases = {}
+    processes = []
+    for _ in range(STARTUP_RUNS):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, os.path.join(REPO_DIR, "main.py"), "--profile-startup"],
+                                env=env, check=True, capture_output=True, text=True).stdout
+        processes.append(time.perf_counter() - start)
+        for line in output.splitlines()[1:]:
+            phase, milliseconds = line.split()[:2]
+            phases.setdefault(phase, []).append(float(milliseconds) / 1000)
+    for phase, times in phases.items():
+        yield result(f"startup.{phase}", {}, (min(times), statistics.median(times)), STARTUP_RUNS)
+    yield result("startup.process", {}, (min(processes), statistics.median(processes)), STARTUP_RUNS)
+
+
+# Reporting
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    from reportlab import Version as reportlab_version
+    return {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "reportlab": reportlab_version,
+        "numpy": numpy_version,
+    }
+
+
+def _key(entry):
+    return entry["name"], json.dumps(entry["params"], sort_keys=True)
+
+
+def compare(baseline, current):
+    """Return lines comparing the best times of two result documents."""
+    old = {_key(entry): entry for entry in baseline["results"]}
+    lines = [f"{'benchmark':<36} {'params':<40} {'before':>10} {'after':>10} {'ratio':>7}"]
+    for entry in current["results"]:
+        before = old.get(_key(entry))
+        after = entry["best"]
+        params = ", ".join(f"{k}={v}" for k, v in entry["params"].items())
+        if before is None:
+            lines.append(f"{entry['name']:<36} {params:<40} {'-':>10} {after:>10.4f} {'new':>7}")
+        else:
+            ratio = after / before["best"] if before["best"] else float("inf")
+            lines.append(f"{entry['name']:<36} {params:<40} {before['best']:>10.4f} {after:>10.4f} {ratio:>6.2f}x")
+    return lines
+
+
+def run(names, limit=None, log=None):
+    results = []
+    for name in names:
+        with working_directory():
+            for entry in BENCHMARKS[name](limit):
+                results.append(entry)
+                if log:
+                    params = ", ".join(f"{k}={v}" for k, v in entry["params"].items())
+                    log(f"{entry['name']} [{params}]: {entry['best']:.4f}s")
+    return {"environment": environment(), "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the invoice generator benchmarks.")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), default=list(BENCHMARKS),
+                        help="benchmarks to run (default: all)")
+    parser.add_argument("--quick", action="store_true",
+                        help=f"skip parameter values above {QUICK_LIMIT}")
+    parser.add_argument("-o", "--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--compare", metavar="BASELINE", help="print a comparison with earlier JSON results")
+    parser.add_argument("-q", "--quiet", action="store_true", help="do not log results while running")
+    args = parser.parse_args(argv)
+
+    log = None if args.quiet else (lambda line: print(line, file=sys.stderr, flush=True))
+    document = run(args.only, QUICK_LIMIT if args.quick else None, log)
+    text = json.dumps(document, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print("\n".join(compare(baseline, document)), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,16 @@
+import bisect
+import difflib
 import json
 import os
+import re
+import unicodedata
+
+from atomic_io import atomic_write
 
 CLIENTS_FILE = "clients.json"
+# Single-client updates are appended here and folded into CLIENTS_FILE by
+# ClientRegistry.compact(), so one change never rewrites the whole file.
+JOURNAL_SUFFIX = ".journal"
 
 def load_clients():
     """Load the list of predefined clients from the JSON file.
@@ -16,7 +25,230 @@ def load_clients():
             return json.load(f)
     return []
 
-def save_clients(clients):
-    """Save the given list of client dictionaries to the JSON file."""
-    with open(CLIENTS_FILE, "w") as f:
+def save_clients(clients, path=None):
+    """Save the given list of client dictionaries to the JSON file,
+    replacing it atomically."""
+    with atomic_write(path or CLIENTS_FILE, "w") as f:
         json.dump(clients, f, indent=2)
+
+def normalize_name(name):
+    """Lowercase, strip accents and punctuation and collapse whitespace."""
+    name = unicodedata.normalize("NFKD", name or "")
+    name = "".join(ch for ch in name if not unicodedata.combining(ch))
+    return " ".join(re.sub(r"[^\w\s]", " ", name.lower()).split())
+
+def _file_stat(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def _drop_torn_line(f):
+    """Cut off a last line without its newline, left by a crash during an
+    append to the journal, so the next append starts on a fresh line."""
+    size = f.seek(0, os.SEEK_END)
+    if size == 0:
+        return
+    f.seek(size - 1)
+    if f.read(1) == b"\n":
+        return
+    f.seek(0)
+    f.truncate(f.read().rfind(b"\n") + 1)
+
+class ClientRegistry:
+    """Indexed, incrementally searchable view of clients.json.
+
+    Clients are indexed by VAT number, registration number and normalized
+    company name. search() matches the prefix of any word of the name,
+    falling back to fuzzy matching. refresh() only reloads when the
+    clients file or its journal changed on disk. With load=False the
+    registry starts empty and the first refresh() reads the files.
+    """
+
+    def __init__(self, path=None, load=True):
+        self.path = path or CLIENTS_FILE
+        self._stat = None
+        self._build_index([])
+        if load:
+            self.refresh()
+
+    @property
+    def journal_path(self):
+        return self.path + JOURNAL_SUFFIX
+
+    def refresh(self):
+        """Reload the clients if the files changed. Returns True if reloaded."""
+        stat = (_file_stat(self.path), _file_stat(self.journal_path))
+        if stat == self._stat:
+            return False
+        clients = []
+        if stat[0] is not None:
+            with open(self.path, "r") as f:
+                clients = json.load(f)
+        self._build_index(clients)
+        if stat[1] is not None:
+            with open(self.journal_path, "r") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break  # torn by a crash during upsert(), never acknowledged
+                    if line.strip():
+                        self._apply_upsert(json.loads(line))
+        self._stat = stat
+        return True
+
+    def _build_index(self, clients):
+        self.clients = clients
+        self._by_vat = {}
+        self._by_registration = {}
+        self._by_name = {}
+        self._names = []   # normalized company name per client index
+        self._tokens = []  # sorted (word, index) pairs for prefix search
+        for index, client in enumerate(clients):
+            self._index_client(index, client, sort=False)
+        self._tokens.sort()
+
+    def _keys(self, client):
+        return ((client.get("vat_number") or "").strip().upper(),
+                (client.get("registration_number") or "").strip(),
+                normalize_name(client.get("company_name")))
+
+    def _index_client(self, index, client, sort=True):
+        vat, registration, name = self._keys(client)
+        if vat:
+            self._by_vat[vat] = index
+        if registration:
+            self._by_registration[registration] = index
+        if name:
+            self._by_name[name] = index
+        if index == len(self._names):
+            self._names.append(name)
+        else:
+            self._names[index] = name
+        for word in set(name.split()):
+            if sort:
+                bisect.insort(self._tokens, (word, index))
+            else:
+                self._tokens.append((word, index))
+
+    def _unindex_client(self, index, client):
+        vat, registration, name = self._keys(client)
+        for key, mapping in ((vat, self._by_vat), (registration, self._by_registration),
+                             (name, self._by_name)):
+            if key and mapping.get(key) == index:
+                del mapping[key]
+        for word in set(name.split()):
+            position = bisect.bisect_left(self._tokens, (word, index))
+            if position < len(self._tokens) and self._tokens[position] == (word, index):
+                del self._tokens[position]
+
+    def _find_existing(self, client):
+        vat, registration, name = self._keys(client)
+        if vat and vat in self._by_vat:
+            return self._by_vat[vat]
+        if registration and registration in self._by_registration:
+            return self._by_registration[registration]
+        index = self._by_name.get(name)
+        if index is None:
+            return None
+        # Same name but a different VAT or registration number is a
+        # different company
+        existing_vat, existing_registration, _ = self._keys(self.clients[index])
+        if vat and existing_vat and vat != existing_vat:
+            return None
+        if registration and existing_registration and registration != existing_registration:
+            return None
+        return index
+
+    def _apply_upsert(self, client):
+        index = self._find_existing(client)
+        if index is None:
+            index = len(self.clients)
+            self.clients.append(client)
+        else:
+            self._unindex_client(index, self.clients[index])
+            self.clients[index] = client
+        self._index_client(index, client)
+        return index
+
+    def find_by_vat(self, vat_number):
+        index = self._by_vat.get((vat_number or "").strip().upper())
+        return None if index is None else self.clients[index]
+
+    def find_by_registration(self, registration_number):
+        index = self._by_registration.get((registration_number or "").strip())
+        return None if index is None else self.clients[index]
+
+    def find_by_name(self, company_name):
+        index = self._by_name.get(normalize_name(company_name))
+        return None if index is None else self.clients[index]
+
+    def search(self, text, limit=20):
+        """Return up to `limit` indexes of clients matching `text`.
+
+        Every word of the query must prefix a word of the company name;
+        a VAT or registration number match comes first. If nothing
+        matches, close (fuzzy) name matches are returned instead.
+        """
+        query = normalize_name(text)
+        if not query:
+            return []
+        results = []
+        for exact in (self._by_vat.get(text.strip().upper()),
+                      self._by_registration.get(text.strip())):
+            if exact is not None and exact not in results:
+                results.append(exact)
+        words = query.split()
+        # Candidates come from the least common word prefix, the other
+        # words are then checked against the candidate's name.
+        candidates = None
+        for word in words:
+            matches = self._prefix_matches(word)
+            if candidates is None or len(matches) < len(candidates):
+                candidates = matches
+        for index in sorted(candidates):
+            if len(results) >= limit:
+                break
+            name_words = self._names[index].split()
+            if index not in results and all(any(w.startswith(q) for w in name_words) for q in words):
+                results.append(index)
+        if not results:
+            # Only names with a word sharing the query's first letter are
+            # compared, which keeps fuzzy matching fast on large files.
+            names = {self._names[index]: index for index in self._prefix_matches(words[0][0])}
+            close = difflib.get_close_matches(query, names.keys(), n=limit, cutoff=0.6)
+            results = [names[name] for name in close]
+        return results[:limit]
+
+    def _prefix_matches(self, prefix):
+        matches = set()
+        position = bisect.bisect_left(self._tokens, (prefix, -1))
+        while position < len(self._tokens) and self._tokens[position][0].startswith(prefix):
+            matches.add(self._tokens[position][1])
+            position += 1
+        return matches
+
+    def upsert(self, client):
+        """Add or replace one client without rewriting the clients file.
+
+        The client replaces an existing one with the same VAT number or
+        registration number, or else with the same normalized name unless
+        their VAT or registration numbers differ. Returns its index.
+        """
+        self.refresh()
+        with open(self.journal_path, "a+b") as f:
+            _drop_torn_line(f)
+            f.write((json.dumps(client) + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        index = self._apply_upsert(client)
+        self._stat = (_file_stat(self.path), _file_stat(self.journal_path))
+        return index
+
+    def compact(self):
+        """Fold the journal into the clients file."""
+        self.refresh()
+        save_clients(self.clients, self.path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self._stat = (_file_stat(self.path), None)
@@ -0,0 +1,407 @@
+"""Machine readable copies of invoices, as UBL 2.1 XML or JSON.
+
+Both formats are built from the same Invoice/InvoiceItem data as the PDF
+and written incrementally: XML through xml.sax's XMLGenerator and JSON
+piece by piece, one invoice line at a time, so neither ever holds a
+document tree or the full text of an invoice in memory.
+
+    with open("2025-001.xml", "wb") as f:
+        write_ubl_invoice(invoice, f, "Slovene", include_vat=True)
+
+write_sidecar() writes the copy next to a PDF. EInvoiceExport collects
+any number of invoices in one file: an <Invoices> element holding one
+UBL <Invoice> per invoice, or JSON lines with one invoice per line. Its
+memory use does not grow with the number of invoices.
+
+Amounts are exact decimal strings computed from the integer cents of
+invoice_model, unit prices keep their four decimals. Without VAT the
+lines are not subject to VAT (category "O"), with the reverse charge
+note they are reverse charged (category "AE").
+"""
+import io
+import json
+import os
+from xml.sax.saxutils import XMLGenerator
+
+from atomic_io import AtomicFile, atomic_write
+from invoice_layout import LOCALES
+from invoice_model import UNIT_PRICE_SCALE, VAT_RATE_SCALE, InvoiceTotals
+
+CURRENCY = "EUR"
+UBL_NAMESPACES = {
+    "xmlns": "urn:oasis:names:specification:ubl:schema:xsd:Invoice-2",
+    "xmlns:cac": "urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2",
+    "xmlns:cbc": "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2",
+}
+INVOICE_TYPE_CODE = "380"     # commercial invoice
+CREDIT_TRANSFER_CODE = "30"
+UNIT_CODE = "C62"             # one (unit)
+FORMATS = {"xml": ".xml", "json": ".json"}
+
+
+def _decimal(value, digits):
+    """Fixed point integer `value` with `digits` decimals as a string."""
+    sign = "-" if value < 0 else ""
+    whole, fraction = divmod(abs(value), 10 ** digits)
+    return f"{sign}{whole}.{fraction:0{digits}d}"
+
+
+def _cents(cents):
+    return _decimal(cents, 2)
+
+
+def _unit_price(price_units):
+    return _decimal(price_units, len(str(UNIT_PRICE_SCALE)) - 1)
+
+
+def _percent(vat_bp):
+    return _decimal(vat_bp, len(str(VAT_RATE_SCALE)) - 1)
+
+
+def _tax_category(vat_bp, include_vat, include_note):
+    if not include_vat:
+        return "AE" if include_note else "O"
+    return "S" if vat_bp else "Z"
+
+
+def _note(language, include_note):
+    return "".join(LOCALES[language]["note"]) if include_note else None
+
+
+def _tax_breakdown(totals, include_vat):
+    """[(vat_bp, net_cents, vat_cents)] of the tax subtotals of an invoice.
+
+    With VAT there is one per rate. Without it all lines share category O
+    or AE, which allow one subtotal only, at a rate of zero.
+    """
+    if include_vat:
+        return [(vat_bp, net, vat) for vat_bp, (net, vat, _) in sorted(totals.by_rate.items())]
+    return [(0, totals.net_cents, 0)] if totals.by_rate else []
+
+
+def _line(item):
+    """(description, quantity, price_units, vat_bp, net_cents, vat_cents) of an item."""
+    return item.description, item.quantity, item.price_units, item.vat_bp, item.net_cents, item.vat_cents
+
+
+# UBL
+
+class _UblWriter:
+    def __init__(self, generator):
+        self.generator = generator
+
+    def start(self, name, attrs=None):
+        self.generator.startElement(name, attrs or {})
+
+    def end(self, name):
+        self.generator.endElement(name)
+
+    def text(self, name, value, attrs=None):
+        if value is None or value == "":
+            return
+        self.generator.startElement(name, attrs or {})
+        self.generator.characters(str(value))
+        self.generator.endElement(name)
+
+    def amount(self, name, cents):
+        self.text(name, _cents(cents), {"currencyID": CURRENCY})
+
+    def newline(self):
+        self.generator.ignorableWhitespace("\n")
+
+    def party(self, name, info):
+        self.start(name)
+        self.start("cac:Party")
+        self.start("cac:PartyName")
+        self.text("cbc:Name", info.get("company_name"))
+        self.end("cac:PartyName")
+        if info.get("address"):
+            self.start("cac:PostalAddress")
+            self.start("cac:AddressLine")
+            self.text("cbc:Line", info["address"])
+            self.end("cac:AddressLine")
+            self.end("cac:PostalAddress")
+        if info.get("vat_number"):
+            self.start("cac:PartyTaxScheme")
+            self.text("cbc:CompanyID", info["vat_number"])
+            self.tax_scheme()
+            self.end("cac:PartyTaxScheme")
+        self.start("cac:PartyLegalEntity")
+        self.text("cbc:RegistrationName", info.get("company_name"))
+        self.text("cbc:CompanyID", info.get("registration_number"))
+        self.end("cac:PartyLegalEntity")
+        self.end("cac:Party")
+        self.end(name)
+
+    def tax_scheme(self):
+        self.start("cac:TaxScheme")
+        self.text("cbc:ID", "VAT")
+        self.end("cac:TaxScheme")
+
+    def tax_category(self, name, vat_bp, include_vat, include_note, note=None):
+        category = _tax_category(vat_bp, include_vat, include_note)
+        self.start(name)
+        self.text("cbc:ID", category)
+        if category != "O":
+            # EN 16931 forbids a rate on lines not subject to VAT
+            self.text("cbc:Percent", _percent(vat_bp if include_vat else 0))
+        if category == "AE":
+            self.text("cbc:TaxExemptionReasonCode", "VATEX-EU-AE")
+            self.text("cbc:TaxExemptionReason", note)
+        self.tax_scheme()
+        self.end(name)
+
+    def invoice(self, invoice, language, include_vat, include_note):
+        note = _note(language, include_note)
+        # UBL puts the totals before the lines, so they are computed first
+        # (Invoice.totals is cached) and the lines are streamed after them.
+        totals = invoice.totals
+        vat_cents = totals.vat_cents if include_vat else 0
+        self.start("Invoice", UBL_NAMESPACES)
+        self.newline()
+        self.text("cbc:UBLVersionID", "2.1")
+        self.text("cbc:ID", invoice.invoice_number)
+        self.text("cbc:IssueDate", invoice.issue_date)
+        self.text("cbc:DueDate", invoice.due_date)
+        self.text("cbc:InvoiceTypeCode", INVOICE_TYPE_CODE)
+        self.text("cbc:Note", note, {"languageID": LOCALES[language]["language_code"]})
+        self.text("cbc:DocumentCurrencyCode", CURRENCY)
+        self.newline()
+        self.party("cac:AccountingSupplierParty", invoice.contractor_info)
+        self.newline()
+        self.party("cac:AccountingCustomerParty", invoice.client_info)
+        self.newline()
+        contractor = invoice.contractor_info
+        if contractor.get("bank_info"):
+            self.start("cac:PaymentMeans")
+            self.text("cbc:PaymentMeansCode", CREDIT_TRANSFER_CODE)
+            self.text("cbc:PaymentDueDate", invoice.due_date)
+            self.start("cac:PayeeFinancialAccount")
+            self.text("cbc:ID", contractor["bank_info"])
+            if contractor.get("swift"):
+                self.start("cac:FinancialInstitutionBranch")
+                self.text("cbc:ID", contractor["swift"])
+                self.end("cac:FinancialInstitutionBranch")
+            self.end("cac:PayeeFinancialAccount")
+            self.end("cac:PaymentMeans")
+            self.newline()
+        self.start("cac:TaxTotal")
+        self.amount("cbc:TaxAmount", vat_cents)
+        for vat_bp, net, vat in _tax_breakdown(totals, include_vat):
+            self.start("cac:TaxSubtotal")
+            self.amount("cbc:TaxableAmount", net)
+            self.amount("cbc:TaxAmount", vat)
+            self.tax_category("cac:TaxCategory", vat_bp, include_vat, include_note, note)
+            self.end("cac:TaxSubtotal")
+        self.end("cac:TaxTotal")
+        self.newline()
+        self.start("cac:LegalMonetaryTotal")
+        self.amount("cbc:LineExtensionAmount", totals.net_cents)
+        self.amount("cbc:TaxExclusiveAmount", totals.net_cents)
+        self.amount("cbc:TaxInclusiveAmount", totals.net_cents + vat_cents)
+        self.amount("cbc:PayableAmount", totals.net_cents + vat_cents)
+        self.end("cac:LegalMonetaryTotal")
+        self.newline()
+        for number, item in enumerate(invoice.items, start=1):
+            description, quantity, price_units, vat_bp, net_cents, _ = _line(item)
+            self.start("cac:InvoiceLine")
+            self.text("cbc:ID", number)
+            self.text("cbc:InvoicedQuantity", quantity, {"unitCode": UNIT_CODE})
+            self.amount("cbc:LineExtensionAmount", net_cents)
+            self.start("cac:Item")
+            self.text("cbc:Name", description)
+            self.tax_category("cac:ClassifiedTaxCategory", vat_bp, include_vat, include_note, note)
+            self.end("cac:Item")
+            self.start("cac:Price")
+            self.text("cbc:PriceAmount", _unit_price(price_units), {"currencyID": CURRENCY})
+            self.end("cac:Price")
+            self.end("cac:InvoiceLine")
+            self.newline()
+        self.end("Invoice")
+
+
+def _text_writer(stream):
+    # XMLGenerator's own wrapper writes through on every tiny piece; this
+    # one buffers a few KB at a time, which is several times faster.
+    return io.TextIOWrapper(stream, encoding="utf-8", errors="xmlcharrefreplace", newline="\n")
+
+
+def _generator(text):
+    return XMLGenerator(text, encoding="utf-8", short_empty_elements=True)
+
+
+def write_ubl_invoice(invoice, stream, language="English", include_vat=False, include_note=False):
+    """Write an invoice as a UBL 2.1 XML document to a binary stream."""
+    text = _text_writer(stream)
+    generator = _generator(text)
+    generator.startDocument()
+    _UblWriter(generator).invoice(invoice, language, include_vat, include_note)
+    generator.endDocument()
+    text.flush()
+    text.detach()  # leaves the caller's stream open
+
+
+# JSON
+
+def _json_parts(invoice, language, include_vat, include_note):
+    """Yield the JSON text of an invoice in pieces, on a single line.
+
+    The lines are written as they are read and summed on the way, so the
+    totals come last and `invoice.items` is read only once.
+    """
+    dump = json.dumps
+    header = {
+        "number": invoice.invoice_number,
+        "issue_date": str(invoice.issue_date),
+        "due_date": str(invoice.due_date) if invoice.due_date else None,
+        "currency": CURRENCY,
+        "language": language,
+        "include_vat": bool(include_vat),
+        "reverse_charge": bool(include_note),
+        "note": _note(language, include_note),
+        "supplier": invoice.contractor_info,
+        "customer": invoice.client_info,
+    }
+    yield dump(header, ensure_ascii=False)[:-1]
+    yield ', "lines": ['
+    totals = InvoiceTotals()
+    separator = ""
+    for item in invoice.items:
+        description, quantity, price_units, vat_bp, net_cents, vat_cents = _line(item)
+        line = {
+            "description": description,
+            "quantity": quantity,
+            "unit_price": _unit_price(price_units),
+            "vat_rate": _percent(vat_bp if include_vat else 0),
+            "tax_category": _tax_category(vat_bp, include_vat, include_note),
+            "net": _cents(net_cents),
+            "vat": _cents(vat_cents if include_vat else 0),
+        }
+        yield separator + dump(line, ensure_ascii=False)
+        separator = ", "
+        totals.add(item)
+    vat_cents = totals.vat_cents if include_vat else 0
+    breakdown = [
+        {"vat_rate": _percent(vat_bp), "tax_category": _tax_category(vat_bp, include_vat, include_note),
+         "taxable": _cents(net), "vat": _cents(vat)}
+        for vat_bp, net, vat in _tax_breakdown(totals, include_vat)
+    ]
+    summary = {
+        "vat_breakdown": breakdown,
+        "net": _cents(totals.net_cents),
+        "vat": _cents(vat_cents),
+        "payable": _cents(totals.net_cents + vat_cents),
+    }
+    yield "], " + dump(summary, ensure_ascii=False)[1:]
+
+
+def write_json_invoice(invoice, stream, language="English", include_vat=False, include_note=False):
+    """Write an invoice as one line of JSON, with a newline, to a binary stream."""
+    for part in _json_parts(invoice, language, include_vat, include_note):
+        stream.write(part.encode("utf-8"))
+    stream.write(b"\n")
+
+
+_WRITERS = {"xml": write_ubl_invoice, "json": write_json_invoice}
+
+
+def sidecar_path(pdf_path, format="xml"):
+    """Path of the machine readable copy of the PDF at pdf_path."""
+    base, extension = os.path.splitext(pdf_path)
+    return (base if extension.lower() == ".pdf" else pdf_path) + FORMATS[format]
+
+
+def write_sidecar(invoice, pdf_path, format="xml", language="English", include_vat=False, include_note=False,
+                  group=None):
+    """Write the XML or JSON copy of an invoice next to its PDF and return
+    its path. `group` is an optional atomic_io.GroupCommit."""
+    if format not in _WRITERS:
+        raise ValueError(f"Unknown e-invoice format: {format!r} (use one of {', '.join(FORMATS)})")
+    path = sidecar_path(pdf_path, format)
+    with atomic_write(path, group=group) as f:
+        _WRITERS[format](invoice, f, language, include_vat, include_note)
+    return path
+
+
+def export_format(path):
+    """Format of a combined export file from its extension."""
+    name = path.lower()
+    if name.endswith(".xml"):
+        return "xml"
+    if name.endswith((".jsonl", ".json")):
+        return "json"
+    raise ValueError(f"Unsupported export file: {path} (use .xml or .jsonl)")
+
+
+class EInvoiceExport:
+    """Combined export of many invoices into the file at `path`.
+
+    The format follows the extension: ".xml" for an <Invoices> element of
+    UBL invoices, ".jsonl" for JSON lines. Each add() writes its invoice
+    straight to a temporary file, which replaces `path` once closed. Use
+    as a context manager; if the block raises, the export is discarded
+    and `path` is left as it was.
+    """
+
+    def __init__(self, path, format=None):
+        self.path = path
+        self.format = format or export_format(path)
+        if self.format not in _WRITERS:
+            raise ValueError(f"Unknown e-invoice format: {self.format!r} (use one of {', '.join(FORMATS)})")
+        self.count = 0
+        self._atomic = AtomicFile(path)
+        self._file = self._atomic.file
+        self._ubl = None
+        if self.format == "xml":
+            self._file = _text_writer(self._file)
+            generator = _generator(self._file)
+            generator.startDocument()
+            generator.startElement("Invoices", {})
+            generator.ignorableWhitespace("\n")
+            self._ubl = _UblWriter(generator)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def add(self, invoice, language="English", include_vat=False, include_note=False):
+        if self._ubl is not None:
+            self._ubl.invoice(invoice, language, include_vat, include_note)
+            self._ubl.newline()
+        else:
+            write_json_invoice(invoice, self._file, language, include_vat, include_note)
+        self.count += 1
+
+    def close(self):
+        if self._atomic is None:
+            return
+        atomic, text = self._atomic, self._file
+        self._atomic = self._file = None
+        try:
+            if self._ubl is not None:
+                self._ubl.end("Invoices")
+                self._ubl.generator.endDocument()
+                self._ubl = None
+            if text is not atomic.file:
+                text.detach()  # flushes into the binary file
+        except BaseException:
+            atomic.discard()
+            raise
+        atomic.commit()
+
+    def discard(self):
+        """Drop the export; `path` keeps its previous contents, if any."""
+        if self._atomic is None:
+            return
+        atomic, text = self._atomic, self._file
+        self._atomic = self._file = self._ubl = None
+        try:
+            if text is not atomic.file:
+                text.detach()
+        finally:
+            atomic.discard()
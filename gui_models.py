@@ -0,0 +1,204 @@
+from PyQt5.QtCore import Qt, QAbstractListModel, QAbstractTableModel, QModelIndex, pyqtSignal
+
+from invoice_model import InvoiceItem, InvoiceTotals
+
+
+def client_display_name(client):
+    """Text shown for a client in the dropdown and search results."""
+    name = client.get("company_name", "")
+    vat_number = client.get("vat_number")
+    return f"{name} ({vat_number})" if vat_number else name
+
+
+class ClientListModel(QAbstractListModel):
+    """Lazily populated list of the clients of a ClientRegistry.
+
+    Row 0 is the "Custom" entry, row n is registry.clients[n - 1]. Rows
+    are handed to the view in batches through canFetchMore/fetchMore, so
+    a dropdown over tens of thousands of clients opens immediately.
+    """
+    BATCH_SIZE = 200
+
+    def __init__(self, registry, parent=None):
+        super().__init__(parent)
+        self.registry = registry
+        self._loaded = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return 1 + self._loaded
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        if role == Qt.DisplayRole:
+            if row == 0:
+                return "Custom"
+            return client_display_name(self.registry.clients[row - 1])
+        if role == Qt.UserRole:
+            return row - 1
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        return self._loaded < len(self.registry.clients)
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        count = min(self.BATCH_SIZE, len(self.registry.clients) - self._loaded)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), 1 + self._loaded, self._loaded + count)
+        self._loaded += count
+        self.endInsertRows()
+
+    def client(self, row):
+        """Client dict shown in `row`, or None for the "Custom" row."""
+        return None if row <= 0 else self.registry.clients[row - 1]
+
+    def refresh(self):
+        """Reload the registry if its files changed and reset the model."""
+        if self.registry.refresh():
+            self.beginResetModel()
+            self._loaded = 0
+            self.endResetModel()
+            return True
+        return False
+
+
+class InvoiceItemTableModel(QAbstractTableModel):
+    """Table model over a list of InvoiceItems, without per-row widgets.
+
+    The model works on the list it is given in place, so the list can be
+    handed to Invoice as is. Description, unit price, quantity and VAT
+    rate are editable; an edited row is replaced by a new InvoiceItem so
+    its derived amounts stay consistent.
+
+    `totals` follows every change in O(1) per affected row and
+    totalsChanged is emitted after each change.
+    """
+    totalsChanged = pyqtSignal()
+    HEADERS = ["Description", "Unit Price (EUR)", "Quantity", "VAT Rate (%)", "VAT Amount (EUR)", "Total (EUR)"]
+    EDITABLE_COLUMNS = (0, 1, 2, 3)
+    MAX_REMOVE_RANGES = 32
+
+    def __init__(self, items, parent=None):
+        super().__init__(parent)
+        self.items = items
+        self.totals = InvoiceTotals(items)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.items)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.EditRole):
+            return None
+        item = self.items[index.row()]
+        column = index.column()
+        if column == 0:
+            return item.description
+        if column == 1:
+            return f"{item.unit_price:.2f}"
+        if column == 2:
+            return str(item.quantity)
+        if column == 3:
+            return f"{item.vat_rate:.2f}"
+        if column == 4:
+            return f"{item.vat_amount:.2f}"
+        return f"{item.total_gross:.2f}"
+
+    def flags(self, index):
+        flags = super().flags(index)
+        if index.isValid() and index.column() in self.EDITABLE_COLUMNS:
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid() or role != Qt.EditRole:
+            return False
+        row = index.row()
+        item = self.items[row]
+        fields = {
+            "description": item.description,
+            "unit_price": item.unit_price,
+            "quantity": item.quantity,
+            "vat_rate": item.vat_rate
+        }
+        text = str(value).strip()
+        try:
+            if index.column() == 0:
+                if not text:
+                    return False
+                fields["description"] = text
+            elif index.column() == 1:
+                fields["unit_price"] = float(text)
+            elif index.column() == 2:
+                fields["quantity"] = int(text)
+            elif index.column() == 3:
+                fields["vat_rate"] = float(text) if text else 0.0
+            else:
+                return False
+        except ValueError:
+            return False
+        new_item = InvoiceItem(**fields)
+        self.items[row] = new_item
+        self.totals.remove(item)
+        self.totals.add(new_item)
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.HEADERS) - 1))
+        self.totalsChanged.emit()
+        return True
+
+    def append_items(self, items):
+        """Append several items with a single insert notification."""
+        items = list(items)
+        if not items:
+            return
+        first = len(self.items)
+        self.beginInsertRows(QModelIndex(), first, first + len(items) - 1)
+        self.items.extend(items)
+        self.endInsertRows()
+        for item in items:
+            self.totals.add(item)
+        self.totalsChanged.emit()
+
+    def remove_rows(self, rows):
+        """Remove the given rows, one notification per contiguous range.
+
+        Scattered selections with many ranges are removed in one pass
+        with a model reset instead.
+        """
+        rows = sorted(set(rows))
+        ranges = []
+        for row in rows:
+            if ranges and ranges[-1][1] == row - 1:
+                ranges[-1][1] = row
+            else:
+                ranges.append([row, row])
+        if len(ranges) > self.MAX_REMOVE_RANGES:
+            removed = set(rows)
+            for row in removed:
+                self.totals.remove(self.items[row])
+            self.beginResetModel()
+            self.items[:] = [item for row, item in enumerate(self.items) if row not in removed]
+            self.endResetModel()
+        else:
+            for first, last in reversed(ranges):
+                for item in self.items[first:last + 1]:
+                    self.totals.remove(item)
+                self.beginRemoveRows(QModelIndex(), first, last)
+                del self.items[first:last + 1]
+                self.endRemoveRows()
+        if rows:
+            self.totalsChanged.emit()
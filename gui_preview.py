@@ -0,0 +1,191 @@
+"""Live preview of the invoice being edited.
+
+The first page is drawn by the same code as the PDF, invoice_generator's
+draw_invoice, onto a QPainterCanvas that paints into a QImage instead of
+writing PDF operators. It runs on the thread pool with a placeholder
+number, so previewing never allocates a real invoice number.
+
+InvoicePreview debounces change notifications, skips states that were
+rendered already and keeps at most one render running: a change during a
+render cancels it and only the latest state is rendered next.
+"""
+import os
+from collections import OrderedDict
+
+from PyQt5.QtCore import Qt, QPointF, QThreadPool, QTimer
+from PyQt5.QtGui import QFont, QFontDatabase, QImage, QPainter, QPen, QPixmap
+from PyQt5.QtWidgets import QLabel
+
+from gui_workers import PreviewRenderJob
+
+PREVIEW_NUMBER = "PREVIEW"
+PREVIEW_WIDTH = 420        # pixels
+DEBOUNCE_MS = 300
+IMAGE_CACHE_SIZE = 8
+DOTS_PER_METER_72_DPI = round(72 / 0.0254)
+
+_font_families = {}  # reportlab font name -> Qt font family
+
+
+def load_preview_fonts():
+    """Register the invoice fonts with Qt. Must run on the GUI thread."""
+    if _font_families:
+        return
+    from invoice_layout import FONT_DIR, FONTS
+    for name, file_name in FONTS.items():
+        font_id = QFontDatabase.addApplicationFont(os.path.join(FONT_DIR, file_name))
+        families = QFontDatabase.applicationFontFamilies(font_id)
+        _font_families[name] = families[0] if families else ""
+
+
+class _FirstPageDone(Exception):
+    pass
+
+
+class QPainterCanvas:
+    """The part of the reportlab canvas API used by draw_invoice, painting
+    the first page onto a QPainter in PDF points. Drawing stops with
+    _FirstPageDone at the end of the first page."""
+
+    def __init__(self, painter, page_height):
+        self.painter = painter
+        self.page_height = page_height
+        self._font_name = None
+        self._font_size = None
+        painter.setPen(QPen(Qt.black, 1.0))
+
+    def setFont(self, name, size):
+        font = QFont(_font_families.get(name, ""))
+        font.setBold(name.endswith("-Bold"))
+        font.setPointSizeF(size)
+        font.setHintingPreference(QFont.PreferNoHinting)
+        self.painter.setFont(font)
+        self._font_name = name
+        self._font_size = size
+
+    def drawString(self, x, y, text):
+        self.painter.drawText(QPointF(x, self.page_height - y), text)
+
+    def drawRightString(self, x, y, text):
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+        self.drawString(x - stringWidth(text, self._font_name, self._font_size), y, text)
+
+    def line(self, x1, y1, x2, y2):
+        self.painter.drawLine(QPointF(x1, self.page_height - y1), QPointF(x2, self.page_height - y2))
+
+    def showPage(self):
+        raise _FirstPageDone()
+
+
+def render_first_page(invoice, language, include_vat, include_note, width=PREVIEW_WIDTH, progress=None):
+    """Rasterize the first page of an invoice into a QImage `width` pixels wide.
+
+    Safe to call off the GUI thread once load_preview_fonts() has run.
+    progress is passed to draw_invoice and may raise RenderCancelled.
+    """
+    from invoice_generator import PAGE_HEIGHT, PAGE_WIDTH, draw_invoice
+    scale = width / PAGE_WIDTH
+    image = QImage(width, round(PAGE_HEIGHT * scale), QImage.Format_RGB32)
+    # At 72 dpi a point size equals the size in page units
+    image.setDotsPerMeterX(DOTS_PER_METER_72_DPI)
+    image.setDotsPerMeterY(DOTS_PER_METER_72_DPI)
+    image.fill(Qt.white)
+    painter = QPainter(image)
+    try:
+        painter.setRenderHints(QPainter.Antialiasing | QPainter.TextAntialiasing)
+        painter.scale(scale, scale)
+        draw_invoice(QPainterCanvas(painter, PAGE_HEIGHT), invoice, language, include_vat, include_note,
+                     progress)
+    except _FirstPageDone:
+        pass
+    finally:
+        painter.end()
+    return image
+
+
+class InvoicePreview(QLabel):
+    """Preview pane showing the first page of the current invoice.
+
+    `snapshot` is called when the debounce timer fires and returns
+    (invoice, language, include_vat, include_note) for the current form
+    state, or None when the form cannot be rendered. Call schedule() on
+    every change.
+    """
+
+    def __init__(self, snapshot, parent=None):
+        super().__init__(parent)
+        self.snapshot = snapshot
+        self.setAlignment(Qt.AlignTop | Qt.AlignHCenter)
+        self.setMinimumWidth(PREVIEW_WIDTH)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(DEBOUNCE_MS)
+        self._timer.timeout.connect(self.update_preview)
+        self._images = OrderedDict()  # content key -> QImage, least recently used first
+        self._shown_key = None
+        self._generation = 0
+        self._job = None      # render running on the pool
+        self._pending = None  # (key, args) waiting for the running render to stop
+
+    def schedule(self):
+        """Note a change; the preview follows once changes pause."""
+        self._timer.start()
+
+    def update_preview(self):
+        self._timer.stop()
+        state = self.snapshot()
+        if state is None:
+            return
+        from render_cache import invoice_key
+        invoice, language, include_vat, include_note = state
+        invoice.invoice_number = PREVIEW_NUMBER
+        key = invoice_key(invoice, language, include_vat, include_note, "preview")
+        if key == self._shown_key:
+            # Back to what is shown, e.g. an edit that was undone
+            self._cancel_running()
+            return
+        image = self._images.get(key)
+        if image is not None:
+            self._cancel_running()
+            self._show(key, image)
+            return
+        if self._job is not None:
+            if self._job.key == key and not self._job.is_cancelled():
+                self._pending = None
+                return
+            # Only the latest state is rendered once the running job stops
+            self._cancel_running()
+            self._pending = (key, state)
+            return
+        self._start(key, state)
+
+    def _cancel_running(self):
+        self._pending = None
+        self._generation += 1
+        if self._job is not None:
+            self._job.cancel()
+
+    def _start(self, key, state):
+        load_preview_fonts()
+        self._generation += 1
+        self._job = PreviewRenderJob(self._generation, key, *state, width=PREVIEW_WIDTH)
+        self._job.signals.finished.connect(self._on_rendered)
+        QThreadPool.globalInstance().start(self._job)
+
+    def _on_rendered(self, generation, key, image):
+        self._job = None
+        if image is not None:
+            self._images[key] = image
+            while len(self._images) > IMAGE_CACHE_SIZE:
+                self._images.popitem(last=False)
+            if generation == self._generation:
+                self._show(key, image)
+        if self._pending is not None:
+            key, state = self._pending
+            self._pending = None
+            self._start(key, state)
+
+    def _show(self, key, image):
+        self._images.move_to_end(key)
+        self._shown_key = key
+        self.setPixmap(QPixmap.fromImage(image))
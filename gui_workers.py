@@ -0,0 +1,158 @@
+import os
+import threading
+
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+
+from invoice_metadata import (
+    allocate_invoice_numbers, release_invoice_numbers, save_last_items, save_last_info, save_invoice_options,
+    metadata_transaction
+)
+from invoice_ledger import record_invoice
+
+# invoice_generator pulls in reportlab, which is slow to import. It is
+# imported on first use so the window can show without it, and preloaded
+# in the background by PreloadRendererJob.
+
+
+class RenderJobSignals(QObject):
+    """Signals of an InvoiceRenderJob, delivered on the GUI thread."""
+    progress = pyqtSignal(int, int)  # items drawn, total items
+    finished = pyqtSignal(str, str)  # invoice number, warning or ""
+    cancelled = pyqtSignal()
+    failed = pyqtSignal(str)         # error message
+
+
+class InvoiceRenderJob(QRunnable):
+    """Allocate a number for an invoice, render it and save the metadata.
+
+    Runs on a QThreadPool. The number is allocated in a short metadata
+    transaction and the render runs outside the metadata lock, so batch
+    runs and the render service are not held up by a long render. If the
+    render fails or is cancelled the number is given back, when nobody
+    allocated after it, and nothing else is saved. The written invoice is
+    recorded in the invoice ledger.
+
+    `failed` is only emitted when no PDF was written. Once it is, the
+    number is used, so a failure to save the form or to record the
+    invoice is reported as a warning with `finished`; reporting it as a
+    failure would have the user generate the same invoice again.
+    """
+
+    def __init__(self, invoice, language, include_vat, include_note):
+        super().__init__()
+        self.invoice = invoice
+        self.language = language
+        self.include_vat = include_vat
+        self.include_note = include_note
+        self.signals = RenderJobSignals()
+        self._cancel_event = threading.Event()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def _progress(self, count):
+        if self._cancel_event.is_set():
+            from invoice_generator import RenderCancelled
+            raise RenderCancelled()
+        self.signals.progress.emit(count, len(self.invoice.items))
+
+    def run(self):
+        from invoice_generator import RenderCancelled, generate_invoice_pdf, generate_invoice_pdf_slovene
+        invoice = self.invoice
+        try:
+            numbers = allocate_invoice_numbers(1)
+            invoice.invoice_number = numbers[0]
+            try:
+                if self.language == "Slovene":
+                    path = generate_invoice_pdf_slovene(invoice, self.include_vat, self.include_note,
+                                                        progress=self._progress)
+                else:
+                    path = generate_invoice_pdf(invoice, self.include_vat, self.include_note,
+                                                progress=self._progress)
+            except BaseException:
+                release_invoice_numbers(numbers)
+                raise
+        except RenderCancelled:
+            self.signals.cancelled.emit()
+            return
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+        warnings = []
+        try:
+            with metadata_transaction():
+                save_invoice_options(self.include_vat, self.language, self.include_note)
+                save_last_items(invoice.items)
+                save_last_info(invoice.contractor_info, invoice.client_info)
+        except Exception as e:
+            warnings.append(f"The form could not be saved: {e}")
+        try:
+            record_invoice(invoice, self.language, self.include_vat, self.include_note, os.path.abspath(path))
+        except Exception as e:
+            warnings.append(f"The invoice could not be recorded in the ledger: {e}")
+        self.signals.finished.emit(invoice.invoice_number, "\n".join(warnings))
+
+
+class PreloadSignals(QObject):
+    finished = pyqtSignal()
+
+
+class PreloadRendererJob(QRunnable):
+    """Import reportlab and parse the fonts ahead of the first render."""
+
+    def __init__(self):
+        super().__init__()
+        self.signals = PreloadSignals()
+
+    def run(self):
+        from invoice_generator import register_fonts
+        register_fonts()
+        self.signals.finished.emit()
+
+
+class PreviewSignals(QObject):
+    # generation, content key, QImage or None when cancelled or failed
+    finished = pyqtSignal(int, str, object)
+
+
+class PreviewRenderJob(QRunnable):
+    """Rasterize the first page of an invoice for the preview pane.
+
+    The invoice carries a placeholder number, nothing is allocated or
+    saved. cancel() stops the render at the next progress check.
+    """
+
+    def __init__(self, generation, key, invoice, language, include_vat, include_note, width):
+        super().__init__()
+        self.generation = generation
+        self.key = key
+        self.invoice = invoice
+        self.language = language
+        self.include_vat = include_vat
+        self.include_note = include_note
+        self.width = width
+        self.signals = PreviewSignals()
+        self._cancel_event = threading.Event()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def is_cancelled(self):
+        return self._cancel_event.is_set()
+
+    def _progress(self, count):
+        if self._cancel_event.is_set():
+            from invoice_generator import RenderCancelled
+            raise RenderCancelled()
+
+    def run(self):
+        from gui_preview import render_first_page
+        image = None
+        try:
+            image = render_first_page(self.invoice, self.language, self.include_vat, self.include_note,
+                                      self.width, self._progress)
+        except Exception:
+            # RenderCancelled or a form state the renderer rejects; the
+            # preview keeps showing the last good page.
+            pass
+        self.signals.finished.emit(self.generation, self.key, image)
@@ -0,0 +1,302 @@
+"""Phase timings and counters of the invoice pipeline.
+
+Disabled by default. Enable it with enable() or by setting the
+INVOICE_INSTRUMENTATION environment variable to "1", or to "memory" to
+also record tracemalloc peaks per span (process wide, so allocations of
+other threads count too). With INVOICE_METRICS_FILE set the collected
+data is written there when the process exits, as Prometheus text if the
+name ends in ".prom" and as JSON lines otherwise.
+
+    with instrumentation.span("render", invoice="2025-001"):
+        ...
+    instrumentation.count("items", 120)
+
+While disabled, span() returns a shared no-op context manager and
+count() returns immediately. Hot loops check `enabled` once and pick
+the plain or the timed() function, so they pay nothing per call.
+
+A span is logged as an event and added to the per-name totals; timed()
+functions only add to the totals. Worker processes hand their data to
+the parent with snapshot() and merge().
+"""
+import atexit
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+ENV_VAR = "INVOICE_INSTRUMENTATION"
+METRICS_FILE_ENV_VAR = "INVOICE_METRICS_FILE"
+PROMETHEUS_PREFIX = "invoice"
+
+enabled = False
+trace_memory = False
+
+_lock = threading.Lock()
+_local = threading.local()  # per thread stack of open spans
+_events = deque()  # finished spans: dicts with name, start, duration, attrs and memory_peak
+_totals = {}    # span name -> [count, total seconds, max seconds]
+_counters = {}  # counter name -> value
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _add_total(name, duration):
+    entry = _totals.get(name)
+    if entry is None:
+        entry = _totals[name] = [0, 0.0, 0.0]
+    entry[0] += 1
+    entry[1] += duration
+    if duration > entry[2]:
+        entry[2] = duration
+
+
+class _Span:
+    __slots__ = ("name", "attrs", "start", "memory_start", "memory_peak")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """Attach more attributes, e.g. results known only at the end."""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+        self.memory_start = None
+        self.memory_peak = None
+        if trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            # The peak is reset for this span, the enclosing span keeps the
+            # highest peak seen so far in memory_peak.
+            if len(stack) > 1:
+                parent = stack[-2]
+                parent.memory_peak = max(parent.memory_peak or 0, peak)
+            tracemalloc.reset_peak()
+            self.memory_start = current
+            self.memory_peak = current
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        stack = _local.stack
+        stack.pop()
+        event = {"name": self.name, "start": time.time() - duration, "duration": duration}
+        if self.attrs:
+            event["attrs"] = self.attrs
+        if exc_type is not None:
+            event["error"] = exc_type.__name__
+        if self.memory_start is not None:
+            peak = max(tracemalloc.get_traced_memory()[1], self.memory_peak)
+            event["memory_peak"] = peak - self.memory_start
+            if stack:
+                stack[-1].memory_peak = max(stack[-1].memory_peak or 0, peak)
+        with _lock:
+            _events.append(event)
+            _add_total(self.name, duration)
+        return False
+
+
+def span(name, **attrs):
+    """Context manager timing a phase, a no-op while disabled."""
+    if not enabled:
+        return _NULL_SPAN
+    return _Span(name, attrs)
+
+
+def count(name, value=1):
+    """Add `value` to a counter, e.g. items, pages or bytes."""
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def timed(name, func):
+    """Wrap func so every call adds to the totals of `name`.
+
+    The wrapper checks `enabled` on each call; code running func in a
+    hot loop should instead use the wrapper only when enabled.
+    """
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            with _lock:
+                _add_total(name, duration)
+    wrapper.__wrapped__ = func
+    return wrapper
+
+
+def enable(memory=False, max_events=None):
+    """Start collecting. With memory=True spans also record the peak of
+    memory allocated while they ran, via tracemalloc. `max_events` keeps
+    only the latest span events, for long running processes; the totals
+    and counters are kept in full either way."""
+    global enabled, trace_memory, _events
+    enabled = True
+    trace_memory = memory
+    with _lock:
+        _events = deque(_events, maxlen=max_events)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global enabled, trace_memory
+    enabled = False
+    if trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    trace_memory = False
+
+
+def config():
+    """Settings to hand to a worker process, None while disabled."""
+    return {"memory": trace_memory} if enabled else None
+
+
+def configure(settings):
+    """Apply config() of another process."""
+    if settings is not None and not enabled:
+        enable(**settings)
+
+
+def reset():
+    """Forget everything collected so far."""
+    with _lock:
+        _events.clear()
+        _totals.clear()
+        _counters.clear()
+
+
+def snapshot(clear=False):
+    """Return the collected data as plain, picklable dicts."""
+    with _lock:
+        data = {
+            "events": list(_events),
+            "totals": {name: list(entry) for name, entry in _totals.items()},
+            "counters": dict(_counters),
+        }
+        if clear:
+            _events.clear()
+            _totals.clear()
+            _counters.clear()
+    return data
+
+
+def merge(data):
+    """Add a snapshot, e.g. of a worker process, to this process' data."""
+    with _lock:
+        _events.extend(data["events"])
+        for name, (calls, total, longest) in data["totals"].items():
+            entry = _totals.setdefault(name, [0, 0.0, 0.0])
+            entry[0] += calls
+            entry[1] += total
+            entry[2] = max(entry[2], longest)
+        for name, value in data["counters"].items():
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def jsonl_lines(data=None):
+    """JSON lines: one per span event, then one per span total and counter."""
+    data = data or snapshot()
+    for event in data["events"]:
+        yield json.dumps(dict(event, type="span"))
+    for name, (calls, total, longest) in sorted(data["totals"].items()):
+        yield json.dumps({"type": "total", "name": name, "count": calls, "seconds": total, "max": longest})
+    for name, value in sorted(data["counters"].items()):
+        yield json.dumps({"type": "counter", "name": name, "value": value})
+
+
+def _metric_name(name):
+    return "".join(ch if ch.isalnum() else "_" for ch in name)
+
+
+def prometheus_text(data=None):
+    """Span totals and counters in the Prometheus text exposition format."""
+    data = data or snapshot()
+    prefix = PROMETHEUS_PREFIX
+    lines = [
+        f"# HELP {prefix}_span_seconds_total Time spent in each phase.",
+        f"# TYPE {prefix}_span_seconds_total counter",
+    ]
+    totals = sorted(data["totals"].items())
+    for name, (_, total, _) in totals:
+        lines.append(f'{prefix}_span_seconds_total{{span="{name}"}} {total:.6f}')
+    lines += [
+        f"# HELP {prefix}_span_calls_total Number of times each phase ran.",
+        f"# TYPE {prefix}_span_calls_total counter",
+    ]
+    for name, (calls, _, _) in totals:
+        lines.append(f'{prefix}_span_calls_total{{span="{name}"}} {calls}')
+    lines += [
+        f"# HELP {prefix}_span_max_seconds Longest single run of each phase.",
+        f"# TYPE {prefix}_span_max_seconds gauge",
+    ]
+    for name, (_, _, longest) in totals:
+        lines.append(f'{prefix}_span_max_seconds{{span="{name}"}} {longest:.6f}')
+    peaks = {}
+    for event in data["events"]:
+        if "memory_peak" in event:
+            peaks[event["name"]] = max(peaks.get(event["name"], 0), event["memory_peak"])
+    if peaks:
+        lines += [
+            f"# HELP {prefix}_span_memory_peak_bytes Highest memory allocated during each phase.",
+            f"# TYPE {prefix}_span_memory_peak_bytes gauge",
+        ]
+        for name, peak in sorted(peaks.items()):
+            lines.append(f'{prefix}_span_memory_peak_bytes{{span="{name}"}} {peak}')
+    for name, value in sorted(data["counters"].items()):
+        metric = f"{prefix}_{_metric_name(name)}_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path, data=None):
+    """Write the collected data to `path`, Prometheus text for ".prom"
+    files and JSON lines otherwise. The file is replaced atomically, so
+    a collector never reads it half written."""
+    data = data or snapshot()
+    if path.endswith(".prom"):
+        text = prometheus_text(data)
+    else:
+        text = "".join(line + "\n" for line in jsonl_lines(data))
+    # Imported here, atomic_io itself reports its fsyncs to this module
+    from atomic_io import write_atomic
+    # Metrics are rewritten often and cheap to lose, so no fsync
+    write_atomic(path, text, sync=False)
+
+
+def _configure_from_env():
+    setting = os.environ.get(ENV_VAR, "").strip().lower()
+    if setting and setting not in ("0", "false", "no", "off"):
+        enable(memory=setting == "memory")
+        path = os.environ.get(METRICS_FILE_ENV_VAR)
+        if path:
+            atexit.register(lambda: write_metrics(path))
+
+
+_configure_from_env()
@@ -3,271 +3,517 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.units import mm
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfbase import pdfmetrics
-import textwrap
+import io
+import os
+import threading
 
-pdfmetrics.registerFont(TTFont('DejaVu', 'DejaVuSans.ttf'))
-pdfmetrics.registerFont(TTFont('DejaVu-Bold', 'DejaVuSans-Bold.ttf'))
+import instrumentation
+from atomic_io import atomic_write
+from invoice_layout import compile_layout, FONT_DIR, FONTS, MARGIN, PAGE_HEIGHT, PAGE_WIDTH, RIGHT_EDGE
+from invoice_model import InvoiceTotals
+from text_layout import wrap_text
 
-def generate_invoice_pdf(invoice, include_vat, include_note):
-    """Generate an invoice PDF in English."""
-    file_name = f"{invoice.invoice_number}.pdf"
-    c = canvas.Canvas(file_name, pagesize=A4)
-    width, height = A4
-    margin = 20 * mm
-    y = height - margin
+_fonts_registered = False
+_fonts_lock = threading.Lock()
 
-    # Header
-    c.setFont("DejaVu-Bold", 16)
-    c.drawString(margin, y, f"Invoice number: {invoice.invoice_number}")
-    y -= 20
-    c.setFont("DejaVu", 10)
-    c.drawString(margin, y, f"Issue Date: {invoice.issue_date}")
-    y -= 15
-    c.drawString(margin, y, f"Due Date: {invoice.due_date}")
-    y -= 30
+def register_fonts():
+    """Parse and register the TTF fonts with reportlab, once per process.
 
-    # Contractor Information
-    c.setFont("DejaVu-Bold", 12)
-    c.drawString(margin, y, "From:")
-    y -= 15
-    c.setFont("DejaVu", 10)
-    contractor = invoice.contractor_info
-    c.drawString(margin, y, contractor.get("company_name", ""))
-    y -= 13
-    c.drawString(margin, y, contractor.get("address", ""))
-    y -= 13
-    c.drawString(margin, y, f"Registration Number: {contractor.get('registration_number')}")
-    y -= 13
-    c.drawString(margin, y, f"VAT Number: {contractor.get('vat_number')}")
-    y -= 13
-    c.drawString(margin, y, f"Bank Info: {contractor.get('bank_info', '')}")
-    y -= 13
-    c.drawString(margin, y, f"SWIFT: {contractor.get('swift', '')}")
-    y -= 30
+    The generators call this on first render. Call it before starting a
+    forked worker pool so the workers inherit the already parsed fonts.
+    It is safe to call from several threads, e.g. to preload the fonts
+    in the background.
+    """
+    global _fonts_registered
+    if _fonts_registered:
+        return
+    with _fonts_lock:
+        if not _fonts_registered:
+            with instrumentation.span("fonts.register"):
+                _register_fonts()
+            _fonts_registered = True
 
-    # Client Information
-    c.setFont("DejaVu-Bold", 12)
-    c.drawString(margin, y, "Bill To:")
-    y -= 15
-    c.setFont("DejaVu", 10)
-    client = invoice.client_info
-    c.drawString(margin, y, client.get("company_name", ""))
-    y -= 13
-    c.drawString(margin, y, client.get("address", ""))
-    if client.get("registration_number"):
-        y -= 13
-        c.drawString(margin, y, f"Registration Number: {client.get('registration_number')}")
-    if client.get("vat_number"):
-        y -= 13
-        c.drawString(margin, y, f"VAT Number: {client.get('vat_number')}")
-    y -= 100
+def _register_fonts():
+    for name, file_name in FONTS.items():
+        # Without asciiReadable, subsets hold only the glyphs actually drawn
+        # instead of always starting with all of printable ASCII.
+        font = TTFont(name, os.path.join(FONT_DIR, file_name), asciiReadable=False)
+        # reportlab subsets and embeds the font during canvas.save()
+        font.addObjects = instrumentation.timed("fonts.embed", font.addObjects)
+        pdfmetrics.registerFont(font)
 
-    # Invoice Items Table
+# Lowest y an item line may be drawn at before the table continues on the
+# next page; leaves room for the "carried forward" line below it.
+ITEMS_BOTTOM = 20 * mm + 30
+LINE_HEIGHT = 15
+RECAP_LINE_HEIGHT = 13
+NOTE_LINE_HEIGHT = 11
+# Gap between the totals and the reverse charge note
+NOTE_GAP = 100
+# Number of items between two calls of the progress callback.
+PROGRESS_INTERVAL = 50
+# Contractor fields printed in the contractor block.
+CONTRACTOR_FIELDS = ("company_name", "address", "registration_number", "vat_number", "bank_info", "swift")
+
+# Canvas options per output profile. Every profile embeds only the glyphs
+# an invoice uses from each font, see register_fonts. "reproducible" pins the
+# creation date and document ID, so the same invoice always renders to
+# the same bytes; "uncompressed" keeps content streams readable.
+OUTPUT_PROFILES = {
+    "compact": {"pageCompression": 1, "invariant": 0},
+    "reproducible": {"pageCompression": 1, "invariant": 1},
+    "uncompressed": {"pageCompression": 0, "invariant": 0},
+}
+DEFAULT_PROFILE = "compact"
+
+class RenderCancelled(Exception):
+    """Raised by a progress callback to abort a render."""
+
+class RenderReport:
+    """Size report of one rendered invoice.
+
+    `glyphs` maps each embedded font to the number of glyphs in its
+    subset, `path` is set when the invoice was written to a file.
+    """
+    __slots__ = ("invoice_number", "profile", "size", "pages", "glyphs", "path")
+
+    def __init__(self, invoice_number, profile, size, pages, glyphs, path=None):
+        self.invoice_number = invoice_number
+        self.profile = profile
+        self.size = size
+        self.pages = pages
+        self.glyphs = glyphs
+        self.path = path
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class _CountingStream:
+    """Write-through wrapper counting the bytes written to a stream."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return self.stream.write(data)
+
+    def flush(self):
+        flush = getattr(self.stream, "flush", None)
+        if flush:
+            flush()
+
+def _embedded_glyphs(c):
+    """Number of glyphs embedded per font in the document of canvas c."""
+    glyphs = {}
+    for name in FONTS:
+        state = pdfmetrics.getFont(name).state.get(c._doc)
+        if state is not None:
+            # Unused slots of the first subset are padded with 0 (.notdef).
+            glyphs[name] = len({code for subset in state.subsets for code in subset if code})
+    return glyphs
+
+class _StaticForms:
+    """Form XObjects of the blocks that repeat across the invoices of a
+    statement: the contractor block, the table header and the note.
+
+    Each block is defined once per document and key, then referenced
+    from every page it appears on.
+    """
+
+    def __init__(self, c):
+        self.canvas = c
+        self._forms = {}  # key -> (form name, y offset, font after the block)
+
+    def draw(self, key, y, draw, *args):
+        """Draw the block `draw(c, *args, y)` with its top at y and return
+        the y the block ends at, like calling draw directly."""
+        c = self.canvas
+        form = self._forms.get(key)
+        if form is None:
+            name = f"Static{len(self._forms)}"
+            # The block is drawn downwards from 0, the bounding box only
+            # needs to contain it.
+            c.beginForm(name, lowerx=0, lowery=-PAGE_HEIGHT, upperx=PAGE_WIDTH, uppery=PAGE_HEIGHT)
+            end = draw(c, *args, 0)
+            font = (c._fontname, c._fontsize)
+            c.endForm()
+            form = self._forms[key] = (name, end, font)
+        name, end, font = form
+        c.saveState()
+        c.translate(0, y)
+        c.doForm(name)
+        c.restoreState()
+        c.setFont(*font)
+        return y + end
+
+def _draw_block(c, forms, key, y, draw, *args):
+    if forms is None:
+        return draw(c, *args, y)
+    return forms.draw(key, y, draw, *args)
+
+def _draw_table_header(c, plan, y):
     c.setFont("DejaVu-Bold", 10)
-    if include_vat:
-        # Header with VAT columns
-        c.drawRightString(margin + 238, y, "Unit")
-        c.drawRightString(margin + 338, y, "VAT")
-        c.drawRightString(margin + 416, y, "VAT")
-        y -= 12
-        c.drawString(margin, y, "Description")
-        c.drawRightString(margin + 238, y, "Price (EUR)")
-        c.drawRightString(margin + 289, y, "Quantity")
-        c.drawRightString(margin + 338, y, "Rate (%)")
-        c.drawRightString(margin + 416, y, "Amount (EUR)")
-        c.drawRightString(width - margin, y, "Total (EUR)")
-    else:
-        # Header without VAT columns
-        c.drawString(margin, y, "Description")
-        c.drawRightString(margin + 330, y, "Unit Price (EUR)")
-        c.drawRightString(margin + 400, y, "Quantity")
-        c.drawRightString(width - margin, y, "Total (EUR)")
+    for row, cells in enumerate(plan.header_rows):
+        if row:
+            y -= 12
+        for x, text, right_aligned in cells:
+            if right_aligned:
+                c.drawRightString(x, y, text)
+            else:
+                c.drawString(x, y, text)
     y -= 15
     c.setFont("DejaVu", 10)
-    c.line(margin, y, width - margin, y)
-    y -= 10
+    c.line(MARGIN, y, RIGHT_EDGE, y)
+    y -= plan.header_gap
+    return y
+
+def _draw_header_block(c, plan, y, forms=None):
+    return _draw_block(c, forms, ("header", plan.language, plan.include_vat), y, _draw_table_header, plan)
 
-    # List invoice items with wrapped description
-    for item in invoice.items:
-        wrapped_desc = textwrap.wrap(item.description, width=25)
-        for i, line in enumerate(wrapped_desc):
-            c.drawString(margin, y, line)
-            # Only on the first line print the rest of the columns
-            if i == 0:
-                if include_vat:
-                    c.drawRightString(margin + 238, y, f"{item.unit_price:.2f}")
-                    c.drawRightString(margin + 289, y, f"{item.quantity}")
-                    c.drawRightString(margin + 338, y, f"{item.vat_rate:.2f}")
-                    c.drawRightString(margin + 416, y, f"{item.vat_amount:.2f}")
-                    c.drawRightString(width - margin, y, f"{item.total_gross:.2f}")
-                else:
-                    c.drawRightString(margin + 330, y, f"{item.unit_price:.2f}")
-                    c.drawRightString(margin + 400, y, f"{item.quantity}")
-                    c.drawRightString(width - margin, y, f"{item.total_net:.2f}")
+def _draw_items_table(c, plan, invoice, items, y, progress=None, forms=None):
+    """Draw the item rows, starting a new page whenever the current one is full.
+
+    `items` may be any iterable, including a generator: rows are drawn as
+    they are produced and every finished page is closed with showPage, so
+    no item needs to be kept once it is on the page. The table header is
+    repeated on every page and the running total of the last column is
+    carried over between pages.
+
+    progress(count), if given, is called with the number of items drawn
+    so far every PROGRESS_INTERVAL items and once at the end; it may
+    raise RenderCancelled to abort the render.
+
+    `forms`, when given, is the _StaticForms of a statement and the
+    table header is drawn from it.
+
+    Returns (y, totals) with the InvoiceTotals accumulated over all items.
+    """
+    labels = plan.labels
+    format_amount = plan.format_amount
+    item_cells = plan.item_cells
+    description_width = plan.description_width
+    draw_string = c.drawString
+    draw_right_string = c.drawRightString
+    wrap = instrumentation.timed("wrap", wrap_text) if instrumentation.enabled else wrap_text
+    # Running totals in integer cents, exact however many lines there are
+    totals = InvoiceTotals()
+    count = 0
+    y = _draw_header_block(c, plan, y, forms)
+    for item in items:
+        if progress is not None and count % PROGRESS_INTERVAL == 0:
+            progress(count)
+        count += 1
+        lines = wrap(item.description, description_width)
+        if y - LINE_HEIGHT * (len(lines) - 1) < ITEMS_BOTTOM:
+            running = format_amount(totals.total_gross if plan.include_vat else totals.total_net)
+            y -= 10
+            c.line(MARGIN, y, RIGHT_EDGE, y)
             y -= 15
+            c.setFont("DejaVu", 10)
+            draw_right_string(RIGHT_EDGE, y, f"{labels['carried_forward']} {running} EUR")
+            y = _next_page(c, plan, invoice)
+            y = _draw_header_block(c, plan, y, forms)
+            draw_right_string(RIGHT_EDGE, y, f"{labels['brought_forward']} {running} EUR")
+            y -= LINE_HEIGHT
+        draw_string(MARGIN, y, lines[0])
+        # Only on the first line print the rest of the columns
+        for x, value, formatter in item_cells:
+            draw_right_string(x, y, formatter(value(item)))
+        y -= LINE_HEIGHT
+        for line in lines[1:]:
+            draw_string(MARGIN, y, line)
+            y -= LINE_HEIGHT
+        totals.add(item)
+    if progress is not None:
+        progress(count)
 
     y -= 10
-    c.line(margin, y, width - margin, y)
+    c.line(MARGIN, y, RIGHT_EDGE, y)
     y -= 20
+    if y - _totals_height(plan, totals) < MARGIN:
+        y = _next_page(c, plan, invoice)
+    return y, totals
 
-    # Totals
-    if include_vat:
-        subtotal_net = invoice.total_net
-        total_vat = invoice.total_vat
-        grand_total = subtotal_net + total_vat
-        c.setFont("DejaVu", 12)
-        c.drawRightString(width - margin, y, f"Subtotal: {subtotal_net:.2f} EUR")
-        y -= 15
-        c.drawRightString(width - margin, y, f"VAT: {total_vat:.2f} EUR")
-        y -= 15
-        c.setFont("DejaVu-Bold", 12)
-        c.drawRightString(width - margin, y, f"Total: {grand_total:.2f} EUR")
-    else:
-        total = invoice.total_net  # net equals gross if no VAT
-        c.setFont("DejaVu-Bold", 12)
-        c.drawRightString(width - margin, y, f"Total: {total:.2f} EUR")
-    y -= 100
+def _next_page(c, plan, invoice):
+    """Start a continuation page headed by the invoice number; returns y."""
+    c.showPage()
+    y = PAGE_HEIGHT - MARGIN
+    c.setFont("DejaVu-Bold", 10)
+    c.drawString(MARGIN, y, f"{plan.labels['invoice_number']} {invoice.invoice_number}")
+    return y - 30
 
-    if include_note:
-        c.setFont("DejaVu", 9)
-        note = ["Note: VAT is not charged according to the Article 44 of the Directive ",
-                "EU 2006/112/ES – reverse charge (for recipient)."]
-        c.drawString(margin, y, note[0])
-        y -= 11
-        c.drawString(margin, y, note[1])
+def _totals_height(plan, totals):
+    """Distance from the first to the last baseline of what _draw_invoice
+    draws below the items: the VAT recap, the totals and the note."""
+    height = 0
+    recap = _vat_recap(plan, totals)
+    if recap:
+        height += RECAP_LINE_HEIGHT * len(recap) + 5
+    if plan.include_vat:
+        height += 15 + (25 if plan.vat_total_rule else 15)
+    if plan.note:
+        height += NOTE_GAP + NOTE_LINE_HEIGHT * (len(plan.note) - 1)
+    return height
 
-    c.showPage()
-    c.save()
+def _vat_recap(plan, totals):
+    """Per VAT rate lines printed above the totals, when rates are mixed."""
+    if not plan.include_vat or len(totals.by_rate) < 2:
+        return []
+    return totals.vat_breakdown()
+
+def _draw_contractor(c, plan, contractor, y):
+    labels = plan.labels
+    c.setFont("DejaVu-Bold", 12)
+    c.drawString(MARGIN, y, labels["contractor"])
+    y -= 15
+    c.setFont("DejaVu", 10)
+    c.drawString(MARGIN, y, contractor.get("company_name", ""))
+    y -= 13
+    c.drawString(MARGIN, y, contractor.get("address", ""))
+    y -= 13
+    c.drawString(MARGIN, y, f"{labels['registration_number']} {contractor.get('registration_number')}")
+    y -= 13
+    c.drawString(MARGIN, y, f"{labels['vat_number']} {contractor.get('vat_number')}")
+    y -= 13
+    c.drawString(MARGIN, y, f"{labels['bank_info']} {contractor.get('bank_info', '')}")
+    y -= 13
+    c.drawString(MARGIN, y, f"{labels['swift']} {contractor.get('swift', '')}")
+    return y
+
+def _contractor_key(contractor):
+    return tuple(str(contractor.get(field)) for field in CONTRACTOR_FIELDS)
+
+def _draw_note(c, plan, y):
+    c.setFont("DejaVu", 9)
+    for line in plan.note:
+        c.drawString(MARGIN, y, line)
+        y -= NOTE_LINE_HEIGHT
+    return y
+
+def _draw_invoice(c, plan, invoice, items, progress=None, forms=None):
+    """Draw an invoice onto the canvas following the layout plan.
 
-def generate_invoice_pdf_slovene(invoice, include_vat, include_note):
-    """Generate an invoice PDF in Slovene."""
-    file_name = f"{invoice.invoice_number}.pdf"
-    c = canvas.Canvas(file_name, pagesize=A4)
-    width, height = A4
-    margin = 20 * mm
-    y = height - margin
+    With `forms` (a _StaticForms) the blocks that are the same across
+    invoices are drawn as shared form XObjects. Returns the InvoiceTotals
+    of the drawn items.
+    """
+    labels = plan.labels
+    y = PAGE_HEIGHT - MARGIN
 
     # Header
     c.setFont("DejaVu-Bold", 16)
-    c.drawString(margin, y, f"Račun številka: {invoice.invoice_number}")
+    c.drawString(MARGIN, y, f"{labels['invoice_number']} {invoice.invoice_number}")
     y -= 20
     c.setFont("DejaVu", 10)
-    c.drawString(margin, y, f"Datum izdaje: {invoice.issue_date}")
+    c.drawString(MARGIN, y, f"{labels['issue_date']} {invoice.issue_date}")
     y -= 15
-    c.drawString(margin, y, f"Datum zapadlosti: {invoice.due_date}")
+    c.drawString(MARGIN, y, f"{labels['due_date']} {invoice.due_date}")
     y -= 30
 
     # Contractor Information
-    c.setFont("DejaVu-Bold", 12)
-    c.drawString(margin, y, "Izvajalec:")
-    y -= 15
-    c.setFont("DejaVu", 10)
     contractor = invoice.contractor_info
-    c.drawString(margin, y, contractor.get("company_name", ""))
-    y -= 13
-    c.drawString(margin, y, contractor.get("address", ""))
-    y -= 13
-    c.drawString(margin, y, f"Matična številka: {contractor.get('registration_number')}")
-    y -= 13
-    c.drawString(margin, y, f"Davčna številka: {contractor.get('vat_number')}")
-    y -= 13
-    c.drawString(margin, y, f"TRR: {contractor.get('bank_info', '')}")
-    y -= 13
-    c.drawString(margin, y, f"SWIFT: {contractor.get('swift', '')}")
+    y = _draw_block(c, forms, ("contractor", plan.language, plan.include_vat, _contractor_key(contractor)),
+                    y, _draw_contractor, plan, contractor)
     y -= 30
 
     # Client Information
     c.setFont("DejaVu-Bold", 12)
-    c.drawString(margin, y, "Naročnik:")
+    c.drawString(MARGIN, y, labels["client"])
     y -= 15
     c.setFont("DejaVu", 10)
     client = invoice.client_info
-    c.drawString(margin, y, client.get("company_name", ""))
+    c.drawString(MARGIN, y, client.get("company_name", ""))
     y -= 13
-    c.drawString(margin, y, client.get("address", ""))
+    c.drawString(MARGIN, y, client.get("address", ""))
     if client.get("registration_number"):
         y -= 13
-        c.drawString(margin, y, f"Matična številka: {client.get('registration_number')}")
+        c.drawString(MARGIN, y, f"{labels['registration_number']} {client.get('registration_number')}")
     if client.get("vat_number"):
         y -= 13
-        c.drawString(margin, y, f"Davčna številka: {client.get('vat_number')}")
+        c.drawString(MARGIN, y, f"{labels['vat_number']} {client.get('vat_number')}")
     y -= 100
 
     # Invoice Items Table
-    c.setFont("DejaVu-Bold", 10)
-    if include_vat:
-        # Header with VAT columns
-        c.drawRightString(margin + 222, y, "Cena na")
-        c.drawRightString(margin + 331, y, "Stopnja")
-        c.drawRightString(margin + 400, y, "Znesek")
-        y -= 12
-        c.drawString(margin, y, "Opis")
-        c.drawRightString(margin + 222, y, "enoto (EUR)")
-        c.drawRightString(margin + 275, y, "Količina")
-        c.drawRightString(margin + 331, y, "DDV (%)")
-        c.drawRightString(margin + 400, y, "DDV (EUR)")
-        c.drawRightString(width - margin, y, "Skupaj (EUR)")
-    else:
-        # Header without VAT columns
-        c.drawString(margin, y, "Opis")
-        c.drawRightString(margin + 330, y, "Cena na enoto (EUR)")
-        c.drawRightString(margin + 400, y, "Količina")
-        c.drawRightString(width - margin, y, "Skupaj (EUR)")
-    y -= 15
-    c.setFont("DejaVu", 10)
-    c.line(margin, y, width - margin, y)
-    y -= 13
-
-    # List invoice items with wrapped description
-    for item in invoice.items:
-        wrapped_desc = textwrap.wrap(item.description, width=25)
-        for i, line in enumerate(wrapped_desc):
-            c.drawString(margin, y, line)
-            if i == 0:
-                if include_vat:
-                    c.drawRightString(margin + 222, y, f"{item.unit_price:.2f}".replace(".", ","))
-                    c.drawRightString(margin + 275, y, f"{item.quantity}")
-                    c.drawRightString(margin + 331, y, f"{item.vat_rate:.2f}".replace(".", ","))
-                    c.drawRightString(margin + 400, y, f"{item.vat_amount:.2f}".replace(".", ","))
-                    c.drawRightString(width - margin, y, f"{item.total_gross:.2f}".replace(".", ","))
-                else:
-                    c.drawRightString(margin + 330, y, f"{item.unit_price:.2f}".replace(".", ","))
-                    c.drawRightString(margin + 400, y, f"{item.quantity}")
-                    c.drawRightString(width - margin, y, f"{item.total_net:.2f}".replace(".", ","))
-            y -= 15
-
-    y -= 10
-    c.line(margin, y, width - margin, y)
-    y -= 20
+    y, totals = _draw_items_table(
+        c, plan, invoice, items if items is not None else invoice.items, y, progress, forms
+    )
 
     # Totals
-    if include_vat:
-        subtotal_net = invoice.total_net
-        total_vat = invoice.total_vat
-        grand_total = subtotal_net + total_vat
+    format_amount = plan.format_amount
+    subtotal_net = totals.total_net
+    total_vat = totals.total_vat
+    recap = _vat_recap(plan, totals)
+    if recap:
+        c.setFont("DejaVu", 10)
+        for vat_rate, net, vat in recap:
+            label = labels["vat_recap"].format(rate=format_amount(vat_rate), base=format_amount(net))
+            c.drawRightString(RIGHT_EDGE, y, f"{label} {format_amount(vat)} EUR")
+            y -= RECAP_LINE_HEIGHT
+        y -= 5
+    if plan.include_vat:
+        grand_total = totals.total_gross
         c.setFont("DejaVu", 12)
-        c.drawRightString(width - margin, y, f"Skupaj brez DDV: {subtotal_net:.2f} EUR".replace(".", ","))
+        c.drawRightString(RIGHT_EDGE, y, f"{labels['subtotal']} {format_amount(subtotal_net)} EUR")
         y -= 15
-        c.drawRightString(width - margin, y, f"DDV: {total_vat:.2f} EUR".replace(".", ","))
-        y -= 7
-        c.line(350, y, width - margin, y)
-        y -= 18
+        c.drawRightString(RIGHT_EDGE, y, f"{labels['vat']} {format_amount(total_vat)} EUR")
+        if plan.vat_total_rule:
+            y -= 7
+            c.line(350, y, RIGHT_EDGE, y)
+            y -= 18
+        else:
+            y -= 15
         c.setFont("DejaVu-Bold", 12)
-        c.drawRightString(width - margin, y, f"Skupaj z DDV: {grand_total:.2f} EUR".replace(".", ","))
+        c.drawRightString(RIGHT_EDGE, y, f"{labels['total_with_vat']} {format_amount(grand_total)} EUR")
     else:
-        total = invoice.total_net  # net equals gross if no VAT
+        total = subtotal_net  # net equals gross if no VAT
         c.setFont("DejaVu-Bold", 12)
-        c.drawRightString(width - margin, y, f"Skupaj: {total:.2f} EUR".replace(".", ","))
-    y -= 100
+        c.drawRightString(RIGHT_EDGE, y, f"{labels['total']} {format_amount(total)} EUR")
+    y -= NOTE_GAP
 
-    if include_note:
-        c.setFont("DejaVu", 9)
-        note = ["Opomba: DDV se ne obračuna v skladu s 44. členom Direktive EU 2006/112/ES – ",
-                "obratno obračunavanje (za prejemnika)."]
-        c.drawString(margin, y, note[0])
-        y -= 11
-        c.drawString(margin, y, note[1])
+    if plan.note:
+        y = _draw_block(c, forms, ("note", plan.language), y, _draw_note, plan)
 
     c.showPage()
-    c.save()
+    return totals
+
+def draw_invoice(c, invoice, language="English", include_vat=False, include_note=False, progress=None):
+    """Draw an invoice onto `c` without saving it and return its InvoiceTotals.
+
+    `c` is a reportlab canvas or any object with the setFont, drawString,
+    drawRightString, line and showPage methods, e.g. the QPainter canvas
+    of the GUI preview.
+    """
+    register_fonts()
+    plan = compile_layout(language, include_vat, include_note)
+    return _draw_invoice(c, plan, invoice, None, progress)
+
+def _canvas_options(profile):
+    try:
+        return OUTPUT_PROFILES[profile]
+    except KeyError:
+        raise ValueError(f"Unknown output profile: {profile!r}") from None
+
+def render_invoice(invoice, stream, language="English", include_vat=False, include_note=False, items=None,
+                   progress=None, profile=DEFAULT_PROFILE, cache=None):
+    """Render an invoice PDF into a writable binary stream.
+
+    `stream` can be anything with a write() method: an open file, a
+    BytesIO, a socket file or an archive member. `items` optionally
+    replaces invoice.items with any iterable of InvoiceItems, e.g. a
+    generator over a large usage export. `progress` is called with the
+    number of items drawn so far and may raise RenderCancelled.
+    `profile` selects one of OUTPUT_PROFILES. With a render_cache.RenderCache
+    as `cache`, an invoice whose content was rendered before is copied
+    from the cache; `items` bypasses the cache. Returns a RenderReport.
+    """
+    options = _canvas_options(profile)
+    if cache is not None and items is None:
+        return _render_cached(cache, invoice, stream, language, include_vat, include_note, progress, profile)
+    register_fonts()
+    with instrumentation.span("render", invoice=invoice.invoice_number, language=language, profile=profile):
+        plan = compile_layout(language, include_vat, include_note)
+        counter = _CountingStream(stream)
+        c = canvas.Canvas(counter, pagesize=A4, **options)
+        with instrumentation.span("layout"):
+            totals = _draw_invoice(c, plan, invoice, items, progress)
+        pages = c.getPageNumber() - 1
+        glyphs = _embedded_glyphs(c)
+        with instrumentation.span("pdf.save"):
+            c.save()
+    _count_rendered(1, totals.line_count, pages, counter.size)
+    return RenderReport(invoice.invoice_number, profile, counter.size, pages, glyphs)
+
+def _render_cached(cache, invoice, stream, language, include_vat, include_note, progress, profile):
+    key = cache.key(invoice, language, include_vat, include_note, profile)
+    cached = cache.get(key)
+    if cached is not None:
+        data, fields = cached
+        stream.write(data)
+        return RenderReport(invoice.invoice_number, profile, len(data), fields["pages"], fields["glyphs"])
+    buffer = io.BytesIO()
+    report = render_invoice(invoice, buffer, language, include_vat, include_note, None, progress, profile)
+    data = buffer.getvalue()
+    stream.write(data)
+    cache.put(key, data, report.as_dict())
+    return report
+
+def _count_rendered(invoices, items, pages, size):
+    if instrumentation.enabled:
+        instrumentation.count("invoices", invoices)
+        instrumentation.count("items", items)
+        instrumentation.count("pages", pages)
+        instrumentation.count("pdf_bytes", size)
+
+def render_invoice_bytes(invoice, language="English", include_vat=False, include_note=False, items=None,
+                         progress=None, profile=DEFAULT_PROFILE, cache=None):
+    """Render an invoice PDF and return it as bytes."""
+    buffer = io.BytesIO()
+    render_invoice(invoice, buffer, language, include_vat, include_note, items, progress, profile, cache)
+    return buffer.getvalue()
+
+def render_statement(jobs, stream, progress=None, profile=DEFAULT_PROFILE):
+    """Render many invoices one after another into a single PDF.
+
+    `jobs` is an iterable of objects with invoice, language, include_vat
+    and include_note attributes, e.g. batch_renderer.BatchJob. Fonts are
+    embedded once for the whole document, and the contractor block, the
+    table header and the note are each defined once as a form XObject
+    per contractor, language and VAT option and reused on every page.
+    progress(count), if given, is called after every invoice with the
+    number of invoices drawn. Returns a RenderReport of the document.
+    """
+    options = _canvas_options(profile)
+    register_fonts()
+    items = 0
+    with instrumentation.span("statement", profile=profile) as statement_span:
+        counter = _CountingStream(stream)
+        c = canvas.Canvas(counter, pagesize=A4, **options)
+        forms = _StaticForms(c)
+        count = 0
+        with instrumentation.span("layout"):
+            for job in jobs:
+                plan = compile_layout(job.language, job.include_vat, job.include_note)
+                items += _draw_invoice(c, plan, job.invoice, None, forms=forms).line_count
+                count += 1
+                if progress is not None:
+                    progress(count)
+        pages = c.getPageNumber() - 1
+        glyphs = _embedded_glyphs(c)
+        with instrumentation.span("pdf.save"):
+            c.save()
+        statement_span.set(invoices=count)
+    _count_rendered(count, items, pages, counter.size)
+    return RenderReport(None, profile, counter.size, pages, glyphs)
+
+def write_invoice_file(invoice, language="English", include_vat=False, include_note=False, items=None,
+                       output_path=None, progress=None, profile=DEFAULT_PROFILE, cache=None, group=None):
+    """Render an invoice PDF to a file and return its RenderReport.
+
+    The file is written to `output_path`, by default "{invoice_number}.pdf"
+    in the working directory, through atomic_io: a failed or cancelled
+    render, or a crash, never leaves a half written PDF and never
+    clobbers an earlier one. `group` is an optional atomic_io.GroupCommit.
+    """
+    output_path = output_path or f"{invoice.invoice_number}.pdf"
+    with atomic_write(output_path, group=group) as f:
+        report = render_invoice(invoice, f, language, include_vat, include_note, items, progress, profile, cache)
+    report.path = output_path
+    return report
+
+def generate_invoice_pdf(invoice, include_vat, include_note, items=None, output_path=None, progress=None,
+                         profile=DEFAULT_PROFILE):
+    """Generate an invoice PDF in English.
+
+    The file is written to `output_path`, by default "{invoice_number}.pdf"
+    in the working directory. Returns the path of the written file.
+    """
+    return write_invoice_file(invoice, "English", include_vat, include_note, items, output_path, progress,
+                              profile).path
 
+def generate_invoice_pdf_slovene(invoice, include_vat, include_note, items=None, output_path=None, progress=None,
+                                 profile=DEFAULT_PROFILE):
+    """Generate an invoice PDF in Slovene, see generate_invoice_pdf."""
+    return write_invoice_file(invoice, "Slovene", include_vat, include_note, items, output_path, progress,
+                              profile).path
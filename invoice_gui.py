@@ -1,26 +1,38 @@
 import sys
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QFormLayout, QLineEdit, 
-    QPushButton, QTableWidget, QTableWidgetItem, QHeaderView, QGroupBox, 
-    QMessageBox, QAbstractItemView, QComboBox, QCheckBox, QLabel, QStyle
+    QPushButton, QTableView, QHeaderView, QGroupBox, QShortcut, 
+    QMessageBox, QAbstractItemView, QComboBox, QCheckBox, QLabel, QStyle, QCompleter,
+    QProgressBar
 )
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QStringListModel, QThreadPool, QTimer, pyqtSignal
+from PyQt5.QtGui import QKeySequence
 from datetime import datetime, timedelta
 from invoice_model import Invoice, InvoiceItem
-from invoice_metadata import (
-    get_next_invoice_number, load_last_items, save_last_items, 
-    load_last_info, save_last_info, load_invoice_options, save_invoice_options
-)
-from invoice_generator import generate_invoice_pdf, generate_invoice_pdf_slovene
-from client_manager import load_clients
+from invoice_metadata import load_metadata, load_last_items, load_last_info, load_invoice_options
+from client_manager import ClientRegistry
+from gui_models import ClientListModel, InvoiceItemTableModel, client_display_name
+from gui_preview import InvoicePreview
+from gui_workers import InvoiceRenderJob, PreloadRendererJob
 
 class InvoiceGUI(QWidget):
+    # Emitted after the first paint, once the saved state and the clients
+    # are loaded, and once reportlab and the fonts are ready to render.
+    shown = pyqtSignal()
+    loaded = pyqtSignal()
+    rendererReady = pyqtSignal()
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Invoice Generator by Jure Rebernik")
         self.invoice_items = []
-        self.predefined_clients = load_clients()  # load predefined clients from file
+        self.render_job = None  # invoice currently rendered in the background
+        # Indexed predefined clients from file, read by load_deferred
+        self.client_registry = ClientRegistry(load=False)
         self.init_ui()
+        # The window is painted first, everything read from disk follows
+        # on the next pass of the event loop, see paintEvent.
+        self._load_pending = True
         
     def init_ui(self):
         main_layout = QVBoxLayout()
@@ -48,14 +60,25 @@ class InvoiceGUI(QWidget):
         
         # New: Predefined Client dropdown
         self.predefined_client_combo = QComboBox()
-        # First option is "Custom" meaning no predefined client is chosen.
-        self.predefined_client_combo.addItem("Custom")
-        # Then add each predefined client (using their company name as display)
-        for client in self.predefined_clients:
-            self.predefined_client_combo.addItem(client.get("company_name", ""))
+        # First option is "Custom" meaning no predefined client is chosen,
+        # the clients themselves are fetched lazily by the model.
+        self.client_list_model = ClientListModel(self.client_registry, self)
+        self.predefined_client_combo.setModel(self.client_list_model)
         self.predefined_client_combo.currentIndexChanged.connect(self.on_predefined_client_changed)
         client_layout.addRow("Predefined Client:", self.predefined_client_combo)
         
+        # Incremental search over name, VAT and registration number
+        self.client_search_edit = QLineEdit()
+        self.client_search_edit.setPlaceholderText("Search by name, VAT or registration number")
+        self.client_search_model = QStringListModel(self)
+        self.client_search_results = {}
+        completer = QCompleter(self.client_search_model, self)
+        completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        completer.activated[str].connect(self.on_client_search_activated)
+        self.client_search_edit.setCompleter(completer)
+        self.client_search_edit.textEdited.connect(self.on_client_search_edited)
+        client_layout.addRow("Search Client:", self.client_search_edit)
+        
         # Client fields (editable)
         self.client_name_edit = QLineEdit()
         self.client_address_edit = QLineEdit()
@@ -70,21 +93,6 @@ class InvoiceGUI(QWidget):
         main_layout.addWidget(contractor_group)
         main_layout.addWidget(client_group)
         
-        # Load Last Contractor and Client Info (if any)
-        contractor_info, client_info = load_last_info()
-        if contractor_info:
-            self.company_name_edit.setText(contractor_info.get("company_name", ""))
-            self.address_edit.setText(contractor_info.get("address", ""))
-            self.registration_number_edit.setText(contractor_info.get("registration_number", ""))
-            self.vat_number_edit.setText(contractor_info.get("vat_number", ""))
-            self.bank_info_edit.setText(contractor_info.get("bank_info", ""))
-            self.swift_edit.setText(contractor_info.get("swift", ""))
-        if client_info:
-            self.client_name_edit.setText(client_info.get("company_name", ""))
-            self.client_address_edit.setText(client_info.get("address", ""))
-            self.client_registration_edit.setText(client_info.get("registration_number", ""))
-            self.client_vat_edit.setText(client_info.get("vat_number", ""))
-            
         # Invoice Options Group (Vertical Layout; language first)
         options_group = QGroupBox("Invoice Options")
         options_layout = QVBoxLayout()
@@ -114,15 +122,6 @@ class InvoiceGUI(QWidget):
         options_group.setLayout(options_layout)
         main_layout.addWidget(options_group)
         
-        # Load Invoice Options
-        options = load_invoice_options()
-        self.include_vat_checkbox.setChecked(options.get("include_vat", False))
-        language = options.get("language", "English")
-        index = self.language_combo.findText(language)
-        if index >= 0:
-            self.language_combo.setCurrentIndex(index)
-        self.include_note_checkbox.setChecked(options.get("include_note", False))
-            
         # Invoice Item Entry Group (with VAT field)
         item_entry_group = QGroupBox("Add Invoice Item")
         item_entry_layout = QHBoxLayout()
@@ -145,48 +144,151 @@ class InvoiceGUI(QWidget):
         item_entry_group.setLayout(item_entry_layout)
         main_layout.addWidget(item_entry_group)
         
-        # Invoice Items Table (7 columns)
-        self.table = QTableWidget(0, 7)
-        self.table.setHorizontalHeaderLabels([
-            "Description", "Unit Price (EUR)", "Quantity", "VAT Rate (%)", "VAT Amount (EUR)", "Total (EUR)", ""
-        ])
+        # Invoice Items Table (model/view, edit cells in place)
+        self.item_model = InvoiceItemTableModel(self.invoice_items, self)
+        self.table = QTableView()
+        self.table.setModel(self.item_model)
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
         self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
-        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.table.setEditTriggers(QAbstractItemView.DoubleClicked | QAbstractItemView.EditKeyPressed)
         main_layout.addWidget(self.table)
         
+        # Live totals, updated by the model as rows change
+        self.totals_label = QLabel()
+        self.totals_label.setAlignment(Qt.AlignRight)
+        self.item_model.totalsChanged.connect(self.update_totals_label)
+        self.include_vat_checkbox.toggled.connect(self.update_totals_label)
+        main_layout.addWidget(self.totals_label)
+        
+        # Remove selected items button with trash icon, also bound to Delete
+        remove_btn = QPushButton("Remove Selected")
+        remove_btn.setIcon(self.style().standardIcon(QStyle.SP_TrashIcon))
+        remove_btn.clicked.connect(self.remove_selected_items)
+        main_layout.addWidget(remove_btn)
+        remove_shortcut = QShortcut(QKeySequence.Delete, self.table)
+        remove_shortcut.activated.connect(self.remove_selected_items)
+        
+        self.update_totals_label()
+            
+        # Generate Invoice Button, with progress and cancel while rendering
+        self.generate_btn = QPushButton("Generate Invoice")
+        self.generate_btn.clicked.connect(self.generate_invoice)
+        main_layout.addWidget(self.generate_btn)
+        progress_layout = QHBoxLayout()
+        self.render_progress = QProgressBar()
+        self.cancel_render_btn = QPushButton("Cancel")
+        self.cancel_render_btn.clicked.connect(self.cancel_generate_invoice)
+        progress_layout.addWidget(self.render_progress)
+        progress_layout.addWidget(self.cancel_render_btn)
+        main_layout.addLayout(progress_layout)
+        self.render_progress.hide()
+        self.cancel_render_btn.hide()
+        
+        # Live preview of the first page, follows every change of the form
+        self.preview = InvoicePreview(self.preview_state)
+        for edit in (self.company_name_edit, self.address_edit, self.registration_number_edit,
+                     self.vat_number_edit, self.bank_info_edit, self.swift_edit, self.client_name_edit,
+                     self.client_address_edit, self.client_registration_edit, self.client_vat_edit,
+                     self.due_date_edit):
+            edit.textChanged.connect(self.preview.schedule)
+        self.language_combo.currentIndexChanged.connect(self.preview.schedule)
+        self.include_vat_checkbox.toggled.connect(self.preview.schedule)
+        self.include_note_checkbox.toggled.connect(self.preview.schedule)
+        self.item_model.totalsChanged.connect(self.preview.schedule)
+        
+        window_layout = QHBoxLayout()
+        window_layout.addLayout(main_layout)
+        window_layout.addWidget(self.preview)
+        self.setLayout(window_layout)
+        
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self._load_pending:
+            self._load_pending = False
+            self.shown.emit()
+            QTimer.singleShot(0, self.load_deferred)
+
+    def load_deferred(self):
+        """Load what startup does not need to show the window."""
+        self._load_pending = False
+        # Resetting the client model makes the combo select its first entry,
+        # which clears the client fields; restore the saved state after it.
+        self.client_list_model.refresh()
+        self.load_saved_state(load_metadata())
+        self.loaded.emit()
+        self.preview.schedule()
+        preload_job = PreloadRendererJob()
+        preload_job.signals.finished.connect(self.rendererReady)
+        QThreadPool.globalInstance().start(preload_job)
+
+    def load_saved_state(self, data):
+        """Fill in the contractor, client, options and items of the last invoice."""
+        # Load Last Contractor and Client Info (if any)
+        contractor_info, client_info = load_last_info(data)
+        if contractor_info:
+            self.company_name_edit.setText(contractor_info.get("company_name", ""))
+            self.address_edit.setText(contractor_info.get("address", ""))
+            self.registration_number_edit.setText(contractor_info.get("registration_number", ""))
+            self.vat_number_edit.setText(contractor_info.get("vat_number", ""))
+            self.bank_info_edit.setText(contractor_info.get("bank_info", ""))
+            self.swift_edit.setText(contractor_info.get("swift", ""))
+        if client_info:
+            self.client_name_edit.setText(client_info.get("company_name", ""))
+            self.client_address_edit.setText(client_info.get("address", ""))
+            self.client_registration_edit.setText(client_info.get("registration_number", ""))
+            self.client_vat_edit.setText(client_info.get("vat_number", ""))
+
+        # Load Invoice Options
+        options = load_invoice_options(data)
+        self.include_vat_checkbox.setChecked(options.get("include_vat", False))
+        language = options.get("language", "English")
+        index = self.language_combo.findText(language)
+        if index >= 0:
+            self.language_combo.setCurrentIndex(index)
+        self.include_note_checkbox.setChecked(options.get("include_note", False))
+
         # Load Last Invoice Items
-        last_items_data = load_last_items()
-        for item_data in last_items_data:
-            vat_rate = item_data.get("vat_rate", 0.0)
-            item = InvoiceItem(
+        self.item_model.append_items(
+            InvoiceItem(
                 description=item_data["description"],
                 unit_price=item_data["unit_price"],
                 quantity=item_data["quantity"],
-                vat_rate=vat_rate
+                vat_rate=item_data.get("vat_rate", 0.0)
             )
-            self.invoice_items.append(item)
-            self.add_item_to_table(item)
-            
-        # Generate Invoice Button
-        generate_btn = QPushButton("Generate Invoice")
-        generate_btn.clicked.connect(self.generate_invoice)
-        main_layout.addWidget(generate_btn)
-        
-        self.setLayout(main_layout)
-        
+            for item_data in load_last_items(data)
+        )
+
     def on_predefined_client_changed(self, index):
-        if index == 0:
+        client = self.client_list_model.client(index)
+        if client is None:
             self.client_name_edit.clear()
             self.client_address_edit.clear()
             self.client_registration_edit.clear()  # Clear new field
             self.client_vat_edit.clear()  # Clear new field
         else:
-            client = self.predefined_clients[index - 1]
-            self.client_name_edit.setText(client.get("company_name", ""))
-            self.client_address_edit.setText(client.get("address", ""))
-            self.client_registration_edit.setText(client.get("registration_number", ""))  # Set new field
-            self.client_vat_edit.setText(client.get("vat_number", ""))  # Set new field
+            self.fill_client_fields(client)
+            
+    def fill_client_fields(self, client):
+        self.client_name_edit.setText(client.get("company_name", ""))
+        self.client_address_edit.setText(client.get("address", ""))
+        self.client_registration_edit.setText(client.get("registration_number", ""))  # Set new field
+        self.client_vat_edit.setText(client.get("vat_number", ""))  # Set new field
+            
+    def on_client_search_edited(self, text):
+        # Picks up changes to clients.json, only reloads if its mtime changed
+        self.client_list_model.refresh()
+        clients = self.client_registry.clients
+        matches = [clients[i] for i in self.client_registry.search(text)]
+        self.client_search_results = {client_display_name(client): client for client in matches}
+        self.client_search_model.setStringList(list(self.client_search_results))
+        
+    def on_client_search_activated(self, text):
+        client = self.client_search_results.get(text)
+        if client is not None:
+            self.fill_client_fields(client)
+            
             
     def add_item(self):
         desc = self.item_desc_edit.text().strip()
@@ -203,8 +305,7 @@ class InvoiceGUI(QWidget):
             return
         
         item = InvoiceItem(description=desc, unit_price=unit_price, quantity=quantity, vat_rate=vat_rate)
-        self.invoice_items.append(item)
-        self.add_item_to_table(item)
+        self.item_model.append_items([item])
         
         # Clear entry fields
         self.item_desc_edit.clear()
@@ -212,36 +313,26 @@ class InvoiceGUI(QWidget):
         self.quantity_edit.clear()
         self.item_vat_edit.clear()
         
-    def add_item_to_table(self, item):
-        row_position = self.table.rowCount()
-        self.table.insertRow(row_position)
-        self.table.setItem(row_position, 0, QTableWidgetItem(item.description))
-        self.table.setItem(row_position, 1, QTableWidgetItem(f"{item.unit_price:.2f}"))
-        self.table.setItem(row_position, 2, QTableWidgetItem(str(item.quantity)))
-        self.table.setItem(row_position, 3, QTableWidgetItem(f"{item.vat_rate:.2f}"))
-        self.table.setItem(row_position, 4, QTableWidgetItem(f"{item.vat_amount:.2f}"))
-        self.table.setItem(row_position, 5, QTableWidgetItem(f"{item.total_gross:.2f}"))
-        
-        # Remove button with trash icon
-        remove_btn = QPushButton()
-        remove_btn.setFlat(True)
-        trash_icon = self.style().standardIcon(QStyle.SP_TrashIcon)
-        remove_btn.setIcon(trash_icon)
-        remove_btn.clicked.connect(lambda _, row=row_position: self.remove_item(row))
-        self.table.setCellWidget(row_position, 6, remove_btn)
-        
-    def remove_item(self, row):
-        self.table.removeRow(row)
-        if row < len(self.invoice_items):
-            del self.invoice_items[row]
-        self.update_remove_buttons()
-        
-    def update_remove_buttons(self):
-        for row in range(self.table.rowCount()):
-            widget = self.table.cellWidget(row, 6)
-            if widget:
-                widget.clicked.disconnect()
-                widget.clicked.connect(lambda _, r=row: self.remove_item(r))
+    def update_totals_label(self):
+        totals = self.item_model.totals
+        if not self.include_vat_checkbox.isChecked():
+            # Like the PDF: without VAT the total is the net amount
+            self.totals_label.setText(f"Total: {totals.total_net:.2f} EUR")
+            return
+        text = f"Net: {totals.total_net:.2f} EUR"
+        for vat_rate, net, vat in totals.vat_breakdown():
+            if vat_rate:
+                text += f"   VAT {vat_rate:.2f} %: {vat:.2f} EUR"
+        text += f"   Total: {totals.total_gross:.2f} EUR"
+        self.totals_label.setText(text)
+        
+    def remove_selected_items(self):
+        # Walk the selection ranges, selectedRows() is very slow on large
+        # scattered selections.
+        rows = set()
+        for selection_range in self.table.selectionModel().selection():
+            rows.update(range(selection_range.top(), selection_range.bottom() + 1))
+        self.item_model.remove_rows(rows)
         
     def generate_invoice(self):
         if not self.company_name_edit.text().strip() or not self.address_edit.text().strip():
@@ -254,12 +345,27 @@ class InvoiceGUI(QWidget):
             QMessageBox.critical(self, "Input Error", "Please add at least one invoice item.")
             return
         
+        # The job renders a snapshot, rows edited meanwhile are not affected
+        invoice, language, include_vat, include_note = self.current_invoice()
+        
+        # Number allocation, rendering and metadata I/O run on a worker
+        # thread; the number is only consumed if the invoice is written.
+        self.render_job = InvoiceRenderJob(invoice, language, include_vat, include_note)
+        self.render_job.signals.progress.connect(self.on_render_progress)
+        self.render_job.signals.finished.connect(self.on_render_finished)
+        self.render_job.signals.cancelled.connect(self.on_render_cancelled)
+        self.render_job.signals.failed.connect(self.on_render_failed)
+        self.set_rendering(True)
+        QThreadPool.globalInstance().start(self.render_job)
+        
+    def current_invoice(self):
+        """Return (invoice, language, include_vat, include_note) of the form,
+        the invoice without a number and with a copy of the items.
+        Raises ValueError for an invalid due date."""
         include_vat = self.include_vat_checkbox.isChecked()
         language = self.language_combo.currentText()
         include_note = self.include_note_checkbox.isChecked()
-        save_invoice_options(include_vat, language, include_note)
         
-        invoice_number = get_next_invoice_number()
         issue_date = datetime.now().date()
         due_date = issue_date + timedelta(days=int(self.due_date_edit.text().strip() or 15))
         
@@ -279,30 +385,70 @@ class InvoiceGUI(QWidget):
         }
         
         invoice = Invoice(
-            invoice_number=invoice_number,
+            invoice_number=None,
             issue_date=issue_date,
             due_date=due_date,
             contractor_info=contractor_info,
             client_info=client_info,
-            items=self.invoice_items
+            items=list(self.invoice_items)
         )
+        return invoice, language, include_vat, include_note
         
+    def preview_state(self):
+        """Form state for the preview pane, None while the due date is invalid."""
         try:
-            if language == "Slovene":
-                generate_invoice_pdf_slovene(invoice, include_vat, include_note)
-            else:
-                generate_invoice_pdf(invoice, include_vat, include_note)
-            save_last_items(self.invoice_items)
-            save_last_info(contractor_info, client_info)
-            QMessageBox.information(self, "Invoice Generated", f"Invoice {invoice.invoice_number} generated successfully.")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"An error occurred: {str(e)}")
-        
-def main():
+            return self.current_invoice()
+        except ValueError:
+            return None
+        
+    def cancel_generate_invoice(self):
+        if self.render_job is not None:
+            self.render_job.cancel()
+            
+    def set_rendering(self, rendering):
+        self.generate_btn.setEnabled(not rendering)
+        self.render_progress.setValue(0)
+        self.render_progress.setVisible(rendering)
+        self.cancel_render_btn.setVisible(rendering)
+        if not rendering:
+            self.render_job = None
+            
+    def on_render_progress(self, done, total):
+        self.render_progress.setMaximum(max(total, 1))
+        self.render_progress.setValue(done)
+        
+    def on_render_finished(self, invoice_number, warning):
+        self.set_rendering(False)
+        if warning:
+            QMessageBox.warning(self, "Invoice Generated",
+                                f"Invoice {invoice_number} was generated, do not generate it again.\n\n{warning}")
+        else:
+            QMessageBox.information(self, "Invoice Generated", f"Invoice {invoice_number} generated successfully.")
+        
+    def on_render_cancelled(self):
+        self.set_rendering(False)
+        
+    def on_render_failed(self, message):
+        self.set_rendering(False)
+        QMessageBox.critical(self, "Error", f"An error occurred: {message}")
+        
+def main(profile=None):
+    """Run the application. `profile`, when given, gets mark(phase) calls
+    as startup progresses and the application quits once the renderer is
+    preloaded, see main.py --profile-startup."""
     app = QApplication(sys.argv)
     gui = InvoiceGUI()
+    if profile is not None:
+        profile.mark("window_constructed")
+        gui.shown.connect(lambda: profile.mark("first_paint"))
+        gui.loaded.connect(lambda: profile.mark("state_and_clients_loaded"))
+        gui.rendererReady.connect(lambda: profile.mark("renderer_preloaded"))
+        gui.rendererReady.connect(app.quit)
     gui.show()
-    sys.exit(app.exec_())
+    exit_code = app.exec_()
+    # Let a running render finish writing before the process exits
+    QThreadPool.globalInstance().waitForDone()
+    sys.exit(exit_code)
 
 if __name__ == '__main__':
     main()
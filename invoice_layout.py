@@ -0,0 +1,177 @@
+"""Declarative invoice templates compiled into cached layout plans.
+
+Every language is described by a LOCALES entry: label strings, the
+decimal separator and the item table columns. compile_layout() turns an
+entry into a LayoutPlan for one (language, include_vat, include_note)
+combination, resolving column positions, label texts and number
+formatters up front, so rendering an invoice only executes the plan.
+
+Adding a language means adding a LOCALES entry, no code changes.
+"""
+import os
+from functools import lru_cache
+from operator import attrgetter
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+
+# The invoice fonts, here rather than in invoice_generator so the GUI can
+# load them without importing the renderer
+FONT_DIR = os.path.dirname(os.path.abspath(__file__))
+FONTS = {
+    "DejaVu": "DejaVuSans.ttf",
+    "DejaVu-Bold": "DejaVuSans-Bold.ttf"
+}
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN = 20 * mm
+RIGHT_EDGE = PAGE_WIDTH - MARGIN
+# Room kept free left of the first right aligned column for its values.
+DESCRIPTION_GAP = 60
+
+# Column entries: (item attribute, x offset from the left margin or None
+# for the right page edge, number format or None for plain str(), header
+# lines top to bottom). The first column is the description.
+LOCALES = {
+    "English": {
+        "language_code": "en",
+        "decimal_separator": ".",
+        "labels": {
+            "invoice_number": "Invoice number:",
+            "issue_date": "Issue Date:",
+            "due_date": "Due Date:",
+            "contractor": "From:",
+            "client": "Bill To:",
+            "registration_number": "Registration Number:",
+            "vat_number": "VAT Number:",
+            "bank_info": "Bank Info:",
+            "swift": "SWIFT:",
+            "subtotal": "Subtotal:",
+            "vat": "VAT:",
+            "total_with_vat": "Total:",
+            "total": "Total:",
+            "carried_forward": "Carried forward:",
+            "brought_forward": "Brought forward:",
+            "vat_recap": "VAT {rate} % of {base} EUR:"
+        },
+        "note": ["Note: VAT is not charged according to the Article 44 of the Directive ",
+                 "EU 2006/112/ES – reverse charge (for recipient)."],
+        "header_gap": 10,
+        "vat_total_rule": False,
+        "columns": {
+            True: [
+                ("description", 0, None, ["Description"]),
+                ("unit_price", 238, ".2f", ["Unit", "Price (EUR)"]),
+                ("quantity", 289, None, ["Quantity"]),
+                ("vat_rate", 338, ".2f", ["VAT", "Rate (%)"]),
+                ("vat_amount", 416, ".2f", ["VAT", "Amount (EUR)"]),
+                ("total_gross", None, ".2f", ["Total (EUR)"])
+            ],
+            False: [
+                ("description", 0, None, ["Description"]),
+                ("unit_price", 330, ".2f", ["Unit Price (EUR)"]),
+                ("quantity", 400, None, ["Quantity"]),
+                ("total_net", None, ".2f", ["Total (EUR)"])
+            ]
+        }
+    },
+    "Slovene": {
+        "language_code": "sl",
+        "decimal_separator": ",",
+        "labels": {
+            "invoice_number": "Račun številka:",
+            "issue_date": "Datum izdaje:",
+            "due_date": "Datum zapadlosti:",
+            "contractor": "Izvajalec:",
+            "client": "Naročnik:",
+            "registration_number": "Matična številka:",
+            "vat_number": "Davčna številka:",
+            "bank_info": "TRR:",
+            "swift": "SWIFT:",
+            "subtotal": "Skupaj brez DDV:",
+            "vat": "DDV:",
+            "total_with_vat": "Skupaj z DDV:",
+            "total": "Skupaj:",
+            "carried_forward": "Prenos:",
+            "brought_forward": "Prenos s prejšnje strani:",
+            "vat_recap": "DDV {rate} % od osnove {base} EUR:"
+        },
+        "note": ["Opomba: DDV se ne obračuna v skladu s 44. členom Direktive EU 2006/112/ES – ",
+                 "obratno obračunavanje (za prejemnika)."],
+        "header_gap": 13,
+        "vat_total_rule": True,
+        "columns": {
+            True: [
+                ("description", 0, None, ["Opis"]),
+                ("unit_price", 222, ".2f", ["Cena na", "enoto (EUR)"]),
+                ("quantity", 275, None, ["Količina"]),
+                ("vat_rate", 331, ".2f", ["Stopnja", "DDV (%)"]),
+                ("vat_amount", 400, ".2f", ["Znesek", "DDV (EUR)"]),
+                ("total_gross", None, ".2f", ["Skupaj (EUR)"])
+            ],
+            False: [
+                ("description", 0, None, ["Opis"]),
+                ("unit_price", 330, ".2f", ["Cena na enoto (EUR)"]),
+                ("quantity", 400, None, ["Količina"]),
+                ("total_net", None, ".2f", ["Skupaj (EUR)"])
+            ]
+        }
+    }
+}
+
+
+def _number_formatter(number_format, decimal_separator):
+    if number_format is None:
+        return str
+    if decimal_separator == ".":
+        return ("{:" + number_format + "}").format
+    template = "{:" + number_format + "}"
+    return lambda value: template.format(value).replace(".", decimal_separator)
+
+
+class LayoutPlan:
+    """Everything needed to draw one kind of invoice, resolved in advance.
+
+    header_rows: list of rows, each a list of (x, text, right_aligned)
+    item_cells: list of (x, value getter, formatter) for the numeric
+        columns drawn on the first line of every item
+    description_width: width in points descriptions are wrapped to
+    format_amount: formats a float amount with the locale separator
+    """
+
+    def __init__(self, language, include_vat, include_note, locale):
+        self.language = language
+        self.include_vat = include_vat
+        self.include_note = include_note
+        self.labels = dict(locale["labels"])
+        self.note = list(locale["note"]) if include_note else []
+        self.header_gap = locale["header_gap"]
+        self.vat_total_rule = locale["vat_total_rule"]
+        separator = locale["decimal_separator"]
+        self.format_amount = _number_formatter(".2f", separator)
+
+        columns = locale["columns"][bool(include_vat)]
+        header_depth = max(len(header) for _, _, _, header in columns)
+        self.header_rows = [[] for _ in range(header_depth)]
+        self.item_cells = []
+        for attribute, offset, number_format, header in columns:
+            x = RIGHT_EDGE if offset is None else MARGIN + offset
+            right_aligned = attribute != "description"
+            # Short headers are bottom aligned with the longest one.
+            first_row = header_depth - len(header)
+            for row, text in enumerate(header, start=first_row):
+                self.header_rows[row].append((x, text, right_aligned))
+            if attribute != "description":
+                self.item_cells.append((x, attrgetter(attribute),
+                                        _number_formatter(number_format, separator)))
+        self.description_width = self.item_cells[0][0] - MARGIN - DESCRIPTION_GAP
+
+
+@lru_cache(maxsize=None)
+def compile_layout(language, include_vat, include_note):
+    """Return the cached LayoutPlan for the given options."""
+    try:
+        locale = LOCALES[language]
+    except KeyError:
+        raise ValueError(f"Unsupported invoice language: {language}")
+    return LayoutPlan(language, bool(include_vat), bool(include_note), locale)
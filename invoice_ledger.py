@@ -0,0 +1,325 @@
+"""SQLite ledger of every issued invoice.
+
+Each generated invoice is recorded with its number, dates, contractor
+and client, items, totals in cents, language, VAT and note options and
+the path of its PDF. Indexes on the number, the client VAT number and
+the issue date keep lookups and period queries fast over hundreds of
+thousands of invoices, and the per rate VAT amounts are kept in their
+own table so period aggregates never have to read the items.
+
+    with InvoiceLedger() as ledger:
+        ledger.record(invoice, "English", True, False, "2025-001.pdf")
+        ledger.period_totals("2025-01-01", "2025-12-31", group_by="month")
+
+Rendering an invoice number again replaces its record. record_many()
+writes any number of invoices in one transaction; the batch renderer
+uses it through LedgerWriter, which buffers records into batches.
+
+Run `python invoice_ledger.py --help` for a command line query tool.
+"""
+import argparse
+import json
+import sqlite3
+import sys
+from datetime import datetime
+
+LEDGER_FILE = "invoice_ledger.sqlite3"
+BATCH_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    number TEXT PRIMARY KEY,
+    issue_date TEXT NOT NULL,
+    due_date TEXT,
+    client_name TEXT,
+    client_vat_number TEXT,
+    contractor_info TEXT NOT NULL,
+    client_info TEXT NOT NULL,
+    items TEXT NOT NULL,
+    item_count INTEGER NOT NULL,
+    net_cents INTEGER NOT NULL,
+    vat_cents INTEGER NOT NULL,
+    gross_cents INTEGER NOT NULL,
+    language TEXT NOT NULL,
+    include_vat INTEGER NOT NULL,
+    include_note INTEGER NOT NULL,
+    path TEXT,
+    recorded_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS invoices_client_vat ON invoices (client_vat_number, issue_date);
+-- Covers the period aggregates, which then never read the wide rows
+CREATE INDEX IF NOT EXISTS invoices_issue_date ON invoices (issue_date, net_cents, vat_cents, gross_cents);
+CREATE TABLE IF NOT EXISTS invoice_vat_rates (
+    number TEXT NOT NULL,
+    issue_date TEXT NOT NULL,
+    vat_bp INTEGER NOT NULL,
+    net_cents INTEGER NOT NULL,
+    vat_cents INTEGER NOT NULL,
+    PRIMARY KEY (number, vat_bp)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS invoice_vat_rates_issue_date
+    ON invoice_vat_rates (issue_date, vat_bp, net_cents, vat_cents);
+"""
+
+_SUMMARY_COLUMNS = ("number", "issue_date", "due_date", "client_name", "client_vat_number", "item_count",
+                    "net_cents", "vat_cents", "gross_cents", "language", "include_vat", "include_note", "path")
+
+_INSERT_INVOICE = (
+    "INSERT OR REPLACE INTO invoices (number, issue_date, due_date, client_name, client_vat_number, "
+    "contractor_info, client_info, items, item_count, net_cents, vat_cents, gross_cents, language, "
+    "include_vat, include_note, path, recorded_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+_DELETE_RATES = "DELETE FROM invoice_vat_rates WHERE number = ?"
+_INSERT_RATE = ("INSERT INTO invoice_vat_rates (number, issue_date, vat_bp, net_cents, vat_cents) "
+                "VALUES (?, ?, ?, ?, ?)")
+
+PERIODS = {
+    "day": "issue_date",
+    "month": "substr(issue_date, 1, 7)",
+    "year": "substr(issue_date, 1, 4)",
+}
+
+
+def _rows(invoice, language, include_vat, include_note, path, recorded_at):
+    """The invoices row and the invoice_vat_rates rows of an invoice."""
+    items = []
+    for item in invoice.items:
+        items.append([item.description, item.price_units, item.quantity, item.vat_bp])
+    totals = invoice.totals
+    # Without VAT the invoice charges none, whatever the item rates
+    vat_cents = totals.vat_cents if include_vat else 0
+    number = invoice.invoice_number
+    issue_date = str(invoice.issue_date)
+    client = invoice.client_info
+    invoice_row = (
+        number, issue_date, str(invoice.due_date) if invoice.due_date else None,
+        client.get("company_name"), client.get("vat_number") or None,
+        json.dumps(invoice.contractor_info), json.dumps(client), json.dumps(items), len(items),
+        totals.net_cents, vat_cents, totals.net_cents + vat_cents,
+        language, int(bool(include_vat)), int(bool(include_note)), path, recorded_at,
+    )
+    rate_rows = [(number, issue_date, vat_bp, rate_net, rate_vat if include_vat else 0)
+                 for vat_bp, (rate_net, rate_vat, _) in totals.by_rate.items()]
+    return invoice_row, rate_rows
+
+
+def _period_filter(start, end, column="issue_date"):
+    clauses = []
+    params = []
+    if start is not None:
+        clauses.append(f"{column} >= ?")
+        params.append(str(start))
+    if end is not None:
+        clauses.append(f"{column} <= ?")
+        params.append(str(end))
+    return clauses, params
+
+
+class InvoiceLedger:
+    """Connection to the ledger database at `path` (default LEDGER_FILE).
+
+    Dates are stored and compared as ISO strings; `start` and `end` of
+    the queries are inclusive and may be dates or "YYYY-MM-DD" strings.
+    Query results are dicts with amounts in integer cents.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or LEDGER_FILE
+        # Waits for a concurrent writer, e.g. a batch while the GUI records
+        self.connection = sqlite3.connect(self.path, timeout=30)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def record(self, invoice, language="English", include_vat=False, include_note=False, path=None):
+        """Record one issued invoice, replacing an earlier record of its number."""
+        self.record_many([(invoice, language, include_vat, include_note, path)])
+
+    def record_many(self, entries):
+        """Record (invoice, language, include_vat, include_note, path) tuples
+        in a single transaction. Returns the number of invoices recorded."""
+        recorded_at = datetime.now().isoformat(timespec="seconds")
+        invoice_rows = []
+        rate_rows = []
+        for invoice, language, include_vat, include_note, path in entries:
+            invoice_row, rates = _rows(invoice, language, include_vat, include_note, path, recorded_at)
+            invoice_rows.append(invoice_row)
+            rate_rows.extend(rates)
+        if not invoice_rows:
+            return 0
+        with self.connection:
+            self.connection.executemany(_DELETE_RATES, [(row[0],) for row in invoice_rows])
+            self.connection.executemany(_INSERT_INVOICE, invoice_rows)
+            self.connection.executemany(_INSERT_RATE, rate_rows)
+        return len(invoice_rows)
+
+    def get(self, number):
+        """Full record of an invoice, with its contractor, client and items,
+        or None if the number was never recorded."""
+        row = self.connection.execute("SELECT * FROM invoices WHERE number = ?", (number,)).fetchone()
+        if row is None:
+            return None
+        record = dict(row)
+        for column in ("contractor_info", "client_info"):
+            record[column] = json.loads(record[column])
+        record["items"] = [
+            {"description": description, "price_units": price_units, "quantity": quantity, "vat_bp": vat_bp}
+            for description, price_units, quantity, vat_bp in json.loads(record["items"])
+        ]
+        return record
+
+    def _summaries(self, clauses, params, limit):
+        sql = f"SELECT {', '.join(_SUMMARY_COLUMNS)} FROM invoices"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY issue_date, number"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params = params + [limit]
+        return [dict(row) for row in self.connection.execute(sql, params)]
+
+    def by_client(self, vat_number, start=None, end=None, limit=None):
+        """Summaries of the invoices of a client VAT number, by issue date."""
+        clauses, params = _period_filter(start, end)
+        return self._summaries(["client_vat_number = ?"] + clauses, [vat_number] + params, limit)
+
+    def in_period(self, start=None, end=None, limit=None):
+        """Summaries of the invoices issued between start and end."""
+        clauses, params = _period_filter(start, end)
+        return self._summaries(clauses, params, limit)
+
+    def period_totals(self, start=None, end=None, group_by=None, client_vat_number=None):
+        """Invoice count and net, VAT and gross revenue between start and end.
+
+        group_by is None for a single row, or "day", "month" or "year" for
+        one row per period, in order.
+        """
+        clauses, params = _period_filter(start, end)
+        if client_vat_number is not None:
+            clauses.append("client_vat_number = ?")
+            params.append(client_vat_number)
+        if group_by is not None and group_by not in PERIODS:
+            raise ValueError(f"Unknown period: {group_by!r} (use one of {', '.join(PERIODS)})")
+        period = PERIODS[group_by] if group_by else "NULL"
+        sql = (f"SELECT {period} AS period, COUNT(*) AS invoices, COALESCE(SUM(net_cents), 0) AS net_cents, "
+               "COALESCE(SUM(vat_cents), 0) AS vat_cents, COALESCE(SUM(gross_cents), 0) AS gross_cents "
+               "FROM invoices")
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        if group_by:
+            sql += " GROUP BY period ORDER BY period"
+        return [dict(row) for row in self.connection.execute(sql, params)]
+
+    def vat_by_rate(self, start=None, end=None):
+        """Taxable base and VAT per VAT rate of the invoices issued between
+        start and end, for the VAT return. vat_rate is in percent."""
+        clauses, params = _period_filter(start, end)
+        sql = ("SELECT vat_bp, COUNT(*) AS invoices, SUM(net_cents) AS net_cents, SUM(vat_cents) AS vat_cents "
+               "FROM invoice_vat_rates")
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " GROUP BY vat_bp ORDER BY vat_bp"
+        rows = []
+        for row in self.connection.execute(sql, params):
+            row = dict(row)
+            row["vat_rate"] = row.pop("vat_bp") / 100
+            rows.append(row)
+        return rows
+
+
+class LedgerWriter:
+    """Buffer of invoices to record, written with record_many() in
+    batches of `batch_size` and on flush()/close()."""
+
+    def __init__(self, ledger, batch_size=BATCH_SIZE):
+        self.ledger = ledger
+        self.batch_size = batch_size
+        self.recorded = 0
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+    def add(self, invoice, language, include_vat, include_note, path):
+        self._pending.append((invoice, language, include_vat, include_note, path))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self.recorded += self.ledger.record_many(self._pending)
+            self._pending = []
+
+
+def record_invoice(invoice, language, include_vat, include_note, path, ledger_path=None):
+    """Record a single issued invoice in the ledger at ledger_path."""
+    with InvoiceLedger(ledger_path) as ledger:
+        ledger.record(invoice, language, include_vat, include_note, path)
+
+
+def _format_cents(cents):
+    return f"{cents / 100:.2f}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the ledger of issued invoices.")
+    parser.add_argument("--ledger", default=LEDGER_FILE, help=f"ledger database (default: {LEDGER_FILE})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show", help="print the full record of an invoice as JSON")
+    show.add_argument("number")
+    client = commands.add_parser("client", help="list the invoices of a client VAT number")
+    client.add_argument("vat_number")
+    listing = commands.add_parser("list", help="list the invoices issued in a period")
+    totals = commands.add_parser("totals", help="revenue and VAT totals of a period")
+    totals.add_argument("--by", choices=sorted(PERIODS), help="one line per day, month or year")
+    totals.add_argument("--vat-rates", action="store_true", help="break the VAT down by rate instead")
+    for command in (client, listing, totals):
+        command.add_argument("--from", dest="start", metavar="DATE", help="first issue date, YYYY-MM-DD")
+        command.add_argument("--to", dest="end", metavar="DATE", help="last issue date, YYYY-MM-DD")
+    args = parser.parse_args(argv)
+
+    with InvoiceLedger(args.ledger) as ledger:
+        if args.command == "show":
+            record = ledger.get(args.number)
+            if record is None:
+                sys.stderr.write(f"Invoice {args.number} is not in {args.ledger}\n")
+                return 1
+            print(json.dumps(record, indent=2, ensure_ascii=False))
+        elif args.command in ("client", "list"):
+            if args.command == "client":
+                rows = ledger.by_client(args.vat_number, args.start, args.end)
+            else:
+                rows = ledger.in_period(args.start, args.end)
+            for row in rows:
+                print(f"{row['number']}\t{row['issue_date']}\t{row['client_name']}\t"
+                      f"{_format_cents(row['net_cents'])}\t{_format_cents(row['vat_cents'])}\t"
+                      f"{_format_cents(row['gross_cents'])}")
+        elif args.vat_rates:
+            for row in ledger.vat_by_rate(args.start, args.end):
+                print(f"{row['vat_rate']:.2f} %\t{row['invoices']}\t{_format_cents(row['net_cents'])}\t"
+                      f"{_format_cents(row['vat_cents'])}")
+        else:
+            for row in ledger.period_totals(args.start, args.end, args.by):
+                print(f"{row['period'] or 'total'}\t{row['invoices']}\t{_format_cents(row['net_cents'])}\t"
+                      f"{_format_cents(row['vat_cents'])}\t{_format_cents(row['gross_cents'])}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,40 +1,209 @@
+import copy
 import json
 import os
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 
+import instrumentation
+from atomic_io import atomic_write
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
 METADATA_FILE = "invoice_metadata.json"
 SEQUENCE_LENGTH = 3  # number of digits for the sequence
 
-def load_metadata():
-    if os.path.exists(METADATA_FILE):
-        with open(METADATA_FILE, "r") as f:
-            data = json.load(f)
+# Serialises threads of this process; the lock file serialises processes.
+_thread_lock = threading.RLock()
+_lock_state = threading.local()
+# Last contents read or written by this process, keyed by the file's
+# (inode, mtime, size) so an unchanged file is not parsed again outside
+# of transactions.
+_cache = {"stat": None, "data": None}
+
+def _lock_file(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
     else:
-        data = {}
-    return data
+        # LK_LOCK gives up after ~10 seconds, keep waiting like flock does.
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                pass
+
+def _unlock_file(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+@contextmanager
+def metadata_lock():
+    """Hold an exclusive, re-entrant lock on the metadata file.
+
+    Excludes other threads and other processes (via METADATA_FILE.lock)
+    for the duration of a read-modify-write of the metadata.
+    """
+    with _thread_lock:
+        depth = getattr(_lock_state, "depth", 0)
+        if depth:
+            _lock_state.depth = depth + 1
+            try:
+                yield
+            finally:
+                _lock_state.depth = depth
+            return
+        with open(METADATA_FILE + ".lock", "a+b") as lock_file:
+            with instrumentation.span("metadata.lock_wait"):
+                _lock_file(lock_file)
+            _lock_state.depth = 1
+            try:
+                yield
+            finally:
+                _lock_state.depth = 0
+                _unlock_file(lock_file)
+
+def _file_stat():
+    try:
+        st = os.stat(METADATA_FILE)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def _read_metadata(fresh=False):
+    """Return a copy of the metadata; `fresh` reads the file even if its
+    stat matches the cached one."""
+    stat = _file_stat()
+    if stat is None:
+        return {}
+    if fresh or stat != _cache["stat"]:
+        with instrumentation.span("metadata.read", bytes=stat[2]):
+            with open(METADATA_FILE, "r") as f:
+                _cache["data"] = json.load(f)
+        _cache["stat"] = stat
+        instrumentation.count("metadata.bytes_read", stat[2])
+    with instrumentation.span("metadata.copy"):
+        return copy.deepcopy(_cache["data"])
+
+def load_metadata():
+    """Return the metadata, the live copy of the current transaction if any."""
+    transaction = getattr(_lock_state, "transaction", None)
+    if transaction is not None:
+        return transaction.data
+    return _read_metadata()
 
 def save_metadata(data):
-    with open(METADATA_FILE, "w") as f:
-        json.dump(data, f)
+    """Atomically replace the metadata file, a crash never leaves it truncated."""
+    with instrumentation.span("metadata.write") as span:
+        with atomic_write(METADATA_FILE, "w") as f:
+            json.dump(data, f)
+            size = f.tell()
+        span.set(bytes=size)
+    instrumentation.count("metadata.bytes_written", size)
+    _cache["data"] = copy.deepcopy(data)
+    _cache["stat"] = _file_stat()
 
-def get_next_invoice_number():
+class MetadataTransaction:
+    """Unit of work over the metadata file, see metadata_transaction()."""
+
+    def __init__(self):
+        # Another process may have replaced the file within one timestamp
+        # tick with one of the same size, so never trust the cache under the
+        # lock: a stale sequence would hand out an invoice number twice.
+        self.data = _read_metadata(fresh=True)
+        self.dirty = False
+
+    def flush(self):
+        """Write pending changes now instead of when the transaction ends."""
+        if self.dirty:
+            save_metadata(self.data)
+            self.dirty = False
+
+@contextmanager
+def metadata_transaction():
+    """Group several metadata updates into one read and one atomic write.
+
+    Holds the metadata lock for the whole block. Inside it load_metadata()
+    returns the transaction's data and the save_* helpers only modify it;
+    everything is written once when the block exits. Nothing is written
+    if the block raises. Nested transactions join the outer one.
+    """
+    with metadata_lock():
+        transaction = getattr(_lock_state, "transaction", None)
+        if transaction is not None:
+            yield transaction
+            return
+        transaction = MetadataTransaction()
+        _lock_state.transaction = transaction
+        try:
+            yield transaction
+        finally:
+            _lock_state.transaction = None
+        transaction.flush()
+
+@contextmanager
+def update_metadata():
+    """Lock, load and yield the metadata, then save it when the block exits.
+
+    Inside a metadata_transaction() the write is deferred to the end of
+    the transaction. Nothing is written if the block raises.
+    """
+    with metadata_transaction() as transaction:
+        yield transaction.data
+        transaction.dirty = True
+
+def _format_invoice_number(year, sequence):
+    return f"{year}-{sequence:0{SEQUENCE_LENGTH}d}"
+
+def allocate_invoice_numbers(count=1):
+    """Atomically reserve `count` consecutive invoice numbers of the current year."""
     current_year = datetime.now().year
-    data = load_metadata()
-    # Reset sequence if new year, but keep saved info
-    if str(current_year) != data.get("year"):
-        data["year"] = str(current_year)
-        data["sequence"] = 0
-    data["sequence"] = data.get("sequence", 0) + 1
-    save_metadata(data)
-    invoice_number = f"{current_year}-{data['sequence']:0{SEQUENCE_LENGTH}d}"
-    return invoice_number
-
-def load_last_items():
-    data = load_metadata()
+    with update_metadata() as data:
+        # Reset sequence if new year, but keep saved info
+        if str(current_year) != data.get("year"):
+            data["year"] = str(current_year)
+            data["sequence"] = 0
+        first = data.get("sequence", 0) + 1
+        data["sequence"] = first + count - 1
+    return [_format_invoice_number(current_year, sequence) for sequence in range(first, first + count)]
+
+def get_next_invoice_number():
+    return allocate_invoice_numbers(1)[0]
+
+def release_invoice_numbers(numbers):
+    """Give back the unused tail of a reservation.
+
+    Numbers are only returned to the sequence when nobody allocated
+    after them, otherwise they stay consumed. Returns True if the
+    sequence was rolled back.
+    """
+    if not numbers:
+        return False
+    year, first = numbers[0].rsplit("-", 1)
+    last = numbers[-1].rsplit("-", 1)[1]
+    with metadata_transaction() as transaction:
+        data = transaction.data
+        if data.get("year") != year or data.get("sequence") != int(last):
+            return False
+        data["sequence"] = int(first) - 1
+        transaction.dirty = True
+    return True
+
+def load_last_items(data=None):
+    """Items of the last invoice. The load_* helpers accept metadata that
+    was already loaded, so several of them can share one read."""
+    data = load_metadata() if data is None else data
     return data.get("last_items", [])
 
 def save_last_items(items):
-    data = load_metadata()
     last_items = [
         {
             "description": item.description,
@@ -44,23 +213,22 @@ def save_last_items(items):
         }
         for item in items
     ]
-    data["last_items"] = last_items
-    save_metadata(data)
+    with update_metadata() as data:
+        data["last_items"] = last_items
 
-def load_last_info():
-    data = load_metadata()
+def load_last_info(data=None):
+    data = load_metadata() if data is None else data
     contractor_info = data.get("contractor_info", {})
     client_info = data.get("client_info", {})
     return contractor_info, client_info
 
 def save_last_info(contractor_info, client_info):
-    data = load_metadata()
-    data["contractor_info"] = contractor_info
-    data["client_info"] = client_info
-    save_metadata(data)
+    with update_metadata() as data:
+        data["contractor_info"] = contractor_info
+        data["client_info"] = client_info
 
-def load_invoice_options():
-    data = load_metadata()
+def load_invoice_options(data=None):
+    data = load_metadata() if data is None else data
     return {
         "include_vat": data.get("include_vat", False),
         "language": data.get("language", "English"),
@@ -68,8 +236,7 @@ def load_invoice_options():
     }
 
 def save_invoice_options(include_vat, language, include_note):
-    data = load_metadata()
-    data["include_vat"] = include_vat
-    data["language"] = language
-    data["include_note"] = include_note
-    save_metadata(data)
+    with update_metadata() as data:
+        data["include_vat"] = include_vat
+        data["language"] = language
+        data["include_note"] = include_note
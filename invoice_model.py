@@ -1,12 +1,244 @@
+from array import array
+from decimal import Decimal, ROUND_HALF_UP
+
+# Money is kept as integers: amounts in cents, unit prices in 1/10000 EUR
+# (so sub-cent usage prices survive) and VAT rates in basis points.
+UNIT_PRICE_SCALE = 10000
+VAT_RATE_SCALE = 100
+
+def _to_fixed(value, scale):
+    if isinstance(value, int):
+        return value * scale
+    return int((Decimal(str(value)) * scale).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def _div_round(numerator, denominator):
+    """Integer division rounding half away from zero, like ROUND_HALF_UP."""
+    quotient = (abs(numerator) * 2 + denominator) // (2 * denominator)
+    return quotient if numerator >= 0 else -quotient
+
+_numpy_module = False  # not imported yet
+
+def _numpy():
+    """NumPy, imported on first use since it is slow to import, or None."""
+    global _numpy_module
+    if _numpy_module is False:
+        try:
+            import numpy
+        except ImportError:  # totals fall back to pure Python integer arithmetic
+            numpy = None
+        _numpy_module = numpy
+    return _numpy_module
+
+def _line_cents(price_units, quantity, vat_bp):
+    net_cents = _div_round(price_units * quantity, UNIT_PRICE_SCALE // 100)
+    vat_cents = _div_round(net_cents * vat_bp, 100 * VAT_RATE_SCALE)
+    return net_cents, vat_cents
+
 class InvoiceItem:
+    """One invoice line. Amounts are exact and rounded to cents per line."""
+    __slots__ = ("description", "quantity", "_price_units", "_vat_bp")
+
     def __init__(self, description, unit_price, quantity, vat_rate=0.0):
         self.description = description
-        self.unit_price = unit_price
         self.quantity = quantity
-        self.vat_rate = vat_rate
-        self.total_net = unit_price * quantity
-        self.vat_amount = self.total_net * (vat_rate / 100)
-        self.total_gross = self.total_net + self.vat_amount
+        self._price_units = _to_fixed(unit_price, UNIT_PRICE_SCALE)
+        self._vat_bp = _to_fixed(vat_rate, VAT_RATE_SCALE)
+
+    @classmethod
+    def _from_fixed(cls, description, price_units, quantity, vat_bp):
+        item = cls.__new__(cls)
+        item.description = description
+        item.quantity = quantity
+        item._price_units = price_units
+        item._vat_bp = vat_bp
+        return item
+
+    def __getstate__(self):
+        return (self.description, self.quantity, self._price_units, self._vat_bp)
+
+    def __setstate__(self, state):
+        self.description, self.quantity, self._price_units, self._vat_bp = state
+
+    @property
+    def unit_price(self):
+        return self._price_units / UNIT_PRICE_SCALE
+
+    @unit_price.setter
+    def unit_price(self, unit_price):
+        self._price_units = _to_fixed(unit_price, UNIT_PRICE_SCALE)
+
+    @property
+    def vat_rate(self):
+        return self._vat_bp / VAT_RATE_SCALE
+
+    @vat_rate.setter
+    def vat_rate(self, vat_rate):
+        self._vat_bp = _to_fixed(vat_rate, VAT_RATE_SCALE)
+
+    @property
+    def price_units(self):
+        """Exact unit price in 1/UNIT_PRICE_SCALE EUR."""
+        return self._price_units
+
+    @property
+    def vat_bp(self):
+        """Exact VAT rate in basis points."""
+        return self._vat_bp
+
+    @property
+    def net_cents(self):
+        return _line_cents(self._price_units, self.quantity, self._vat_bp)[0]
+
+    @property
+    def vat_cents(self):
+        return _line_cents(self._price_units, self.quantity, self._vat_bp)[1]
+
+    @property
+    def total_net(self):
+        return self.net_cents / 100
+
+    @property
+    def vat_amount(self):
+        return self.vat_cents / 100
+
+    @property
+    def total_gross(self):
+        net_cents, vat_cents = _line_cents(self._price_units, self.quantity, self._vat_bp)
+        return (net_cents + vat_cents) / 100
+
+class InvoiceTotals:
+    """Running totals of a set of items, overall and per VAT rate.
+
+    add() and remove() update the totals in O(1), so they can follow a
+    changing item list or accumulate while items are streamed.
+    """
+    __slots__ = ("net_cents", "vat_cents", "by_rate")
+
+    def __init__(self, items=()):
+        self.net_cents = 0
+        self.vat_cents = 0
+        self.by_rate = {}  # VAT rate in basis points -> [net_cents, vat_cents, line count]
+        for item in items:
+            self.add(item)
+
+    def _update(self, vat_bp, net_cents, vat_cents, count):
+        self.net_cents += net_cents
+        self.vat_cents += vat_cents
+        entry = self.by_rate.get(vat_bp)
+        if entry is None:
+            entry = self.by_rate[vat_bp] = [0, 0, 0]
+        entry[0] += net_cents
+        entry[1] += vat_cents
+        entry[2] += count
+        if not entry[2]:
+            del self.by_rate[vat_bp]
+
+    def add(self, item):
+        net_cents, vat_cents = _line_cents(item._price_units, item.quantity, item._vat_bp)
+        self._update(item._vat_bp, net_cents, vat_cents, 1)
+
+    def remove(self, item):
+        net_cents, vat_cents = _line_cents(item._price_units, item.quantity, item._vat_bp)
+        self._update(item._vat_bp, -net_cents, -vat_cents, -1)
+
+    @property
+    def line_count(self):
+        return sum(entry[2] for entry in self.by_rate.values())
+
+    @property
+    def total_net(self):
+        return self.net_cents / 100
+
+    @property
+    def total_vat(self):
+        return self.vat_cents / 100
+
+    @property
+    def total_gross(self):
+        return (self.net_cents + self.vat_cents) / 100
+
+    def vat_breakdown(self):
+        """Return [(vat_rate, net, vat)] sorted by rate, amounts in EUR."""
+        return [(vat_bp / VAT_RATE_SCALE, net_cents / 100, vat_cents / 100)
+                for vat_bp, (net_cents, vat_cents, _) in sorted(self.by_rate.items())]
+
+class ItemBatch:
+    """Columnar storage for many invoice lines.
+
+    Prices, quantities and VAT rates live in typed arrays, about 24 bytes
+    per line plus the description. Indexing and iteration return
+    InvoiceItem views, so a batch can be used wherever a list of items
+    is expected. totals() sums all lines in bulk, with NumPy when it is
+    installed.
+    """
+
+    def __init__(self, items=()):
+        self.descriptions = []
+        self.price_units = array("q")
+        self.quantities = array("q")
+        self.vat_bp = array("q")
+        for item in items:
+            self.append_item(item)
+
+    def append(self, description, unit_price, quantity, vat_rate=0.0):
+        self.descriptions.append(description)
+        self.price_units.append(_to_fixed(unit_price, UNIT_PRICE_SCALE))
+        self.quantities.append(quantity)
+        self.vat_bp.append(_to_fixed(vat_rate, VAT_RATE_SCALE))
+
+    def append_item(self, item):
+        self.descriptions.append(item.description)
+        self.price_units.append(item._price_units)
+        self.quantities.append(item.quantity)
+        self.vat_bp.append(item._vat_bp)
+
+    def __len__(self):
+        return len(self.descriptions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return InvoiceItem._from_fixed(self.descriptions[index], self.price_units[index],
+                                       self.quantities[index], self.vat_bp[index])
+
+    def __iter__(self):
+        for fields in zip(self.descriptions, self.price_units, self.quantities, self.vat_bp):
+            yield InvoiceItem._from_fixed(*fields)
+
+    def __delitem__(self, index):
+        del self.descriptions[index]
+        del self.price_units[index]
+        del self.quantities[index]
+        del self.vat_bp[index]
+
+    def totals(self):
+        """Return the InvoiceTotals of all lines, computed in bulk."""
+        totals = InvoiceTotals()
+        if not self.descriptions:
+            return totals
+        np = _numpy()
+        if np is not None:
+            price = np.frombuffer(self.price_units, dtype=np.int64)
+            quantity = np.frombuffer(self.quantities, dtype=np.int64)
+            vat_bp = np.frombuffer(self.vat_bp, dtype=np.int64)
+            net = _np_div_round(np, price * quantity, UNIT_PRICE_SCALE // 100)
+            vat = _np_div_round(np, net * vat_bp, 100 * VAT_RATE_SCALE)
+            rates, groups, counts = np.unique(vat_bp, return_inverse=True, return_counts=True)
+            net_by_rate = np.zeros(len(rates), dtype=np.int64)
+            vat_by_rate = np.zeros(len(rates), dtype=np.int64)
+            np.add.at(net_by_rate, groups, net)
+            np.add.at(vat_by_rate, groups, vat)
+            for rate, net_cents, vat_cents, count in zip(rates, net_by_rate, vat_by_rate, counts):
+                totals._update(int(rate), int(net_cents), int(vat_cents), int(count))
+            return totals
+        for price_units, quantity, vat_bp in zip(self.price_units, self.quantities, self.vat_bp):
+            net_cents, vat_cents = _line_cents(price_units, quantity, vat_bp)
+            totals._update(vat_bp, net_cents, vat_cents, 1)
+        return totals
+
+def _np_div_round(np, numerator, denominator):
+    quotient = (np.abs(numerator) * 2 + denominator) // (2 * denominator)
+    return np.where(numerator >= 0, quotient, -quotient)
 
 class Invoice:
     def __init__(self, invoice_number, issue_date, due_date, contractor_info, client_info, items):
@@ -15,16 +247,70 @@ class Invoice:
         self.due_date = due_date
         self.contractor_info = contractor_info  # dict with keys: company_name, address, bank_info, swift
         self.client_info = client_info          # dict with keys: company_name, address
-        self.items = items  # List of InvoiceItem objects
+        self.items = items  # InvoiceItem objects or an ItemBatch
+
+    @property
+    def items(self):
+        """The items, a tuple or the ItemBatch the invoice was built with.
+
+        Change them with add_item/remove_item or by assigning a new
+        sequence, which keeps the cached totals right. Items are copied
+        into a tuple, so the caller's list can change freely; an ItemBatch
+        is kept as is and must not be modified directly. Items in the
+        invoice must not be changed in place either; replace them.
+        """
+        return self._items
+
+    @items.setter
+    def items(self, items):
+        self._items = items if isinstance(items, ItemBatch) else tuple(items)
+        self._totals = None
+
+    @property
+    def totals(self):
+        """InvoiceTotals of the items, computed once and then kept up to date
+        by add_item/remove_item. Unlike the totals of earlier versions they
+        are not recomputed on every access."""
+        if self._totals is None:
+            if isinstance(self._items, ItemBatch):
+                self._totals = self._items.totals()
+            else:
+                self._totals = InvoiceTotals(self._items)
+        return self._totals
+
+    def add_item(self, item):
+        if isinstance(self._items, ItemBatch):
+            self._items.append_item(item)
+        else:
+            self._items += (item,)
+        if self._totals is not None:
+            self._totals.add(item)
+
+    def remove_item(self, index):
+        item = self._items[index]
+        if isinstance(self._items, ItemBatch):
+            del self._items[index]
+        else:
+            self._items = self._items[:index] + self._items[index + 1:]
+        if self._totals is not None:
+            self._totals.remove(item)
+        return item
+
+    def totals_cents(self):
+        """Return (net_cents, vat_cents) over all items."""
+        return self.totals.net_cents, self.totals.vat_cents
 
     @property
     def total_net(self):
-        return sum(item.total_net for item in self.items)
-    
+        return self.totals.total_net
+
     @property
     def total_vat(self):
-        return sum(item.vat_amount for item in self.items)
-    
+        return self.totals.total_vat
+
     @property
     def total_gross(self):
-        return self.total_net + self.total_vat
+        return self.totals.total_gross
+
+    def vat_breakdown(self):
+        return self.totals.vat_breakdown()
@@ -1,4 +1,42 @@
-from invoice_gui import main
+"""Start the invoice generator.
+
+With --profile-startup the time of each startup phase is printed,
+measured from the start of this script, and the application quits once
+everything deferred at startup has loaded.
+"""
+import sys
+import time
+
+
+class StartupProfile:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.marks = []
+
+    def mark(self, phase):
+        self.marks.append((phase, time.perf_counter() - self.start, len(sys.modules),
+                           "reportlab" in sys.modules))
+
+    def report(self):
+        lines = [f"{'phase':<28} {'ms':>8} {'modules':>8}  reportlab"]
+        for phase, seconds, modules, reportlab in self.marks:
+            lines.append(f"{phase:<28} {seconds * 1000:>8.1f} {modules:>8}  {'yes' if reportlab else 'no'}")
+        return "\n".join(lines)
+
+
+def run(argv):
+    profile = StartupProfile() if "--profile-startup" in argv else None
+    from invoice_gui import main
+    if profile is None:
+        main()
+        return
+    profile.mark("import_gui")
+    try:
+        main(profile)
+    except SystemExit:
+        pass
+    print(profile.report())
+
 
 if __name__ == '__main__':
-    main()
+    run(sys.argv)
@@ -0,0 +1,205 @@
+"""On-disk cache of rendered invoice PDFs, keyed by invoice content.
+
+The key is a SHA-256 over a canonical form of everything that ends up in
+the PDF: invoice number, dates, contractor and client dicts, the items,
+language, VAT and note options and the output profile, plus a
+fingerprint of the renderer sources so a fix to the layout code does not
+serve stale PDFs. Regenerating an unchanged invoice then only copies the
+cached bytes.
+
+Entries are "{key[:2]}/{key}.pdf" with a "{key}.json" sidecar holding
+the RenderReport fields. Every hit touches the entry, and when the cache
+grows beyond max_bytes the least recently used entries are evicted by
+modification time. Entries are written atomically, so processes of a
+batch can share one cache directory.
+"""
+import hashlib
+import json
+import os
+from functools import lru_cache
+
+import instrumentation
+from atomic_io import write_atomic
+
+CACHE_FORMAT = 1
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Everything that influences the rendered bytes besides the invoice
+RENDERER_FILES = ("invoice_generator.py", "invoice_layout.py", "text_layout.py",
+                  "DejaVuSans.ttf", "DejaVuSans-Bold.ttf")
+
+
+@lru_cache(maxsize=None)
+def renderer_fingerprint():
+    """Hash of the renderer sources and fonts, computed once per process."""
+    digest = hashlib.sha256(str(CACHE_FORMAT).encode())
+    base = os.path.dirname(os.path.abspath(__file__))
+    for name in RENDERER_FILES:
+        try:
+            with open(os.path.join(base, name), "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+        except FileNotFoundError:
+            digest.update(b"-")
+    return digest.hexdigest()
+
+
+def _canonical(value):
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def invoice_key(invoice, language="English", include_vat=False, include_note=False, profile=None):
+    """Canonical content hash of an invoice and its render options.
+
+    Items are hashed one at a time, so an ItemBatch of any size is not
+    copied. Amounts go in through their fixed point values, so 10 and
+    10.0 give the same key.
+    """
+    digest = hashlib.sha256(renderer_fingerprint().encode())
+    header = {
+        "invoice_number": invoice.invoice_number,
+        "issue_date": invoice.issue_date,
+        "due_date": invoice.due_date,
+        "contractor": invoice.contractor_info,
+        "client": invoice.client_info,
+        "language": language,
+        "include_vat": bool(include_vat),
+        "include_note": bool(include_note),
+        "profile": profile,
+    }
+    digest.update(_canonical(header).encode("utf-8"))
+    for item in invoice.items:
+        digest.update(b"\n")
+        digest.update(_canonical([item.description, item.price_units, item.quantity, item.vat_bp]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """Size bounded LRU cache of PDF bytes in `directory`.
+
+    get() returns (pdf_bytes, report_fields) or None, put() stores a
+    rendered invoice. The cache holds no open files, so it can be pickled
+    to worker processes; hand them a detached() copy, which never scans
+    the directory, and trim() the cache once they are done.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.evicts = True  # False in detached() copies
+        self._size = None   # estimate of the bytes on disk, None until scanned
+
+    def detached(self):
+        """Copy for worker processes that stores entries without tracking
+        the size or evicting; the owner calls trim() afterwards."""
+        worker = RenderCache(self.directory, self.max_bytes)
+        worker.evicts = False
+        return worker
+
+    key = staticmethod(invoice_key)
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key[:2], key)
+        return base + ".pdf", base + ".json"
+
+    def get(self, key):
+        pdf_path, report_path = self._paths(key)
+        try:
+            with open(report_path, encoding="utf-8") as f:
+                report = json.load(f)
+            with open(pdf_path, "rb") as f:
+                data = f.read()
+        except (FileNotFoundError, ValueError):
+            instrumentation.count("cache.misses")
+            return None
+        if len(data) != report.get("size"):
+            # Torn by a concurrent eviction, render again
+            instrumentation.count("cache.misses")
+            return None
+        try:
+            os.utime(pdf_path)
+        except FileNotFoundError:
+            pass
+        instrumentation.count("cache.hits")
+        return data, report
+
+    def put(self, key, data, report):
+        """Store the PDF bytes and the RenderReport fields (a dict) of `key`."""
+        pdf_path, report_path = self._paths(key)
+        directory = os.path.dirname(pdf_path)
+        os.makedirs(directory, exist_ok=True)
+        # The PDF goes first: an entry counts once its report exists. No
+        # fsync, an entry torn by a power loss fails the size check in get()
+        # and is rendered again.
+        write_atomic(pdf_path, data, sync=False)
+        write_atomic(report_path, json.dumps(report), sync=False)
+        if not self.evicts:
+            return
+        if self._size is None:
+            self._size = self.scan()[1]
+        else:
+            self._size += len(data)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def scan(self):
+        """Return ([(mtime, key, size)], total size) of the entries on disk."""
+        entries = []
+        total = 0
+        try:
+            shards = os.scandir(self.directory)
+        except FileNotFoundError:
+            return entries, total
+        with shards:
+            for shard in shards:
+                if not shard.is_dir():
+                    continue
+                with os.scandir(shard.path) as files:
+                    for entry in files:
+                        if not entry.name.endswith(".pdf"):
+                            continue
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+                        total += stat.st_size
+        return entries, total
+
+    def evict(self, max_bytes=None):
+        """Remove least recently used entries until at most `max_bytes`
+        (default: three quarters of the limit) are left. Returns the
+        number of removed entries."""
+        entries, total = self.scan()
+        return self._evict(entries, total, max_bytes)
+
+    def trim(self):
+        """Evict if the entries on disk exceed max_bytes, e.g. after a batch
+        wrote through detached() copies. Returns the number of removed
+        entries."""
+        entries, total = self.scan()
+        if total <= self.max_bytes:
+            self._size = total
+            return 0
+        return self._evict(entries, total)
+
+    def _evict(self, entries, total, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = self.max_bytes * 3 // 4
+        entries.sort()
+        removed = 0
+        for _, key, size in entries:
+            if total <= max_bytes:
+                break
+            for path in reversed(self._paths(key)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            removed += 1
+        self._size = total
+        instrumentation.count("cache.evictions", removed)
+        return removed
+
+    def clear(self):
+        return self.evict(0)
@@ -0,0 +1,387 @@
+"""Local HTTP service rendering invoice PDFs, without the Qt GUI.
+
+    python render_service.py --port 8080 --workers 4
+
+Endpoints:
+  POST /render   body: one invoice as JSON, in the batch_renderer JSONL
+                 format (invoice_number, dates, language, include_vat,
+                 include_note, contractor_info, client_info, items).
+                 Query: ?profile=compact|reproducible|uncompressed.
+                 Answers with the PDF, application/pdf, and the number
+                 in the X-Invoice-Number header.
+  GET /health    JSON with the pool size, running and queued renders.
+  GET /metrics   Prometheus text: the render phase timings and counters
+                 of instrumentation plus the service gauges.
+
+Renders run on a process pool of `workers` processes, at most `workers`
+at a time. Up to `max_queue` further requests wait for a free worker;
+beyond that the service answers 429 with a Retry-After header instead of
+letting requests pile up. Invoices without a number get the next one
+from invoice_metadata, given back if the render fails and nobody took a
+later number. Rendered invoices are recorded in the invoice ledger.
+
+The server binds to 127.0.0.1 by default; port 0 picks a free port,
+which is printed on startup, so tests can run entirely on localhost.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import instrumentation
+from batch_renderer import init_worker, job_from_record, render_job
+from invoice_generator import DEFAULT_PROFILE, OUTPUT_PROFILES
+from invoice_ledger import LEDGER_FILE, record_invoice
+from invoice_metadata import allocate_invoice_numbers, release_invoice_numbers
+from render_cache import RenderCache
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+MAX_BODY_SIZE = 16 * 1024 * 1024
+MAX_HEADER_SIZE = 64 * 1024
+# Idle keep-alive connections and slow request headers are closed after this
+READ_TIMEOUT = 30
+RETRY_AFTER = 1            # seconds, sent with 429
+WRITE_CHUNK_SIZE = 64 * 1024
+# Span events kept for /metrics, the totals are kept in full
+MAX_EVENTS = 10000
+# Renders between two size checks of the render cache
+CACHE_TRIM_INTERVAL = 100
+
+_REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 408: "Request Timeout",
+    411: "Length Required", 413: "Payload Too Large", 429: "Too Many Requests", 431: "Request Header Fields Too Large",
+    500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+def _render_in_worker(job, profile, cache):
+    """Render one job in a pool worker; returns (BatchResult with the PDF
+    bytes, the worker's instrumentation data or None)."""
+    result = render_job(job, None, profile, cache)
+    return result, instrumentation.snapshot(clear=True) if instrumentation.enabled else None
+
+
+def _warm_up():
+    return os.getpid()
+
+
+class RenderService:
+    """The HTTP service; start() it inside a running event loop.
+
+    `cache` is an optional render_cache.RenderCache, `ledger_path` the
+    invoice ledger to record into, or None to record nothing.
+    """
+
+    def __init__(self, workers=None, max_queue=None, profile=DEFAULT_PROFILE, cache=None,
+                 ledger_path=LEDGER_FILE, max_body_size=MAX_BODY_SIZE):
+        if profile not in OUTPUT_PROFILES:
+            raise ValueError(f"Unknown output profile: {profile!r}")
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = self.workers * 4 if max_queue is None else max_queue
+        self.profile = profile
+        self.cache = cache
+        # Workers get a copy that does not scan the cache on every request
+        self._worker_cache = cache.detached() if cache is not None else None
+        self._renders = 0
+        self.ledger_path = ledger_path
+        self.max_body_size = max_body_size
+        self.active = 0    # renders running on the pool
+        self.waiting = 0   # renders queued for a free worker
+        self.server = None
+        self._pool = None
+        self._slots = None
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """Start the pool and listen; returns the asyncio server."""
+        if not instrumentation.enabled:
+            instrumentation.enable(max_events=MAX_EVENTS)
+        self._slots = asyncio.Semaphore(self.workers)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                         initargs=(instrumentation.config(),))
+        # Start the workers now, a request should not wait for a fork
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._pool, _warm_up) for _ in range(self.workers)))
+        self.server = await asyncio.start_server(self._handle_connection, host, port, limit=MAX_HEADER_SIZE)
+        return self.server
+
+    @property
+    def address(self):
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+        if self.cache is not None:
+            self.cache.trim()
+
+    # HTTP
+
+    async def _read_request(self, reader):
+        """Return (method, target, headers, body), or None at the end of the connection."""
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), READ_TIMEOUT)
+        except asyncio.IncompleteReadError as e:
+            if e.partial.strip():
+                raise HTTPError(400, "Incomplete request")
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(431, "Request headers too large")
+        except asyncio.TimeoutError:
+            return None
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        headers[":version"] = version
+        body = b""
+        if "transfer-encoding" in headers:
+            raise HTTPError(411, "Chunked request bodies are not supported, send Content-Length")
+        if "content-length" in headers:
+            try:
+                length = int(headers["content-length"])
+            except ValueError:
+                raise HTTPError(400, "Invalid Content-Length")
+            if length > self.max_body_size:
+                raise HTTPError(413, f"Request body larger than {self.max_body_size} bytes")
+            try:
+                body = await asyncio.wait_for(reader.readexactly(length), READ_TIMEOUT)
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                raise HTTPError(408, "Request body incomplete")
+        return method, target, headers, body
+
+    async def _write_response(self, writer, status, body, content_type, headers=None, keep_alive=True):
+        lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}",
+                 f"Content-Type: {content_type}",
+                 f"Content-Length: {len(body)}",
+                 "Connection: keep-alive" if keep_alive else "Connection: close"]
+        lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        # Sent in chunks, draining in between, so a slow client holds back
+        # this response only and large PDFs are not copied into one buffer
+        view = memoryview(body)
+        for start in range(0, len(view), WRITE_CHUNK_SIZE):
+            writer.write(view[start:start + WRITE_CHUNK_SIZE])
+            await writer.drain()
+        await writer.drain()
+        instrumentation.count(f"service.responses.{status}")
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    method, target, headers, body = request
+                    keep_alive = (headers.get("connection", "").lower() != "close"
+                                  and headers[":version"] == "HTTP/1.1")
+                    status, payload, content_type, extra = await self._dispatch(method, target, body)
+                except HTTPError as e:
+                    await self._write_response(writer, e.status, _json_body({"error": str(e)}),
+                                               "application/json", e.headers, keep_alive=False)
+                    break
+                except Exception:
+                    traceback.print_exc()
+                    await self._write_response(writer, 500, _json_body({"error": "Internal server error"}),
+                                               "application/json", keep_alive=False)
+                    break
+                await self._write_response(writer, status, payload, content_type, extra, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _dispatch(self, method, target, body):
+        url = urlsplit(target)
+        routes = {
+            "/render": ("POST", self._render_request),
+            "/health": ("GET", self._health),
+            "/metrics": ("GET", self._metrics),
+        }
+        if url.path not in routes:
+            raise HTTPError(404, f"No such endpoint: {url.path}")
+        allowed, handler = routes[url.path]
+        if method != allowed:
+            raise HTTPError(405, f"Use {allowed} for {url.path}", {"Allow": allowed})
+        return await handler(parse_qs(url.query), body)
+
+    # Endpoints
+
+    async def _health(self, query, body):
+        health = {
+            "status": "ok",
+            "workers": self.workers,
+            "active": self.active,
+            "queued": self.waiting,
+            "max_queue": self.max_queue,
+        }
+        return 200, _json_body(health), "application/json", None
+
+    async def _metrics(self, query, body):
+        prefix = instrumentation.PROMETHEUS_PREFIX
+        lines = [instrumentation.prometheus_text().rstrip("\n")]
+        for name, value, help_text in (("workers", self.workers, "Render worker processes."),
+                                       ("active_renders", self.active, "Renders running on the pool."),
+                                       ("queued_renders", self.waiting, "Renders waiting for a worker."),
+                                       ("max_queue", self.max_queue, "Queued renders before answering 429.")):
+            lines += [f"# HELP {prefix}_service_{name} {help_text}",
+                      f"# TYPE {prefix}_service_{name} gauge",
+                      f"{prefix}_service_{name} {value}"]
+        return 200, ("\n".join(lines) + "\n").encode(), "text/plain; version=0.0.4", None
+
+    async def _render_request(self, query, body):
+        try:
+            record = json.loads(body)
+            if not isinstance(record, dict):
+                raise ValueError("expected a JSON object")
+            job = job_from_record(record)
+        except Exception as e:
+            raise HTTPError(400, f"Invalid invoice: {e}")
+        profile = query.get("profile", [self.profile])[0]
+        if profile not in OUTPUT_PROFILES:
+            raise HTTPError(400, f"Unknown output profile: {profile!r}")
+        # Backpressure: refuse rather than queue without bound
+        if self.active + self.waiting >= self.workers + self.max_queue:
+            instrumentation.count("service.rejected")
+            raise HTTPError(429, "Too many renders queued, retry later", {"Retry-After": RETRY_AFTER})
+        pdf = await self.render(job, profile)
+        headers = {
+            "X-Invoice-Number": job.invoice.invoice_number,
+            "Content-Disposition": f'inline; filename="{job.invoice.invoice_number}.pdf"',
+        }
+        return 200, pdf, "application/pdf", headers
+
+    async def render(self, job, profile=None):
+        """Render a BatchJob on the pool and return the PDF bytes.
+
+        Allocates a number when the invoice has none and records the
+        invoice in the ledger. Raises HTTPError(500) if the render fails.
+        """
+        loop = asyncio.get_running_loop()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            allocated = None
+            if not job.invoice.invoice_number:
+                # The metadata lock blocks, keep it off the event loop
+                allocated = await loop.run_in_executor(None, allocate_invoice_numbers, 1)
+                job.invoice.invoice_number = allocated[0]
+            try:
+                with instrumentation.span("service.render", invoice=job.invoice.invoice_number):
+                    result, worker_data = await loop.run_in_executor(
+                        self._pool, _render_in_worker, job, profile or self.profile, self._worker_cache)
+            except BaseException:
+                # A crashed worker, a pickling error or a cancelled request;
+                # not awaited, a cancelled task must not wait for the lock
+                if allocated:
+                    loop.run_in_executor(None, release_invoice_numbers, allocated)
+                raise
+            if worker_data is not None:
+                instrumentation.merge(worker_data)
+            if not result.ok:
+                if allocated:
+                    await loop.run_in_executor(None, release_invoice_numbers, allocated)
+                sys.stderr.write(f"Invoice {result.invoice_number} failed:\n{result.error}\n")
+                raise HTTPError(500, result.error.strip().splitlines()[-1])
+            self._renders += 1
+            if self.cache is not None and self._renders % CACHE_TRIM_INTERVAL == 0:
+                loop.run_in_executor(None, self.cache.trim)
+            if self.ledger_path:
+                await loop.run_in_executor(None, record_invoice, job.invoice, job.language, job.include_vat,
+                                           job.include_note, None, self.ledger_path)
+            return result.pdf
+        finally:
+            self.active -= 1
+            self._slots.release()
+
+
+def _json_body(value):
+    return (json.dumps(value) + "\n").encode()
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, **options):
+    """Run a RenderService until cancelled."""
+    service = RenderService(**options)
+    await service.start(host, port)
+    bound_host, bound_port = service.address
+    print(f"Rendering invoices on http://{bound_host}:{bound_port}/ with {service.workers} workers", flush=True)
+    # Shut the pool down on SIGTERM too, not only on Ctrl+C
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass  # Windows
+    try:
+        await service.server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve invoice PDFs over HTTP on this machine.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"address to bind (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help=f"port to listen on, 0 for any free port (default: {DEFAULT_PORT})")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of render processes (default: number of CPUs)")
+    parser.add_argument("--max-queue", type=int, default=None,
+                        help="requests waiting for a worker before answering 429 (default: 4 per worker)")
+    parser.add_argument("--profile", choices=sorted(OUTPUT_PROFILES), default=DEFAULT_PROFILE,
+                        help=f"default PDF output profile (default: {DEFAULT_PROFILE})")
+    parser.add_argument("--cache", metavar="DIR", help="reuse PDFs of unchanged invoices from DIR")
+    parser.add_argument("--ledger", default=LEDGER_FILE, metavar="PATH",
+                        help=f"record the rendered invoices in this ledger (default: {LEDGER_FILE})")
+    parser.add_argument("--no-ledger", action="store_true", help="do not record the invoices in a ledger")
+    args = parser.parse_args(argv)
+    options = {
+        "workers": args.workers,
+        "max_queue": args.max_queue,
+        "profile": args.profile,
+        "cache": RenderCache(args.cache) if args.cache else None,
+        "ledger_path": None if args.no_ledger else args.ledger,
+    }
+    try:
+        asyncio.run(serve(args.host, args.port, **options))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
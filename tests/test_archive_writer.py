@@ -0,0 +1,28 @@
+from datetime import date
+
+from archive_writer import InvoiceArchive, read_manifest
+from invoice_model import Invoice, InvoiceItem
+
+
+def make_invoice(number):
+    return Invoice(number, date(2026, 1, 15), date(2026, 1, 30), {"company_name": "Me"},
+                   {"company_name": "Client"}, [InvoiceItem("Consulting", 50.0, 1, 22.0)])
+
+
+def test_manifest_totals_follow_the_vat_option(tmp_path):
+    path = str(tmp_path / "invoices.zip")
+    with InvoiceArchive(path) as archive:
+        archive.add(make_invoice("2026-001"), b"%PDF", include_vat=True)
+        archive.add(make_invoice("2026-002"), b"%PDF", include_vat=False)
+    with_vat, without_vat = read_manifest(path)
+    assert (with_vat["net_cents"], with_vat["vat_cents"], with_vat["gross_cents"]) == (5000, 1100, 6100)
+    assert (without_vat["net_cents"], without_vat["vat_cents"], without_vat["gross_cents"]) == (5000, 0, 5000)
+
+
+def test_append_skips_by_source_key(tmp_path):
+    path = str(tmp_path / "invoices.zip")
+    with InvoiceArchive(path) as archive:
+        archive.add(make_invoice("2026-001"), b"%PDF", key="abc")
+    with InvoiceArchive(path, append=True) as archive:
+        assert archive.existing_keys() == {"abc"}
+        assert archive.existing_numbers() == {"2026-001"}
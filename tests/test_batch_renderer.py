@@ -0,0 +1,24 @@
+import pytest
+
+from batch_renderer import job_from_record
+
+
+def record(quantity):
+    return {"invoice_number": "2026-001", "items": [{"description": "Work", "unit_price": 10, "quantity": quantity}]}
+
+
+@pytest.mark.parametrize("quantity", [3, "3", "3.0", " 3 "])
+def test_whole_quantities_are_accepted(quantity):
+    item, = job_from_record(record(quantity)).invoice.items
+    assert item.quantity == 3
+
+
+@pytest.mark.parametrize("quantity", ["1.5", 1.5, "abc", "inf"])
+def test_other_quantities_are_rejected(quantity):
+    with pytest.raises(ValueError, match="item 1: quantity"):
+        job_from_record(record(quantity))
+
+
+def test_missing_item_field_is_named():
+    with pytest.raises(ValueError, match="item 1 has no 'unit_price' field"):
+        job_from_record({"items": [{"description": "Work", "quantity": 1}]})
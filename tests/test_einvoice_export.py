@@ -0,0 +1,56 @@
+import io
+import json
+from datetime import date
+
+import pytest
+
+from einvoice_export import EInvoiceExport, write_json_invoice, write_ubl_invoice
+from invoice_model import Invoice, InvoiceItem
+
+
+def make_invoice(number="2026-001"):
+    items = [InvoiceItem("Consulting", 50.0, 1, 22.0), InvoiceItem("Support", 12.2, 1, 9.5)]
+    return Invoice(number, date(2026, 1, 15), date(2026, 1, 30), {"company_name": "Me"},
+                   {"company_name": "Client"}, items)
+
+
+def json_invoice(include_vat):
+    stream = io.BytesIO()
+    write_json_invoice(make_invoice(), stream, include_vat=include_vat)
+    return json.loads(stream.getvalue())
+
+
+def test_json_without_vat_has_one_tax_subtotal_like_ubl():
+    data = json_invoice(include_vat=False)
+    assert data["vat_breakdown"] == [{"vat_rate": "0.00", "tax_category": "O", "taxable": "62.20", "vat": "0.00"}]
+    assert (data["net"], data["vat"], data["payable"]) == ("62.20", "0.00", "62.20")
+    stream = io.BytesIO()
+    write_ubl_invoice(make_invoice(), stream, include_vat=False)
+    assert stream.getvalue().count(b"<cac:TaxSubtotal>") == 1
+
+
+def test_json_with_vat_has_a_tax_subtotal_per_rate():
+    data = json_invoice(include_vat=True)
+    assert [(entry["vat_rate"], entry["taxable"], entry["vat"]) for entry in data["vat_breakdown"]] == [
+        ("9.50", "12.20", "1.16"), ("22.00", "50.00", "11.00")]
+
+
+@pytest.mark.parametrize("extension", [".xml", ".jsonl"])
+def test_export_is_discarded_when_the_block_raises(tmp_path, extension):
+    path = tmp_path / ("export" + extension)
+    path.write_bytes(b"previous export")
+    with pytest.raises(RuntimeError):
+        with EInvoiceExport(str(path)) as export:
+            export.add(make_invoice())
+            raise RuntimeError("render failed")
+    assert path.read_bytes() == b"previous export"
+    assert [p.name for p in tmp_path.iterdir()] == [path.name]
+
+
+def test_export_is_written_when_the_block_succeeds(tmp_path):
+    path = tmp_path / "export.jsonl"
+    with EInvoiceExport(str(path)) as export:
+        export.add(make_invoice("2026-001"))
+        export.add(make_invoice("2026-002"))
+    numbers = [json.loads(line)["number"] for line in path.read_text().splitlines()]
+    assert numbers == ["2026-001", "2026-002"]
@@ -0,0 +1,52 @@
+from datetime import date
+
+import pytest
+
+pytest.importorskip("PyQt5")
+
+import gui_workers
+from invoice_metadata import allocate_invoice_numbers
+from invoice_model import Invoice, InvoiceItem
+
+
+def run_job(job):
+    events = []
+    job.signals.finished.connect(lambda number, warning: events.append(("finished", number, warning)))
+    job.signals.failed.connect(lambda message: events.append(("failed", message)))
+    job.signals.cancelled.connect(lambda: events.append(("cancelled",)))
+    job.run()
+    return events
+
+
+def make_job():
+    invoice = Invoice(None, date(2026, 1, 15), date(2026, 1, 30), {"company_name": "Me"},
+                      {"company_name": "Client"}, [InvoiceItem("Consulting", 50.0, 1, 22.0)])
+    return gui_workers.InvoiceRenderJob(invoice, "English", True, False)
+
+
+def test_ledger_failure_after_render_is_a_warning(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def record_invoice(*args):
+        raise OSError("database is locked")
+
+    monkeypatch.setattr(gui_workers, "record_invoice", record_invoice)
+    [(event, number, warning)] = run_job(make_job())
+    assert event == "finished"
+    assert "database is locked" in warning
+    # The PDF exists and its number stays used
+    assert any(path.suffix == ".pdf" for path in tmp_path.rglob("*"))
+    assert allocate_invoice_numbers(1)[0] != number
+
+
+def test_render_failure_releases_the_number(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def generate_invoice_pdf(*args, **kwargs):
+        raise ValueError("bad font")
+
+    import invoice_generator
+    monkeypatch.setattr(invoice_generator, "generate_invoice_pdf", generate_invoice_pdf)
+    job = make_job()
+    assert run_job(job) == [("failed", "bad font")]
+    assert allocate_invoice_numbers(1)[0] == job.invoice.invoice_number
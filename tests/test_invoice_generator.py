@@ -0,0 +1,48 @@
+import io
+from datetime import date
+
+import pytest
+
+from invoice_generator import draw_invoice, render_invoice
+from invoice_model import Invoice, InvoiceItem
+
+
+def make_invoice(lines):
+    items = [InvoiceItem("Work", 10, 1, 22.0 if i % 2 else 9.5) for i in range(lines)]
+    return Invoice("2026-077", date(2026, 1, 1), date(2026, 1, 15), {"company_name": "Me"},
+                   {"company_name": "Client"}, items)
+
+
+class RecordingCanvas:
+    """Collects the strings drawn on each page."""
+
+    def __init__(self):
+        self.pages = [[]]
+
+    def setFont(self, name, size):
+        pass
+
+    def drawString(self, x, y, text):
+        self.pages[-1].append(text)
+
+    drawRightString = drawString
+
+    def line(self, x1, y1, x2, y2):
+        pass
+
+    def showPage(self):
+        self.pages.append([])
+
+
+@pytest.mark.parametrize("include_vat, include_note", [(False, False), (True, False), (True, True)])
+def test_short_invoice_fits_on_one_page(include_vat, include_note):
+    report = render_invoice(make_invoice(11), io.BytesIO(), "English", include_vat, include_note)
+    assert report.pages == 1
+
+
+def test_totals_moved_to_a_new_page_get_the_invoice_number():
+    canvas = RecordingCanvas()
+    draw_invoice(canvas, make_invoice(20), "English", include_vat=True, include_note=True)
+    pages = [page for page in canvas.pages if page]
+    assert len(pages) == 2
+    assert pages[1][0] == "Invoice number: 2026-077"
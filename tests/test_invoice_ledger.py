@@ -0,0 +1,28 @@
+from datetime import date
+
+from invoice_ledger import InvoiceLedger
+from invoice_model import Invoice, InvoiceItem
+
+
+def make_invoice(number):
+    items = [InvoiceItem("Consulting", 50.0, 1, 22.0), InvoiceItem("Support", 12.2, 1, 9.5)]
+    return Invoice(number, date(2026, 1, 15), date(2026, 1, 30), {"company_name": "Me"},
+                   {"company_name": "Client", "vat_number": "SI123"}, items)
+
+
+def test_invoice_without_vat_records_no_vat(tmp_path):
+    with InvoiceLedger(str(tmp_path / "ledger.sqlite3")) as ledger:
+        ledger.record(make_invoice("2026-001"), "English", False, False, "2026-001.pdf")
+        row = ledger.get("2026-001")
+        assert (row["net_cents"], row["vat_cents"], row["gross_cents"]) == (6220, 0, 6220)
+        rates = {rate["vat_rate"]: (rate["net_cents"], rate["vat_cents"]) for rate in ledger.vat_by_rate()}
+        assert rates == {9.5: (1220, 0), 22.0: (5000, 0)}
+
+
+def test_invoice_with_vat_records_vat_per_rate(tmp_path):
+    with InvoiceLedger(str(tmp_path / "ledger.sqlite3")) as ledger:
+        ledger.record(make_invoice("2026-001"), "English", True, False, "2026-001.pdf")
+        row = ledger.get("2026-001")
+        assert (row["net_cents"], row["vat_cents"], row["gross_cents"]) == (6220, 1216, 7436)
+        rates = {rate["vat_rate"]: (rate["net_cents"], rate["vat_cents"]) for rate in ledger.vat_by_rate()}
+        assert rates == {9.5: (1220, 116), 22.0: (5000, 1100)}
@@ -0,0 +1,48 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from invoice_metadata import allocate_invoice_numbers, load_metadata, release_invoice_numbers
+
+WORKERS = 4
+ROUNDS = 25
+
+
+def allocate_in(directory, rounds):
+    """Allocate two numbers per round, keep the first and release the second."""
+    os.chdir(directory)
+    kept = []
+    for _ in range(rounds):
+        first, second = allocate_invoice_numbers(2)
+        kept.append(first)
+        if not release_invoice_numbers([second]):
+            kept.append(second)  # someone allocated after it, it stays used
+    return kept
+
+
+def test_processes_never_share_an_invoice_number(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with ProcessPoolExecutor(WORKERS) as pool:
+        results = list(pool.map(allocate_in, [str(tmp_path)] * WORKERS, [ROUNDS] * WORKERS))
+    numbers = [number for kept in results for number in kept]
+    assert len(numbers) == len(set(numbers))
+    sequences = sorted(int(number.rsplit("-", 1)[1]) for number in numbers)
+    # Released numbers were handed out again, so none were lost either
+    assert sequences == list(range(1, len(sequences) + 1))
+    assert load_metadata()["sequence"] == len(sequences)
+
+
+def test_released_tail_is_allocated_again(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    first = allocate_invoice_numbers(3)
+    assert release_invoice_numbers(first[1:])
+    assert allocate_invoice_numbers(2) == first[1:]
+
+
+def test_numbers_allocated_after_a_reservation_keep_it_used(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    failed = allocate_invoice_numbers(2)
+    later = allocate_invoice_numbers(1)
+    assert not release_invoice_numbers(failed)
+    assert allocate_invoice_numbers(1)[0] not in failed + later
+    assert load_metadata()["sequence"] == 4
+    assert release_invoice_numbers([]) is False
@@ -0,0 +1,79 @@
+import random
+from datetime import date
+
+import pytest
+
+import invoice_model
+from invoice_model import Invoice, InvoiceItem, ItemBatch
+
+
+def make_invoice(items):
+    return Invoice("2026-001", date(2026, 1, 15), date(2026, 1, 30), {}, {}, items)
+
+
+def test_totals_ignore_changes_to_the_callers_list():
+    items = [InvoiceItem("Consulting", 50.0, 1, 22.0)]
+    invoice = make_invoice(items)
+    assert invoice.total_net == 50.0
+    items.append(InvoiceItem("Support", 10.0, 1, 22.0))
+    assert len(invoice.items) == 1
+    assert invoice.total_net == 50.0
+
+
+def test_add_and_remove_item_keep_totals_current():
+    invoice = make_invoice([InvoiceItem("Consulting", 50.0, 1, 22.0)])
+    assert invoice.total_gross == 61.0
+    invoice.add_item(InvoiceItem("Support", 12.2, 1, 9.5))
+    assert invoice.totals_cents() == (6220, 1216)
+    removed = invoice.remove_item(0)
+    assert removed.description == "Consulting"
+    assert [item.description for item in invoice.items] == ["Support"]
+    assert invoice.totals_cents() == (1220, 116)
+
+
+@pytest.mark.parametrize("unit_price, quantity, net_cents", [
+    (0.125, 1, 13),
+    (-0.125, 1, -13),
+    (0.0125, 2, 3),
+    (0.0124, 2, 2),
+    (0.0001, 10000, 100),
+    (0.0004, 3, 0),
+    (0.0004, 13, 1),
+])
+def test_line_net_rounds_half_up_to_cents(unit_price, quantity, net_cents):
+    assert InvoiceItem("Usage", unit_price, quantity).net_cents == net_cents
+
+
+def test_line_vat_rounds_half_up_to_cents():
+    assert InvoiceItem("Usage", 0.5, 1, 1.0).vat_cents == 1
+    assert InvoiceItem("Usage", -0.5, 1, 1.0).vat_cents == -1
+    assert InvoiceItem("Usage", 0.49, 1, 1.0).vat_cents == 0
+
+
+def test_sub_cent_unit_price_is_kept_exactly():
+    item = InvoiceItem("Usage", 0.0001, 1)
+    assert item.price_units == 1
+    assert item.unit_price == 0.0001
+
+
+def test_unit_price_and_vat_rate_can_be_assigned():
+    item = InvoiceItem("Consulting", 50.0, 2, 22.0)
+    item.unit_price = 12.345
+    item.vat_rate = 9.5
+    assert (item.price_units, item.vat_bp) == (123450, 950)
+    assert (item.net_cents, item.vat_cents) == (2469, 235)
+
+
+def test_item_batch_totals_match_without_numpy(monkeypatch):
+    pytest.importorskip("numpy")
+    rng = random.Random(11)
+    batch = ItemBatch()
+    for _ in range(2000):
+        batch.append("Usage", rng.randint(-500000, 500000) / 10000, rng.randint(0, 1000),
+                     rng.choice([0.0, 5.0, 9.5, 22.0]))
+    with_numpy = batch.totals()
+    monkeypatch.setattr(invoice_model, "_numpy_module", None)
+    without_numpy = batch.totals()
+    assert without_numpy.by_rate == with_numpy.by_rate
+    assert (without_numpy.net_cents, without_numpy.vat_cents) == (with_numpy.net_cents, with_numpy.vat_cents)
+    assert without_numpy.by_rate == invoice_model.InvoiceTotals(batch).by_rate
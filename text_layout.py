@@ -0,0 +1,93 @@
+"""Text wrapping by rendered width.
+
+Widths come from reportlab's font metrics and are memoized: word widths
+and glyph widths per (font, size), and whole wrap results per
+(text, width, font, size). All three are bounded, so a long running
+process wrapping endless distinct IDs or URLs does not grow. Invoices
+that reuse the same service descriptions only pay for measuring them
+once per process.
+
+The fonts must be registered with reportlab before wrapping.
+"""
+from functools import lru_cache
+
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+WRAP_CACHE_SIZE = 8192
+# Entries per (font, size); a full table is cleared, common words come
+# back after a few lookups
+WIDTH_CACHE_SIZE = 65536
+
+_word_widths = {}   # (font_name, font_size) -> {word: width}
+_glyph_widths = {}  # (font_name, font_size) -> {character: width}
+
+
+def word_width(word, font_name, font_size):
+    widths = _word_widths.setdefault((font_name, font_size), {})
+    width = widths.get(word)
+    if width is None:
+        if len(widths) >= WIDTH_CACHE_SIZE:
+            widths.clear()
+        width = widths[word] = stringWidth(word, font_name, font_size)
+    return width
+
+
+def _glyph_width(char, font_name, font_size):
+    widths = _glyph_widths.setdefault((font_name, font_size), {})
+    width = widths.get(char)
+    if width is None:
+        if len(widths) >= WIDTH_CACHE_SIZE:
+            widths.clear()
+        width = widths[char] = stringWidth(char, font_name, font_size)
+    return width
+
+
+def _split_long_word(word, max_width, font_name, font_size):
+    """Break a word wider than max_width between glyphs."""
+    pieces = []
+    piece = ""
+    piece_width = 0.0
+    for char in word:
+        char_width = _glyph_width(char, font_name, font_size)
+        if piece and piece_width + char_width > max_width:
+            pieces.append(piece)
+            piece = ""
+            piece_width = 0.0
+        piece += char
+        piece_width += char_width
+    if piece:
+        pieces.append(piece)
+    return pieces
+
+
+@lru_cache(maxsize=WRAP_CACHE_SIZE)
+def wrap_text(text, max_width, font_name="DejaVu", font_size=10):
+    """Wrap text into lines no wider than max_width points.
+
+    Returns a tuple of lines, at least one (possibly empty).
+    """
+    space_width = word_width(" ", font_name, font_size)
+    lines = []
+    line = ""
+    line_width = 0.0
+    for word in text.split():
+        width = word_width(word, font_name, font_size)
+        if width > max_width:
+            pieces = _split_long_word(word, max_width, font_name, font_size)
+            if line:
+                lines.append(line)
+            lines.extend(pieces[:-1])
+            line = pieces[-1]
+            line_width = word_width(line, font_name, font_size)
+        elif not line:
+            line = word
+            line_width = width
+        elif line_width + space_width + width <= max_width:
+            line += " " + word
+            line_width += space_width + width
+        else:
+            lines.append(line)
+            line = word
+            line_width = width
+    lines.append(line)
+    return tuple(lines)